@@ -1,4 +1,5 @@
 from ai.gemini_client import gemini_call
+from utils.scoring import DQI_CRITICAL, DQI_WARNING
 import pandas as pd
 
 
@@ -12,7 +13,7 @@ def generate_agent_recommendations(df: pd.DataFrame) -> str:
     avg_dqi = df["dqi"].mean()
 
     # Define alerts as low DQI records
-    alert_count = (df["dqi"] < 40).sum()
+    alert_count = (df["dqi"] < DQI_CRITICAL).sum()
 
     # Identify heavy operational load using numeric columns
     numeric_cols = df.select_dtypes(include="number").columns.tolist()
@@ -20,22 +21,24 @@ def generate_agent_recommendations(df: pd.DataFrame) -> str:
 
     high_load = False
     if operational_cols:
-        load_score = df[operational_cols].sum(axis=1).mean()
-        high_load = load_score > df[operational_cols].mean().mean()
+        # Counts may be nullable small ints; compare as plain floats
+        operational = df[operational_cols].astype("float64")
+        load_score = operational.sum(axis=1).mean()
+        high_load = load_score > operational.mean().mean()
 
     # -------------------------------
     # RULE ENGINE
     # -------------------------------
     rules = []
 
-    if avg_dqi < 60:
+    if avg_dqi < DQI_WARNING:
         rules.append(
             "Average Data Quality Index is below acceptable threshold, indicating systemic site-level quality risk."
         )
 
     if alert_count > 0:
         rules.append(
-            f"{alert_count} subjects exhibit critically low DQI (<40), requiring immediate corrective action."
+            f"{alert_count} subjects exhibit critically low DQI (<{DQI_CRITICAL}), requiring immediate corrective action."
         )
 
     if high_load:
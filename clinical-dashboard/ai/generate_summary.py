@@ -1,43 +1,49 @@
 from ai.gemini_client import gemini_call
+from utils.scoring import DQI_WARNING, site_severity
 import pandas as pd
 
 
-def compute_ai_metrics(df: pd.DataFrame) -> dict:
+def compute_ai_metrics(df: pd.DataFrame, site_rollup: pd.DataFrame = None) -> dict:
     """
     Compute compact, AI-oriented diagnostics from FULL filtered data.
+    site_rollup: optional per-site aggregates (dqi_mean, patients) for the
+    same view, e.g. from the dashboard's cube, to skip the groupby.
     """
 
-    site_summary = (
-        df.groupby("site_id")
-        .agg(
-            avg_dqi=("dqi", "mean"),
-            patients=("patient_id", "nunique"),
+    if site_rollup is not None:
+        site_summary = (
+            site_rollup[["dqi_mean", "patients"]]
+            .rename(columns={"dqi_mean": "avg_dqi"})
+            .reset_index()
+        )
+    else:
+        site_summary = (
+            df.groupby("site_id", observed=True)
+            .agg(
+                avg_dqi=("dqi", "mean"),
+                patients=("patient_id", "nunique"),
+            )
+            .reset_index()
         )
-        .reset_index()
-    )
 
     # ---- Risk Fingerprint (top 5 risky sites) ----
     top_risk = site_summary.sort_values("avg_dqi").head(5)
 
-    risk_fingerprint = []
-    for _, row in top_risk.iterrows():
-        risk_fingerprint.append({
-            "site_id": row["site_id"],
-            "low_dqi": row["avg_dqi"] < 50,
-            "high_load": row["patients"] >= 3,
-            "severity": round(
-                (50 - row["avg_dqi"]) + (row["patients"] * 2), 1
-            )
-        })
+    risk_fingerprint = pd.DataFrame({
+        "site_id": top_risk["site_id"],
+        "low_dqi": top_risk["avg_dqi"] < 50,
+        "high_load": top_risk["patients"] >= 3,
+        "severity": site_severity(top_risk["avg_dqi"], top_risk["patients"], dqi_target=50).round(1),
+    }).to_dict(orient="records")
 
     # ---- Confidence Meter (0–100) ----
-    critical_pct = (df["dqi"] < 60).mean()
+    critical_pct = (df["dqi"] < DQI_WARNING).mean()
     confidence_score = int(max(0, 100 * (1 - critical_pct)))
 
     # ---- Action Priority Stack ----
     action_stack = (
         site_summary
-        .assign(severity=lambda x: (60 - x["avg_dqi"]) + (x["patients"] * 2))
+        .assign(severity=lambda x: site_severity(x["avg_dqi"], x["patients"]))
         .sort_values("severity", ascending=False)
         .head(5)[["site_id", "avg_dqi", "patients", "severity"]]
         .round(2)
@@ -55,7 +61,7 @@ def compute_ai_metrics(df: pd.DataFrame) -> dict:
     }
 
 
-def generate_site_summary(df: pd.DataFrame) -> dict:
+def generate_site_summary(df: pd.DataFrame, site_rollup: pd.DataFrame = None) -> dict:
     """
     Returns AI diagnostics + Gemini narrative.
     """
@@ -66,7 +72,7 @@ def generate_site_summary(df: pd.DataFrame) -> dict:
             "narrative": "No data available for the selected filters."
         }
 
-    metrics = compute_ai_metrics(df)
+    metrics = compute_ai_metrics(df, site_rollup)
 
     prompt = f"""
 You are a Senior Clinical Trial Risk Analyst.
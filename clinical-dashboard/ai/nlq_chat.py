@@ -1,9 +1,10 @@
 import streamlit as st
 import pandas as pd
 from ai.gemini_client import gemini_call
+from utils.scoring import DQI_CRITICAL, DQI_WARNING
 
 
-def nlq_interface(df: pd.DataFrame):
+def nlq_interface(df: pd.DataFrame, site_dqi: pd.Series = None):
     st.markdown("<h2>💬 Natural Language Query</h2>", unsafe_allow_html=True)
     st.caption("Ask questions over the current analytical snapshot")
     
@@ -28,6 +29,9 @@ def nlq_interface(df: pd.DataFrame):
             st.session_state.show_answer = False
             return
         
+        # Per-site DQI: pre-aggregated by the caller when available
+        site_means = site_dqi if site_dqi is not None else df.groupby("site_id", observed=True)["dqi"].mean()
+        
         # Create snapshot
         snapshot = {
             "scope": {
@@ -38,21 +42,19 @@ def nlq_interface(df: pd.DataFrame):
             "data_quality": {
                 "average_dqi": round(df["dqi"].mean(), 2),
                 "median_dqi": round(df["dqi"].median(), 2),
-                "critical_patients": int((df["dqi"] < 40).sum()),
-                "low_dqi_patients": int((df["dqi"] < 60).sum())
+                "critical_patients": int((df["dqi"] < DQI_CRITICAL).sum()),
+                "low_dqi_patients": int((df["dqi"] < DQI_WARNING).sum())
             },
             "site_patterns": {
                 "lowest_dqi_sites": (
-                    df.groupby("site_id")["dqi"]
-                    .mean()
+                    site_means
                     .sort_values()
                     .head(5)
                     .round(2)
                     .to_dict()
                 ),
                 "highest_dqi_sites": (
-                    df.groupby("site_id")["dqi"]
-                    .mean()
+                    site_means
                     .sort_values(ascending=False)
                     .head(5)
                     .round(2)
@@ -3,6 +3,7 @@ import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
 import numpy as np
+import threading
 from pathlib import Path
 from datetime import datetime, timedelta
 from textwrap import dedent
@@ -10,6 +11,44 @@ from textwrap import dedent
 from ai.generate_summary import generate_site_summary
 from ai.agent_recommender import generate_agent_recommendations
 from ai.nlq_chat import nlq_interface
+from qc_pipeline.master_store import read_master_version
+from utils.cube import AggregateCube
+from utils.data_loader import (
+    DATASET_DIRNAME,
+    NUMERIC_COLS,
+    IncrementalReader,
+    compact_master,
+    ds,
+    filter_frame,
+    partition_filters,
+    read_csv_sample,
+    read_manifest,
+    read_master_csv,
+    read_store_sample,
+)
+from utils.exports import EXPORT_FORMATS, ExportCache, export_bytes
+from utils.dqi_sweep import SWEEP_LEVELS, DQISweep, build_sweeps
+from utils.estimates import SAMPLE_PER_SITE, sample_sizes, site_sample, stratified_mean, stratified_ratio
+from utils.figure_cache import FigureCache
+from utils.filter_index import (
+    FILTER_DIMENSIONS,
+    FilterHierarchy,
+    FilterIndex,
+    PatientSearch,
+    sort_for_filtering,
+)
+from utils.memory import enable_copy_on_write, memory_report, peak_rss_mb, read_only
+from utils.paged_table import paged_dataframe, paged_table
+from utils.query_join import link_queries, queries_in_scope
+from utils.scoring import (
+    dqi_status,
+    priority_levels,
+    priority_scores,
+    site_observation,
+)
+
+# Cached frames are shared between sessions; derived frames copy on write
+enable_copy_on_write()
 
 # =========================
 # PAGE CONFIG
@@ -427,92 +466,87 @@ st.markdown("""
 # =========================
 # DATA LOADING & CLEANING
 # =========================
-@st.cache_data(ttl=600)
-def load_data():
-    BASE_DIR = Path(__file__).parent
-    DATA_PATH = BASE_DIR / "data" / "master_dataset.csv"
-    QUERIES_PATH = BASE_DIR / "data" / "queries.csv"
-    
-    # Load main dataset
+BASE_DIR = Path(__file__).parent
+DATA_PATH = BASE_DIR / "data" / "master_dataset.csv"
+QUERIES_PATH = BASE_DIR / "data" / "queries.csv"
+PATIENT_PAGE_SIZE = 50
+DEFAULT_CRITICAL_THRESHOLD = 40
+DEFAULT_HIGH_PERF_THRESHOLD = 50
+DATASET_DIR = BASE_DIR / "data" / DATASET_DIRNAME
+
+def data_version():
+    """
+    Cache key for everything loaded from data/. The master part is the
+    version the pipeline bumps when it commits (Stage 7); file stats cover
+    queries.csv and masters written without a version file. Cached entries
+    for older versions simply stop being requested - there is no TTL.
+    """
+    version = [read_master_version(DATA_PATH)]
+    for path in (DATA_PATH, QUERIES_PATH):
+        if path.exists():
+            stat = path.stat()
+            version.append((stat.st_mtime_ns, stat.st_size))
+        else:
+            version.append(None)
+    return tuple(version)
+
+def current_manifest():
+    """Manifest of the partitioned copy, or None if it lags the master CSV."""
+    if ds is None:
+        return None
+    manifest = read_manifest(DATASET_DIR)
+    if manifest is None or manifest.get("version") != read_master_version(DATA_PATH):
+        return None
+    return manifest
+
+@st.cache_resource
+def partition_reader():
+    # Shared by all sessions: after a new upload only the new part files are read
+    return IncrementalReader(DATASET_DIR)
+
+@st.cache_data(max_entries=4)
+def load_master_csv(version=None, columns=None):
+    # Fallback when there is no up-to-date partitioned copy. Served from the
+    # typed Feather sidecar; the CSV is only parsed again after it changes.
     if not DATA_PATH.exists():
         st.error(f"Dataset not found at {DATA_PATH}")
         st.stop()
     
-    df = pd.read_csv(DATA_PATH, low_memory=False)
-
-    # Standardize column names
-    df.columns = (
-        df.columns
-        .str.strip()
-        .str.lower()
-        .str.replace(" ", "_")
-    )
-    
-    # Column mapping
-    COLUMN_MAP = {
-        "project_name_|_unnamed:_0_level_1_|_unnamed:_0_level_2_|_responsible_lf_for_action": "study",
-        "region_|_unnamed:_1_level_1_|_unnamed:_1_level_2_|_unnamed:_1_level_3": "region",
-        "country_|_unnamed:_2_level_1_|_unnamed:_2_level_2_|_unnamed:_2_level_3": "country",
-        "site_id_|_unnamed:_3_level_1_|_unnamed:_3_level_2_|_unnamed:_3_level_3": "site_id",
-        "subject_id_|_unnamed:_4_level_1_|_unnamed:_4_level_2_|_unnamed:_4_level_3": "patient_id",
-        "latest_visit_(sv)_(source:_rave_edc:_bo4)_|_unnamed:_5_level_1_|_unnamed:_5_level_2_|_unnamed:_5_level_3": "latest_visit",
-        "subject_status_(source:_primary_form)_|_unnamed:_6_level_1_|_unnamed:_6_level_2_|_unnamed:_6_level_3": "subject_status",
-        "input_files_|_missing_visits_|_unnamed:_7_level_2_|_unnamed:_7_level_3": "missing_visits",
-        "input_files_|_missing_page_|_unnamed:_8_level_2_|_unnamed:_8_level_3": "missing_pages",
-        "input_files_|_#_coded_terms_|_unnamed:_9_level_2_|_unnamed:_9_level_3": "coded_terms",
-        "input_files_|_#_uncoded_terms_|_unnamed:_10_level_2_|_unnamed:_10_level_3": "uncoded_terms",
-        "input_files_|_#_open_issues_in_lnr_|_unnamed:_11_level_2_|_unnamed:_11_level_3": "open_lnr_issues",
-        "input_files_|_#_open_issues_reported_for_3rd_party_reconciliation_in_edrr_|_unnamed:_12_level_2_|_unnamed:_12_level_3": "open_edrr_issues",
-        "input_files_|_inactivated_forms_and_folders_|_unnamed:_13_level_2_|_unnamed:_13_level_3": "inactivated_forms",
-        "input_files_|_#_esae_dashboard_review_for_dm_|_unnamed:_14_level_2_|_unnamed:_14_level_3": "esae_dm_reviews",
-        "input_files_|_#_esae_dashboard_review_for_safety_|_unnamed:_15_level_2_|_unnamed:_15_level_3": "esae_safety_reviews",
-        "cpmd_|_visit_status_|_#_expected_visits_(rave_edc_:_bo4)_|_unnamed:_16_level_3": "expected_visits",
-        "cpmd_|_page_status_(source:_(rave_edc_:_bo4))_|_#_pages_entered_|_unnamed:_17_level_3": "pages_entered",
-        "cpmd_|_page_status_(source:_(rave_edc_:_bo4))_|_#_pages_with_non-conformant_data_|_site/cra": "non_conformant_pages",
-        "cpmd_|_page_status_(source:_(rave_edc_:_bo4))_|_#_total_crfs_with_queries_&_non-conformant_data_|_unnamed:_19_level_3": "crfs_with_queries",
-        "cpmd_|_page_status_(source:_(rave_edc_:_bo4))_|_#_total_crfs_without_queries_&_non-conformant_data_|_unnamed:_20_level_3": "crfs_without_queries",
-        "cpmd_|_page_status_(source:_(rave_edc_:_bo4))_|_%_clean_entered_crf_|_unnamed:_21_level_3": "clean_crf_percent",
-        "cpmd_|_queries_status_(source:(rave_edc_:_bo4))_|_#_dm_queries_|_dm": "dm_queries",
-        "cpmd_|_queries_status_(source:(rave_edc_:_bo4))_|_#_clinical_queries_|_cse/cdd": "clinical_queries",
-        "cpmd_|_queries_status_(source:(rave_edc_:_bo4))_|_#_medical_queries_|_cdmd/medical_lead": "medical_queries",
-        "cpmd_|_queries_status_(source:(rave_edc_:_bo4))_|_#_site_queries_|_site/cra": "site_queries",
-        "cpmd_|_queries_status_(source:(rave_edc_:_bo4))_|_#_field_monitor_queries_|_cra": "field_monitor_queries",
-        "cpmd_|_queries_status_(source:(rave_edc_:_bo4))_|_#_coding_queries_|_coder": "coding_queries",
-        "cpmd_|_queries_status_(source:(rave_edc_:_bo4))_|_#_safety_queries_|_safety_team": "safety_queries",
-        "cpmd_|_queries_status_(source:(rave_edc_:_bo4))_|_#total_queries_|_unnamed:_29_level_3": "total_queries",
-        "cpmd_|_page_action_status_(source:_(rave_edc_:_bo4))_|_#_crfs_require_verification_(sdv)_|_cra": "crfs_require_sdv",
-        "cpmd_|_page_action_status_(source:_(rave_edc_:_bo4))_|_#_forms_verified_|_unnamed:_31_level_3": "forms_verified",
-        "cpmd_|_page_action_status_(source:_(rave_edc_:_bo4))_|_#_crfs_frozen_|_unnamed:_32_level_3": "crfs_frozen",
-        "cpmd_|_page_action_status_(source:_(rave_edc_:_bo4))_|_#_crfs_not_frozen_|_dm": "crfs_not_frozen",
-        "cpmd_|_page_action_status_(source:_(rave_edc_:_bo4))_|_#_crfs_locked_|_unnamed:_34_level_3": "crfs_locked",
-        "cpmd_|_page_action_status_(source:_(rave_edc_:_bo4))_|_#_crfs_unlocked_|_unnamed:_35_level_3": "crfs_unlocked",
-        "cpmd_|_protocol_deviations_(source:(rave_edc_:_bo4))_|_#_pds_confirmed_|_cd_lf": "pds_confirmed",
-        "cpmd_|_protocol_deviations_(source:(rave_edc_:_bo4))_|_#_pds_proposed_|_unnamed:_37_level_3": "pds_proposed",
-        "ssm_|_pi_signatures_(source:_(rave_edc_:_bo4))_|_#_crfs_signed_|_investigator": "crfs_signed",
-        "ssm_|_pi_signatures_(source:_(rave_edc_:_bo4))_|_crfs_overdue_for_signs_within_45_days_of_data_entry_|_unnamed:_39_level_3": "signs_overdue_45",
-        "ssm_|_pi_signatures_(source:_(rave_edc_:_bo4))_|_crfs_overdue_for_signs_between_45_to_90_days_of_data_entry_|_unnamed:_40_level_3": "signs_overdue_90",
-        "ssm_|_pi_signatures_(source:_(rave_edc_:_bo4))_|_crfs_overdue_for_signs_beyond_90_days_of_data_entry_|_unnamed:_41_level_3": "signs_overdue_90_plus",
-        "ssm_|_pi_signatures_(source:_(rave_edc_:_bo4))_|_broken_signatures_|_unnamed:_42_level_3": "broken_signatures",
-        "ssm_|_pi_signatures_(source:_(rave_edc_:_bo4))_|_crfs_never_signed_|_unnamed:_43_level_3": "crfs_never_signed",
-        "dqi": "dqi"
-    }
-
-    # Apply mapping safely
-    df = df.rename(columns={k: v for k, v in COLUMN_MAP.items() if k in df.columns})
-    
-    # Convert numeric columns
-    numeric_cols = ['missing_visits', 'missing_pages', 'expected_visits', 'pages_entered', 
-                    'non_conformant_pages', 'total_queries', 'dm_queries', 'clinical_queries',
-                    'medical_queries', 'site_queries', 'field_monitor_queries', 'coding_queries',
-                    'safety_queries', 'crfs_require_sdv', 'forms_verified', 'crfs_frozen',
-                    'crfs_not_frozen', 'crfs_locked', 'crfs_unlocked', 'pds_confirmed',
-                    'pds_proposed', 'crfs_signed', 'signs_overdue_45', 'signs_overdue_90',
-                    'signs_overdue_90_plus', 'broken_signatures', 'crfs_never_signed', 'dqi']
-    
-    for col in numeric_cols:
-        if col in df.columns:
-            df[col] = pd.to_numeric(df[col], errors='coerce')
-    
+    return read_master_csv(DATA_PATH, columns)
+
+def load_dimensions(version=None):
+    """Region/country/site/patient columns only, without loading the metrics."""
+    manifest = current_manifest()
+    if manifest is not None:
+        return partition_reader().read(manifest, columns=FILTER_DIMENSIONS)
+    return load_master_csv(version, FILTER_DIMENSIONS)
+
+@st.cache_resource(max_entries=2)
+def load_hierarchy(version=None):
+    # Built once per data version, shared by every session
+    return FilterHierarchy(load_dimensions(version))
+
+@st.cache_resource(max_entries=16)
+def load_patient_search(version=None, region="All", country="All", site="All"):
+    """Search index over the patients under the current region/country/site."""
+    return PatientSearch(load_hierarchy(version).options(region, country, site))
+
+def read_master(version=None, region="All", country="All", site="All"):
+    """Master rows for a region/country/site selection, as stored (strings, float64)."""
+    filters = partition_filters(region, country, site)
+    
+    # Load main dataset - only the partitions / row groups the filters need
+    manifest = current_manifest()
+    if manifest is not None:
+        return partition_reader().read(manifest, filters)
+    return filter_frame(load_master_csv(version), filters)
+
+def load_data(version=None, region="All", country="All", site="All"):
+    # Categorical dimensions, small-int counts, float32 percentages
+    return compact_master(read_master(version, region, country, site)), load_queries(version)
+
+@st.cache_data(max_entries=2)
+def load_queries(version=None):
     # Load queries dataset
     queries_df = None
     if QUERIES_PATH.exists():
@@ -552,48 +586,53 @@ def load_data():
     else:
         st.warning(f"Queries dataset not found at {QUERIES_PATH}")
     
-    return df, queries_df
+    return queries_df
 
 # =========================
 # CALCULATION FUNCTIONS
 # =========================
 def calculate_metrics(df, queries_df):
-    """Calculate all derived metrics"""
+    """Calculate all derived metrics. Returns a new frame; df is not modified."""
+    derived = {}
+
+    # Counts are held as nullable small ints (compact_master); derive from
+    # float64 copies so the metrics are plain floats and sums cannot overflow
+    values = df[[col for col in NUMERIC_COLS if col in df.columns]].astype("float64")
     
     # Patient Clean Status
-    df['clean_patient'] = (
+    derived['clean_patient'] = (
     # Completeness
-    (df['missing_visits'].fillna(0) == 0) &
-    (df['missing_pages'].fillna(0) == 0) &
+    (values['missing_visits'].fillna(0) == 0) &
+    (values['missing_pages'].fillna(0) == 0) &
     
     # Verification: nothing pending
-    (df['crfs_require_sdv'].fillna(0) == 0) &
+    (values['crfs_require_sdv'].fillna(0) == 0) &
     
     # Signatures: nothing missing or broken
-    (df['crfs_never_signed'].fillna(0) == 0) &
-    (df['broken_signatures'].fillna(0) == 0) 
+    (values['crfs_never_signed'].fillna(0) == 0) &
+    (values['broken_signatures'].fillna(0) == 0) 
     
     
 ).astype(int)
 
     
     # Percentages
-    df['missing_visits_pct'] = (df['missing_visits'].fillna(0) / df['expected_visits']) * 100
-    df['missing_pages_pct'] = (df['missing_pages'].fillna(0) / df['pages_entered']) * 100
-    df['non_conformant_pct'] = (df['non_conformant_pages'].fillna(0) / df['pages_entered'].replace(0, 1)) * 100
-    total_verified = df['forms_verified'].sum()
+    derived['missing_visits_pct'] = (values['missing_visits'].fillna(0) / values['expected_visits']) * 100
+    derived['missing_pages_pct'] = (values['missing_pages'].fillna(0) / values['pages_entered']) * 100
+    derived['non_conformant_pct'] = (values['non_conformant_pages'].fillna(0) / values['pages_entered'].replace(0, 1)) * 100
+    total_verified = values['forms_verified'].sum()
     total_sdv_population = (
-    df['forms_verified'] + df['crfs_require_sdv']
+    values['forms_verified'] + values['crfs_require_sdv']
     ).sum()
 
     verification_pct = (
     total_verified / total_sdv_population * 100
     if total_sdv_population > 0 else np.nan
 )
-    df['verification_pct'] = verification_pct
+    derived['verification_pct'] = verification_pct
 
 
-    df['signature_pct'] = (df['crfs_signed'].fillna(0) / (df['crfs_signed'] + df['crfs_never_signed']).replace(0, 1)) * 100
+    derived['signature_pct'] = (values['crfs_signed'].fillna(0) / (values['crfs_signed'] + values['crfs_never_signed']).replace(0, 1)) * 100
     
     # Query metrics from queries dataset
     if queries_df is not None and 'open_queries' in queries_df.columns and 'closed_queries' in queries_df.columns:
@@ -609,31 +648,157 @@ def calculate_metrics(df, queries_df):
         avg_resolution_days = queries_df['avg_resolution_days'].mean() if 'avg_resolution_days' in queries_df.columns else 0
         
         # Add to df for consistency (these will be used in visualizations)
-        df['total_queries_from_csv'] = total_queries
-        df['open_queries_from_csv'] = total_open_queries
-        df['closed_queries_from_csv'] = total_closed_queries
-        df['query_resolution_rate'] = query_resolution_rate
-        df['avg_resolution_days'] = avg_resolution_days
+        derived['total_queries_from_csv'] = total_queries
+        derived['open_queries_from_csv'] = total_open_queries
+        derived['closed_queries_from_csv'] = total_closed_queries
+        derived['query_resolution_rate'] = query_resolution_rate
+        derived['avg_resolution_days'] = avg_resolution_days
         
         # Calculate query-related percentages per site (if patient_id can be mapped to site_id)
         # For now, we'll add these as global metrics
         print(f"Query metrics: Open={total_open_queries}, Closed={total_closed_queries}, Rate={query_resolution_rate:.1f}%, Avg Days={avg_resolution_days:.1f}")
     else:
         # Fallback to original calculation if queries dataset not available
-        total_queries = df['total_queries'].sum()
-        df['query_resolution_rate'] = 100 - (df['total_queries'].fillna(0) / (df['total_queries'] + 10).replace(0, 1)) * 100
-        df['avg_resolution_days'] = 0  # Not available in original dataset
+        total_queries = values['total_queries'].sum()
+        derived['query_resolution_rate'] = 100 - (values['total_queries'].fillna(0) / (values['total_queries'] + 10).replace(0, 1)) * 100
+        derived['avg_resolution_days'] = 0  # Not available in original dataset
     
     # Data readiness score (composite)
-    df['data_readiness_score'] = (
-        df['clean_crf_percent'].fillna(0) * 0.3 +
-        df['query_resolution_rate'].fillna(0) * 0.2 +
-        (100 - df['missing_visits_pct'].fillna(0)) * 0.2 +
-        df['verification_pct'].fillna(0) * 0.15 +
-        df['signature_pct'].fillna(0) * 0.15
+    derived['data_readiness_score'] = (
+        values['clean_crf_percent'].fillna(0) * 0.3 +
+        pd.Series(derived['query_resolution_rate'], index=values.index).fillna(0) * 0.2 +
+        (100 - derived['missing_visits_pct'].fillna(0)) * 0.2 +
+        pd.Series(verification_pct, index=values.index).fillna(0) * 0.15 +
+        derived['signature_pct'].fillna(0) * 0.15
     )
     
-    return df, queries_df
+    return df.assign(**derived), queries_df
+
+@st.cache_resource(max_entries=8)
+def load_analytics(version=None, region="All", country="All", site="All"):
+    """
+    Loaded data plus derived metrics for a region/country/site selection,
+    computed once per data version and selection. Only the partitions and
+    row groups the selection needs are read; "All" loads the portfolio.
+    version is only used as part of the cache key. Rows are ordered for
+    FilterIndex.
+
+    Held once per process and shared by every session (cache_data would
+    unpickle a private copy per call). The frames are read-only: derive new
+    frames from them, never write into them.
+    """
+    df, queries_df = load_data(version, region, country, site)
+    df, queries_df = calculate_metrics(df, queries_df)
+    if queries_df is not None:
+        queries_df = read_only(queries_df)
+    return read_only(sort_for_filtering(df)), queries_df
+
+@st.cache_resource(max_entries=2)
+def load_query_links(version=None):
+    # queries.csv subjects joined to their master patient/site, once per
+    # version. Joined on the dimensions alone, so a subject split across
+    # sites keeps the same weights whatever selection is loaded.
+    return link_queries(load_dimensions(version), load_queries(version))
+
+@st.cache_resource(max_entries=8)
+def load_cube(version=None, region="All", country="All", site="All"):
+    # Site/country/region aggregates of one loaded selection
+    df, _ = load_analytics(version, region, country, site)
+    return AggregateCube(df, load_query_links(version))
+
+@st.cache_resource(max_entries=8)
+def load_filter_index(version=None, region="All", country="All", site="All"):
+    # Same row order as load_analytics(version, region, country, site), so positions line up
+    df, _ = load_analytics(version, region, country, site)
+    return FilterIndex(df)
+
+@st.cache_resource(max_entries=16)
+def load_dqi_sweeps(version=None, region="All", country="All", site="All", patient="All"):
+    """
+    Sorted country/site/patient DQI means of one filter scope, once per
+    data version, so the threshold sliders only look counts up.
+    """
+    df_scope, _ = load_analytics(version, region, country, site)
+    df = load_filter_index(version, region, country, site).apply(df_scope, {
+        "region": region, "country": country, "site_id": site, "patient_id": patient,
+    })
+    patient_dqi = df.groupby("patient_id", sort=False, observed=True)["dqi"].mean()
+    if patient != "All":
+        # A single patient's rows are few enough to aggregate directly
+        return build_sweeps(
+            df.groupby("country", sort=False, observed=True)["dqi"].mean(),
+            df.groupby("site_id", sort=False, observed=True)["dqi"].mean(),
+            patient_dqi
+        )
+    selection = {"region": region, "country": country, "site_id": site}
+    cube = load_cube(version, region, country, site)
+    return build_sweeps(
+        cube.rollup("country", selection)["dqi_mean"],
+        cube.rollup("site_id", selection)["dqi_mean"],
+        patient_dqi
+    )
+
+def read_site_sample(version=None, region="All", country="All", site="All"):
+    """
+    Stored per-site sample of a region/country/site selection. Only when
+    none is stored for this version (store published before samples were
+    kept, CSV changed since its sidecar) is the master read and sampled.
+    """
+    manifest = current_manifest()
+    if manifest is not None:
+        sample = read_store_sample(DATASET_DIR, manifest)
+    else:
+        sample = read_csv_sample(DATA_PATH) if DATA_PATH.exists() else None
+
+    if sample is None:
+        return site_sample(read_master(version, region, country, site))
+    return filter_frame(sample, partition_filters(region, country, site))
+
+@st.cache_resource(max_entries=8)
+def load_preview(version=None, region="All", country="All", site="All"):
+    """
+    Stratified per-site sample of a selection with its derived metrics, the
+    rows per site and the patient count (summed per site, so an upper
+    bound), for the first paint.
+    """
+    sample = read_site_sample(version, region, country, site)
+    sizes, total_patients = sample_sizes(sample)
+    sample, _ = calculate_metrics(sample, load_queries(version))
+    return sample, sizes, total_patients
+
+@st.cache_resource(max_entries=8)
+def build_exact(version=None, region="All", country="All", site="All"):
+    """
+    Start building the caches the exact dashboard needs for a data version
+    and region/country/site selection in a background thread, once per
+    selection, so the preview paints without waiting for them. The
+    script's own calls join the build in progress.
+    """
+    def build():
+        load_hierarchy(version)
+        load_cube(version, region, country, site)
+        load_filter_index(version, region, country, site)
+        print(f"✅ Exact caches built for {region}/{country}/{site}, data version {version}")
+
+    thread = threading.Thread(target=build, name="build-exact", daemon=True)
+    thread.start()
+    return thread
+
+@st.cache_resource
+def exact_scopes():
+    # (data version, region, country, site) selections whose exact dashboard
+    # has rendered in this process
+    return set()
+
+@st.cache_resource
+def figure_cache():
+    # Shared by every session; keys carry the data version and filter state
+    return FigureCache(max_entries=128)
+
+@st.cache_resource
+def export_cache():
+    # Generated download files, keyed like the figure cache plus the format
+    return ExportCache(max_entries=8)
 
 # =========================
 # VISUALIZATION FUNCTIONS
@@ -670,9 +835,9 @@ def create_gauge_chart(value, title, color_scheme='RdYlGn'):
     
     return fig
 
-def create_heatmap(df, metric_col, title):
-    """Create a heatmap of sites vs metrics"""
-    heatmap_data = df.groupby('site_id')[metric_col].mean().sort_values(ascending=False).head(20)
+def create_heatmap(site_means, title):
+    """Create a heatmap of sites vs metrics (site_means: per-site mean of one metric)"""
+    heatmap_data = site_means.sort_values(ascending=False).head(20)
     
     fig = go.Figure(data=go.Heatmap(
         z=[heatmap_data.values],
@@ -696,6 +861,201 @@ def create_heatmap(df, metric_col, title):
     
     return fig
 
+def cached_figure(figure_id, params, build):
+    """Figure for the current data version and params; build() only runs on a cache miss"""
+    return figure_cache().get((dataset_version, figure_id, params), build)
+
+def export_download_button(label, cache_key, build_frame, fmt, file_name, **button_kwargs):
+    """
+    Download button whose file is only generated when it is clicked, then
+    reused for the same cache_key (data version, filter state, export id)
+    and format. build_frame() returns the frame to export.
+    """
+    cache = export_cache()
+    mime, extension = EXPORT_FORMATS[fmt]
+    return st.download_button(
+        label,
+        lambda: cache.get(cache_key + (fmt,), lambda: export_bytes(build_frame(), fmt)),
+        file_name + extension,
+        mime=mime,
+        **button_kwargs
+    )
+
+def create_world_map(country_sweep, critical_threshold, high_perf_threshold, margins=None):
+    """Choropleth of the average DQI per country, banded by the sidebar thresholds.
+    With `margins` (per country) the DQI is an estimate and the hover shows its ± margin."""
+    map_df = country_sweep.bands(critical_threshold, high_perf_threshold).rename_axis("country").reset_index()
+    hover_data = {"avg_dqi": ":.1f"}
+    if margins is not None:
+        map_df["margin"] = map_df["country"].map(margins)
+        hover_data["margin"] = ":.1f"
+
+    fig = px.choropleth(
+        map_df,
+        locations="country",
+        locationmode="ISO-3",
+        color="DQI Level",
+        hover_name="country",
+        hover_data=hover_data,
+        color_discrete_map={
+            "High Performing": "#38a169",
+            "Average": "#d69e2e",
+            "Critical": "#e53e3e"
+        },
+        title="Global DQI Distribution" + (" (estimated)" if margins is not None else "")
+    )
+
+    fig.update_layout(
+        template="plotly_white",
+        height=500,
+        margin=dict(l=0, r=0, t=50, b=0),
+        plot_bgcolor="white",
+        paper_bgcolor="white",
+        title_font=dict(size=20, color="#1a365d"),
+        legend=dict(
+            font=dict(color="#4a5568"),
+            title_font=dict(color="#2d3748"),
+            bgcolor="white",
+            bordercolor="#e2e8f0",
+            borderwidth=1
+        ),
+        geo=dict(
+            bgcolor="white",
+            lakecolor="white",
+            landcolor="#f7fafc",
+            subunitcolor="#e2e8f0"
+        )
+    )
+
+    return fig
+
+def create_top_sites_bar(site_values, y_label, color_scale):
+    """Bar chart of the 10 sites with the highest values"""
+    top_sites = site_values.sort_values(ascending=False).head(10)
+
+    fig = px.bar(
+        x=top_sites.index,
+        y=top_sites.values,
+        labels={'x': 'Site ID', 'y': y_label},
+        color=top_sites.values,
+        color_continuous_scale=color_scale
+    )
+    fig.update_layout(showlegend=False, height=300)
+
+    return fig
+
+def create_query_status_pie(total_open, total_closed):
+    """Donut of open vs closed queries"""
+    status_data = pd.DataFrame({
+        'Status': ['Open', 'Closed'],
+        'Count': [total_open, total_closed]
+    })
+
+    fig = px.pie(
+        status_data,
+        names='Status',
+        values='Count',
+        color='Status',
+        color_discrete_map={'Open': '#e53e3e', 'Closed': '#38a169'},
+        hole=0.4
+    )
+    fig.update_layout(height=350)
+
+    return fig
+
+def create_top_subjects_bar(queries_df):
+    """Bar chart of the 10 subjects with the most open queries"""
+    top_open = queries_df.nlargest(10, 'open_queries')[['subject_name', 'open_queries']]
+
+    fig = px.bar(
+        top_open,
+        x='subject_name',
+        y='open_queries',
+        labels={'subject_name': 'Subject', 'open_queries': 'Open Queries'},
+        color='open_queries',
+        color_continuous_scale='Reds'
+    )
+    fig.update_layout(showlegend=False, height=300, xaxis_tickangle=45)
+
+    return fig
+
+def create_resolution_histogram(resolution_data):
+    """Histogram of per-subject average query resolution time"""
+    fig = px.histogram(
+        resolution_data,
+        x='avg_resolution_days',
+        labels={'avg_resolution_days': 'Resolution Time (Days)'},
+        nbins=20,
+        color_discrete_sequence=['#3182ce']
+    )
+    fig.update_layout(showlegend=False, height=300)
+
+    return fig
+
+def create_status_pie(status_values):
+    """Donut of subject statuses for the AI site summary"""
+    status_counts = status_values.value_counts()
+    # A categorical column also counts the statuses that are not in scope
+    status_counts = status_counts[status_counts > 0].reset_index()
+    status_counts.columns = ["Status", "Count"]
+
+    fig = px.pie(
+        status_counts,
+        names="Status",
+        values="Count",
+        hole=0.45,
+        title="Subject Status Distribution",
+        color_discrete_sequence=px.colors.qualitative.Set3
+    )
+    fig.update_layout(
+        height=350,
+        paper_bgcolor='white',
+        plot_bgcolor='white',
+        font=dict(color="#2d3748")
+    )
+
+    return fig
+
+def create_dqi_band_pie(dqi):
+    """Donut of rows per DQI quality band for the AI site summary"""
+    dqi_bins = pd.cut(
+        dqi,
+        bins=[0, 40, 60, 85, 100],
+        labels=[
+            "Critical (<40)",
+            "At Risk (40–59)",
+            "Acceptable (60–84)",
+            "High Quality (85+)"
+        ]
+    )
+    dqi_dist = dqi_bins.value_counts().reset_index()
+    dqi_dist.columns = ["DQI Band", "Count"]
+
+    color_map = {
+        "Critical (<40)": "#e53e3e",
+        "At Risk (40–59)": "#d69e2e",
+        "Acceptable (60–84)": "#4299e1",
+        "High Quality (85+)": "#38a169"
+    }
+
+    fig = px.pie(
+        dqi_dist,
+        names="DQI Band",
+        values="Count",
+        hole=0.45,
+        title="DQI Quality Breakdown",
+        color="DQI Band",
+        color_discrete_map=color_map
+    )
+    fig.update_layout(
+        height=350,
+        paper_bgcolor='white',
+        plot_bgcolor='white',
+        font=dict(color="#2d3748")
+    )
+
+    return fig
+
 def create_query_visualizations(queries_df):
     """Create visualizations from queries dataset"""
     if queries_df is None or queries_df.empty:
@@ -754,16 +1114,100 @@ def create_query_visualizations(queries_df):
     return fig_status, fig_top_open, fig_resolution
 
 # =========================
-# LOAD DATA
+# PROGRESSIVE FIRST PAINT
 # =========================
-df_full, queries_df_full = load_data()
-df_full, queries_df_full = calculate_metrics(df_full, queries_df_full)
-df = df_full.copy()
-queries_df = queries_df_full.copy()
+# The first render of a data version builds every cache (filter hierarchy,
+# analytics, cube) before anything exact can be shown. Those builds are
+# started in a background thread while the KPIs, map and gauges are estimated
+# from the stratified per-site sample stored with the master; the exact
+# sections replace them later in the same run.
+def render_preview(version, region, country, site, critical_threshold, high_perf_threshold):
+    sample, sizes, total_patients = load_preview(version, region, country, site)
+    if sample.empty:
+        st.info("⏳ Loading the dataset...")
+        return
+    total_rows = int(sizes.sum())
+
+    st.info(
+        f"⏳ **Estimates** from a stratified sample of {len(sample):,} of {total_rows:,} rows "
+        f"(up to {SAMPLE_PER_SITE} per site), shown as value ± 95% margin. "
+        "Exact values replace them once the full dataset is loaded."
+    )
+
+    st.markdown("##  Key Performance Indicators (estimated)")
+    clean_share, clean_margin = stratified_mean(sample, "clean_patient", sizes)
+    clean_patients = clean_share * total_rows
+    clean_patient_pct = (clean_patients / total_patients * 100) if total_patients > 0 else 0
+    avg_dqi, dqi_margin = stratified_mean(sample, "dqi", sizes)
+
+    cards = [
+        ("Sites", f"{sample['site_id'].nunique():,}", ""),
+        ("Patients", f"≈ {total_patients:,}", "at most, counted per site"),
+        ("Clean Patients", f"≈ {clean_patients:,.0f}",
+         f"± {clean_margin * total_rows:,.0f} · ≈ {clean_patient_pct:.1f}% clean"),
+        ("Avg DQI", f"≈ {avg_dqi:.1f}", f"± {dqi_margin:.1f}"),
+    ]
+    for col, (label, value, note) in zip(st.columns(len(cards)), cards):
+        col.markdown(
+            f"""<div class='kpi-card'>
+                <h3>{label}</h3>
+                <h2>{value}</h2>
+                <div class='trend'>{note}</div>
+            </div>""",
+            unsafe_allow_html=True
+        )
+
+    st.markdown("## 🌍 Global Data Quality Overview (estimated)")
+    country_dqi = stratified_mean(sample, "dqi", sizes, by="country")
+    st.plotly_chart(create_world_map(
+        DQISweep(country_dqi["estimate"]),
+        critical_threshold,
+        high_perf_threshold,
+        margins=country_dqi["margin"]
+    ), use_container_width=True)
+
+    st.markdown("##  Data Quality Metrics (estimated)")
+    missing_visits, missing_visits_margin = stratified_mean(sample, "missing_visits_pct", sizes)
+    verification, verification_margin = stratified_ratio(
+        sample.assign(sdv_population=sample["forms_verified"] + sample["crfs_require_sdv"]),
+        "forms_verified", "sdv_population", sizes
+    )
+    gauges = [
+        ("Clean CRF %", *stratified_mean(sample, "clean_crf_percent", sizes)),
+        ("Query Resolution %", *stratified_mean(sample, "query_resolution_rate", sizes)),
+        ("Visit Completeness %", 100 - missing_visits, missing_visits_margin),
+        ("Verification %", verification * 100, verification_margin * 100),
+    ]
+    for col, (title, value, margin) in zip(st.columns(len(gauges)), gauges):
+        with col:
+            st.plotly_chart(
+                create_gauge_chart(value, f"{title} (± {margin:.1f})"),
+                use_container_width=True
+            )
+
+dataset_version = data_version()
+preview_scope = (
+    dataset_version,
+    st.session_state.get("region_filter", "All"),
+    st.session_state.get("country_filter", "All"),
+    st.session_state.get("site_filter", "All"),
+)
+preview_slot = st.empty()
+if (preview_scope not in exact_scopes()
+        and st.session_state.get("patient_filter", "All") == "All"):
+    build_exact(*preview_scope)
+    with preview_slot.container():
+        render_preview(
+            *preview_scope,
+            st.session_state.get("critical_threshold", DEFAULT_CRITICAL_THRESHOLD),
+            st.session_state.get("high_perf_threshold", DEFAULT_HIGH_PERF_THRESHOLD),
+        )
 
 # =========================
 # SIDEBAR FILTERS
 # =========================
+hierarchy = load_hierarchy(dataset_version)
+
 st.sidebar.markdown("""
 <div class="nav-container">
     <a href="/" class="nav-btn">📊 Dashboard</a>
@@ -773,64 +1217,119 @@ st.sidebar.markdown("""
 
 st.sidebar.markdown("<h2 style='color: #e2e8f0;'>🔍 Filters</h2>", unsafe_allow_html=True)
 
-region_sel = st.sidebar.selectbox(
-    "Region",
-    ["All"] + sorted(df_full["region"].dropna().unique()),
-    key="region_filter"
-)
-
-country_sel = st.sidebar.selectbox(
-    "Country",
-    ["All"] + sorted(df_full["country"].dropna().unique()),
-    key="country_filter"
-)
-
-site_sel = st.sidebar.selectbox(
-    "Site",
-    ["All"] + sorted(df_full["site_id"].dropna().unique()),
-    key="site_filter"
+def cascading_selectbox(label, options, key):
+    """Sidebar selectbox that falls back to "All" when its parent selection
+    no longer contains the current value."""
+    options = ["All"] + options
+    if st.session_state.get(key) not in options:
+        st.session_state[key] = "All"
+    return st.sidebar.selectbox(label, options, key=key)
+
+region_sel = cascading_selectbox("Region", hierarchy.options(), "region_filter")
+country_sel = cascading_selectbox("Country", hierarchy.options(region_sel), "country_filter")
+site_sel = cascading_selectbox("Site", hierarchy.options(region_sel, country_sel), "site_filter")
+# Patient: search box + one page of matches, never the whole scope
+def reset_patient_page():
+    st.session_state["patient_page"] = 1
+
+patient_search = load_patient_search(dataset_version, region_sel, country_sel, site_sel)
+patient_query = st.sidebar.text_input(
+    "Find Patient",
+    key="patient_query",
+    placeholder="Type part of a subject ID",
+    on_change=reset_patient_page
 )
-
-patient_sel = st.sidebar.selectbox(
-    "Patient",
-    ["All"] + sorted(df_full["patient_id"].dropna().unique()),
-    key="patient_filter"
+patient_page = st.session_state.get("patient_page", 1)
+patient_matches, more_patients = patient_search.search(
+    patient_query,
+    limit=PATIENT_PAGE_SIZE,
+    offset=(patient_page - 1) * PATIENT_PAGE_SIZE
 )
+if not patient_matches and patient_page > 1:
+    # The scope shrank under the current page - start over
+    reset_patient_page()
+    patient_page = 1
+    patient_matches, more_patients = patient_search.search(patient_query, limit=PATIENT_PAGE_SIZE)
+
+# Keep the current selection selectable while browsing other pages
+current_patient = st.session_state.get("patient_filter")
+if current_patient in patient_search and current_patient not in patient_matches:
+    patient_matches = [current_patient] + patient_matches
+
+patient_sel = cascading_selectbox("Patient", patient_matches, "patient_filter")
+
+if more_patients or patient_page > 1:
+    st.sidebar.number_input(
+        "Results page",
+        min_value=1,
+        max_value=patient_page + 1 if more_patients else patient_page,
+        step=1,
+        key="patient_page"
+    )
+st.sidebar.caption(f"{len(patient_search):,} patients in scope")
 
 st.sidebar.markdown("---")
 
 critical_threshold = st.sidebar.slider(
     "Critical DQI Alert Threshold",
-    0, 100, 40,
+    0, 100, DEFAULT_CRITICAL_THRESHOLD,
     key="critical_threshold"
 )
 
 high_perf_threshold = st.sidebar.slider(
     "High Performing DQI Threshold",
-    0, 100, 50,
+    0, 100, DEFAULT_HIGH_PERF_THRESHOLD,
     key="high_perf_threshold"
 )
 
 # =========================
-# APPLY FILTERS
+# LOAD DATA
 # =========================
-df = df_full.copy()
-
-if region_sel != "All":
-    df = df[df["region"] == region_sel]
+# Region/country/site are pushed down into the partitioned store, so only
+# the matching partitions and row groups are read
+scope = (dataset_version, region_sel, country_sel, site_sel)
+df_full, queries_df_full = load_analytics(*scope)
+queries_df = queries_df_full     # shared and read-only; scoped below by deriving, not copying
 
-if country_sel != "All":
-    df = df[df["country"] == country_sel]
-
-if site_sel != "All":
-    df = df[df["site_id"] == site_sel]
+# =========================
+# APPLY FILTERS
+# =========================
+# The patient is resolved through the loaded selection's index: no scans,
+# and a contiguous selection comes back as a view of df_full
+df = load_filter_index(*scope).apply(df_full, {
+    "region": region_sel,
+    "country": country_sel,
+    "site_id": site_sel,
+    "patient_id": patient_sel,
+})
+
+# Everything a filtered chart depends on besides the data version
+filter_key = (region_sel, country_sel, site_sel, patient_sel)
+
+# Site/country/region rollups are answered from the loaded selection's
+# cube; a single patient's rows are few enough to aggregate directly
+cube_selection = {"region": region_sel, "country": country_sel, "site_id": site_sel}
+query_links = load_query_links(dataset_version)
+if patient_sel == "All":
+    cube = load_cube(*scope)
+else:
+    patient_links = None if query_links is None else query_links[query_links['patient_id'] == patient_sel]
+    cube = AggregateCube(df, patient_links)
+site_rollup = cube.rollup("site_id", cube_selection)
 
-if patient_sel != "All":
-    df = df[df["patient_id"] == patient_sel]
+# With a filter active, query widgets only see the subjects linked to the
+# selection; the portfolio view keeps every queries.csv subject, matched or not
+filters_active = any(sel != "All" for sel in (region_sel, country_sel, site_sel, patient_sel))
+if filters_active and query_links is not None:
+    queries_df = queries_in_scope(query_links, {**cube_selection, "patient_id": patient_sel})
 
 # =========================
 # TITLE
 # =========================
+# Everything below is exact from here on: drop the sample estimates
+preview_slot.empty()
+exact_scopes().add(scope)
+
 st.markdown("<h1>📊 Clinical Trial Data Quality Dashboard</h1>", unsafe_allow_html=True)
 st.markdown("<p style='font-size: 1.2rem; color: #4a5568;'>Comprehensive data quality monitoring with advanced analytics</p>", unsafe_allow_html=True)
 
@@ -845,7 +1344,15 @@ clean_patients = df['clean_patient'].sum() if 'clean_patient' in df.columns else
 clean_patient_pct = (clean_patients / total_patients * 100) if total_patients > 0 else 0
 
 # Get query metrics from queries dataset
-if queries_df is not None:
+if queries_df is not None and filters_active and cube.has_queries:
+    query_totals = cube.totals(cube_selection)
+    total_open_queries = int(round(query_totals['open_queries_sum']))
+    total_closed_queries = int(round(query_totals['closed_queries_sum']))
+    total_queries = total_open_queries + total_closed_queries
+    query_resolution_rate = (total_closed_queries / total_queries * 100) if total_queries > 0 else 0
+    avg_resolution_days = query_totals['avg_resolution_days_mean']
+    avg_resolution_days = 0 if pd.isna(avg_resolution_days) else avg_resolution_days
+elif queries_df is not None:
     total_open_queries = queries_df['open_queries'].sum() if 'open_queries' in queries_df.columns else 0
     total_closed_queries = queries_df['closed_queries'].sum() if 'closed_queries' in queries_df.columns else 0
     total_queries = total_open_queries + total_closed_queries
@@ -923,62 +1430,27 @@ col6.markdown(
 # =========================
 st.markdown("## 🌍 Global Data Quality Overview")
 
-map_df = (
-    df.groupby("country")
-    .agg(avg_dqi=("dqi", "mean"))
-    .reset_index()
-)
-
-def dqi_band(score, critical_threshold, high_perf_threshold):
-    if score >= high_perf_threshold:
-        return "High Performing"
-    elif score >= critical_threshold:
-        return "Average"
-    else:
-        return "Critical"
+# Banding and threshold counts come from the per-scope cumulative DQI
+# counts, so moving a threshold slider does not touch the data
+dqi_sweeps = load_dqi_sweeps(dataset_version, *filter_key)
 
-map_df["DQI Level"] = map_df["avg_dqi"].apply(
-    lambda x: dqi_band(x, critical_threshold, high_perf_threshold)
+fig_map = cached_figure(
+    "world_map",
+    (filter_key, critical_threshold, high_perf_threshold),
+    lambda: create_world_map(dqi_sweeps["country"], critical_threshold, high_perf_threshold)
 )
 
-fig_map = px.choropleth(
-    map_df,
-    locations="country",
-    locationmode="ISO-3",
-    color="DQI Level",
-    hover_name="country",
-    hover_data={"avg_dqi": ":.1f"},
-    color_discrete_map={
-        "High Performing": "#38a169",
-        "Average": "#d69e2e",
-        "Critical": "#e53e3e"
-    },
-    title="Global DQI Distribution"
-)
+st.plotly_chart(fig_map, use_container_width=True)
 
-fig_map.update_layout(
-    template="plotly_white",
-    height=500,
-    margin=dict(l=0, r=0, t=50, b=0),
-    plot_bgcolor="white",
-    paper_bgcolor="white",
-    title_font=dict(size=20, color="#1a365d"),
-    legend=dict(
-        font=dict(color="#4a5568"),
-        title_font=dict(color="#2d3748"),
-        bgcolor="white",
-        bordercolor="#e2e8f0",
-        borderwidth=1
-    ),
-    geo=dict(
-        bgcolor="white",
-        lakecolor="white",
-        landcolor="#f7fafc",
-        subunitcolor="#e2e8f0"
+threshold_cols = st.columns(len(SWEEP_LEVELS))
+for col, (level, label) in zip(threshold_cols, SWEEP_LEVELS.items()):
+    sweep = dqi_sweeps[level]
+    col.metric(
+        f"{label} below {critical_threshold} DQI",
+        f"{sweep.count_below(critical_threshold):,} of {len(sweep):,}",
+        f"{sweep.count_at_least(high_perf_threshold):,} at or above {high_perf_threshold}",
+        delta_color="off"
     )
-)
-
-st.plotly_chart(fig_map, use_container_width=True)
 
 # =========================
 # DATA QUALITY METRICS SECTION
@@ -989,118 +1461,57 @@ st.markdown("##  Data Quality Metrics")
 col1, col2, col3, col4 = st.columns(4)
 
 with col1:
-    st.plotly_chart(create_gauge_chart(
+    st.plotly_chart(cached_figure("gauge_clean_crf", filter_key, lambda: create_gauge_chart(
         df['clean_crf_percent'].mean(),
         "Clean CRF %"
-    ), use_container_width=True)
+    )), use_container_width=True)
 
 with col2:
-    st.plotly_chart(create_gauge_chart(
+    st.plotly_chart(cached_figure("gauge_query_resolution", filter_key, lambda: create_gauge_chart(
         df['query_resolution_rate'].mean() if 'query_resolution_rate' in df.columns else 0,
         "Query Resolution %"
-    ), use_container_width=True)
+    )), use_container_width=True)
 
 with col3:
-    st.plotly_chart(create_gauge_chart(
+    st.plotly_chart(cached_figure("gauge_visit_completeness", filter_key, lambda: create_gauge_chart(
         100 - df['missing_visits_pct'].mean(),
         "Visit Completeness %"
-    ), use_container_width=True)
+    )), use_container_width=True)
 
 with col4:
-    st.plotly_chart(create_gauge_chart(
+    st.plotly_chart(cached_figure("gauge_verification", filter_key, lambda: create_gauge_chart(
         df['verification_pct'].mean(),
         "Verification %"
-    ), use_container_width=True)
+    )), use_container_width=True)
 
 # =========================
 # ISSUE ANALYSIS SECTION - UPDATED WITH QUERIES DATASET
 # =========================
 st.markdown("##🔍 Issue Analysis")
 
-tab1, tab2, tab3, tab4 = st.tabs(["Missing Data", "Query Analysis", "Protocol Deviations", "Query Resolution Time"])
+# Only the open tab's content runs; switching tabs reruns the page and the
+# tab's figures come from the figure cache for an unchanged filter state
+tab1, tab2, tab3, tab4 = st.tabs(
+    ["Missing Data", "Query Analysis", "Protocol Deviations", "Query Resolution Time"],
+    key="issue_tabs",
+    on_change="rerun"
+)
 
 with tab1:
-    col1, col2 = st.columns(2)
-
-    with col1:
-        st.markdown(dedent("""
-        <div class="chart-container">
-            <h3> Sites with Most Missing Visits</h3>
-        """), unsafe_allow_html=True)
-
-        missing_visits_by_site = (
-            df.groupby('site_id')['missing_visits']
-            .sum()
-            .sort_values(ascending=False)
-            .head(10)
-        )
-
-        fig = px.bar(
-            x=missing_visits_by_site.index,
-            y=missing_visits_by_site.values,
-            labels={'x': 'Site ID', 'y': 'Missing Visits'},
-            color=missing_visits_by_site.values,
-            color_continuous_scale='Reds'
-        )
-        fig.update_layout(showlegend=False, height=300)
-
-        st.plotly_chart(fig, use_container_width=True)
-
-        st.markdown("</div>", unsafe_allow_html=True)
-
-    with col2:
-        st.markdown(dedent("""
-        <div class="chart-container">
-            <h3> Sites with Most Missing Pages</h3>
-        """), unsafe_allow_html=True)
-
-        missing_pages_by_site = (
-            df.groupby('site_id')['missing_pages']
-            .sum()
-            .sort_values(ascending=False)
-            .head(10)
-        )
-
-        fig = px.bar(
-            x=missing_pages_by_site.index,
-            y=missing_pages_by_site.values,
-            labels={'x': 'Site ID', 'y': 'Missing Pages'},
-            color=missing_pages_by_site.values,
-            color_continuous_scale='Oranges'
-        )
-        fig.update_layout(showlegend=False, height=300)
-
-        st.plotly_chart(fig, use_container_width=True)
-
-        st.markdown("</div>", unsafe_allow_html=True)
-
-with tab2:
-    if queries_df is not None and not queries_df.empty:
+    if tab1.open:
         col1, col2 = st.columns(2)
-        
+
         with col1:
             st.markdown(dedent("""
             <div class="chart-container">
-                <h3> Query Status Distribution</h3>
+                <h3> Sites with Most Missing Visits</h3>
             """), unsafe_allow_html=True)
 
-            total_open = queries_df['open_queries'].sum() if 'open_queries' in queries_df.columns else 0
-            total_closed = queries_df['closed_queries'].sum() if 'closed_queries' in queries_df.columns else 0
-            
-            status_data = pd.DataFrame({
-                'Status': ['Open', 'Closed'],
-                'Count': [total_open, total_closed]
-            })
-
-            fig = px.pie(
-                status_data,
-                names='Status',
-                values='Count',
-                color='Status',
-                color_discrete_map={'Open': '#e53e3e', 'Closed': '#38a169'},
-                hole=0.4
+            fig = cached_figure(
+                "top_missing_visits",
+                filter_key,
+                lambda: create_top_sites_bar(site_rollup['missing_visits_sum'], 'Missing Visits', 'Reds')
             )
-            fig.update_layout(height=350)
 
             st.plotly_chart(fig, use_container_width=True)
 
@@ -1109,125 +1520,141 @@ with tab2:
         with col2:
             st.markdown(dedent("""
             <div class="chart-container">
-                <h3> Top Subjects with Open Queries</h3>
+                <h3> Sites with Most Missing Pages</h3>
             """), unsafe_allow_html=True)
 
-            if 'subject_name' in queries_df.columns and 'open_queries' in queries_df.columns:
-                top_open = queries_df.nlargest(10, 'open_queries')[['subject_name', 'open_queries']]
-                
-                fig = px.bar(
-                    top_open,
-                    x='subject_name',
-                    y='open_queries',
-                    labels={'subject_name': 'Subject', 'open_queries': 'Open Queries'},
-                    color='open_queries',
-                    color_continuous_scale='Reds'
-                )
-                fig.update_layout(showlegend=False, height=300, xaxis_tickangle=45)
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("Subject name or open queries data not available in queries dataset")
+            fig = cached_figure(
+                "top_missing_pages",
+                filter_key,
+                lambda: create_top_sites_bar(site_rollup['missing_pages_sum'], 'Missing Pages', 'Oranges')
+            )
+
+            st.plotly_chart(fig, use_container_width=True)
 
             st.markdown("</div>", unsafe_allow_html=True)
-    else:
-        st.info("No query data available. Please ensure queries.csv is in the data folder.")
 
-with tab3:
-    col1, col2 = st.columns(2)
-    
-    with col1:
-        st.markdown(dedent("""
-        <div class="chart-container">
-            <h3>⚠️ Protocol Deviations by Site</h3>
-        """), unsafe_allow_html=True)
-
-        pds_by_site = (
-            df.groupby('site_id')['pds_confirmed']
-            .sum()
-            .sort_values(ascending=False)
-            .head(10)
-        )
+with tab2:
+    if tab2.open:
+        if queries_df is not None and not queries_df.empty:
+            col1, col2 = st.columns(2)
+        
+            with col1:
+                st.markdown(dedent("""
+                <div class="chart-container">
+                    <h3> Query Status Distribution</h3>
+                """), unsafe_allow_html=True)
+
+                fig = cached_figure(
+                    "query_status",
+                    filter_key,
+                    lambda: create_query_status_pie(total_open_queries, total_closed_queries)
+                )
 
-        fig = px.bar(
-            x=pds_by_site.index,
-            y=pds_by_site.values,
-            labels={'x': 'Site ID', 'y': 'Confirmed PDs'},
-            color=pds_by_site.values,
-            color_continuous_scale='Reds'
-        )
-        fig.update_layout(showlegend=False, height=300)
+                st.plotly_chart(fig, use_container_width=True)
 
-        st.plotly_chart(fig, use_container_width=True)
+                st.markdown("</div>", unsafe_allow_html=True)
 
-        st.markdown("</div>", unsafe_allow_html=True)
+            with col2:
+                st.markdown(dedent("""
+                <div class="chart-container">
+                    <h3> Top Subjects with Open Queries</h3>
+                """), unsafe_allow_html=True)
 
-with tab4:
-    if queries_df is not None and 'avg_resolution_days' in queries_df.columns:
+                if 'subject_name' in queries_df.columns and 'open_queries' in queries_df.columns:
+                    fig = cached_figure("top_open_subjects", filter_key, lambda: create_top_subjects_bar(queries_df))
+                    st.plotly_chart(fig, use_container_width=True)
+                else:
+                    st.info("Subject name or open queries data not available in queries dataset")
+
+                st.markdown("</div>", unsafe_allow_html=True)
+        else:
+            st.info("No query data available. Please ensure queries.csv is in the data folder.")
+
+with tab3:
+    if tab3.open:
         col1, col2 = st.columns(2)
-        
+    
         with col1:
             st.markdown(dedent("""
             <div class="chart-container">
-                <h3> Query Resolution Time Distribution</h3>
+                <h3>⚠️ Protocol Deviations by Site</h3>
             """), unsafe_allow_html=True)
 
-            resolution_data = queries_df[queries_df['avg_resolution_days'].notna()]
-            
-            if not resolution_data.empty:
-                fig = px.histogram(
-                    resolution_data,
-                    x='avg_resolution_days',
-                    labels={'avg_resolution_days': 'Resolution Time (Days)'},
-                    nbins=20,
-                    color_discrete_sequence=['#3182ce']
-                )
-                fig.update_layout(showlegend=False, height=300)
-                st.plotly_chart(fig, use_container_width=True)
-            else:
-                st.info("No resolution time data available")
+            fig = cached_figure(
+                "top_protocol_deviations",
+                filter_key,
+                lambda: create_top_sites_bar(site_rollup['pds_confirmed_sum'], 'Confirmed PDs', 'Reds')
+            )
+
+            st.plotly_chart(fig, use_container_width=True)
 
             st.markdown("</div>", unsafe_allow_html=True)
 
-        with col2:
-            st.markdown(dedent("""
-            <div class="chart-container">
-                <h3> Resolution Time Statistics</h3>
-            """), unsafe_allow_html=True)
+with tab4:
+    if tab4.open:
+        if queries_df is not None and 'avg_resolution_days' in queries_df.columns:
+            col1, col2 = st.columns(2)
+        
+            with col1:
+                st.markdown(dedent("""
+                <div class="chart-container">
+                    <h3> Query Resolution Time Distribution</h3>
+                """), unsafe_allow_html=True)
 
-            if not resolution_data.empty:
-                avg_days = resolution_data['avg_resolution_days'].mean()
-                median_days = resolution_data['avg_resolution_days'].median()
-                std_days = resolution_data['avg_resolution_days'].std()
-                min_days = resolution_data['avg_resolution_days'].min()
-                max_days = resolution_data['avg_resolution_days'].max()
+                resolution_data = queries_df[queries_df['avg_resolution_days'].notna()]
+            
+                if not resolution_data.empty:
+                    fig = cached_figure(
+                        "resolution_histogram",
+                        filter_key,
+                        lambda: create_resolution_histogram(resolution_data)
+                    )
+                    st.plotly_chart(fig, use_container_width=True)
+                else:
+                    st.info("No resolution time data available")
+
+                st.markdown("</div>", unsafe_allow_html=True)
+
+            with col2:
+                st.markdown(dedent("""
+                <div class="chart-container">
+                    <h3> Resolution Time Statistics</h3>
+                """), unsafe_allow_html=True)
+
+                if not resolution_data.empty:
+                    avg_days = resolution_data['avg_resolution_days'].mean()
+                    median_days = resolution_data['avg_resolution_days'].median()
+                    std_days = resolution_data['avg_resolution_days'].std()
+                    min_days = resolution_data['avg_resolution_days'].min()
+                    max_days = resolution_data['avg_resolution_days'].max()
                 
-                stats_html = f"""
-                <div style="padding: 20px;">
-                    <div style="display: flex; justify-content: space-between; margin-bottom: 10px;">
-                        <span>Average:</span>
-                        <span style="font-weight: bold; color: #3182ce;">{avg_days:.1f} days</span>
-                    </div>
-                    <div style="display: flex; justify-content: space-between; margin-bottom: 10px;">
-                        <span>Median:</span>
-                        <span style="font-weight: bold; color: #3182ce;">{median_days:.1f} days</span>
-                    </div>
-                    <div style="display: flex; justify-content: space-between; margin-bottom: 10px;">
-                        <span>Fastest:</span>
-                        <span style="font-weight: bold; color: #38a169;">{min_days:.1f} days</span>
-                    </div>
-                    <div style="display: flex; justify-content: space-between; margin-bottom: 10px;">
-                        <span>Slowest:</span>
-                        <span style="font-weight: bold; color: #e53e3e;">{max_days:.1f} days</span>
+                    stats_html = f"""
+                    <div style="padding: 20px;">
+                        <div style="display: flex; justify-content: space-between; margin-bottom: 10px;">
+                            <span>Average:</span>
+                            <span style="font-weight: bold; color: #3182ce;">{avg_days:.1f} days</span>
+                        </div>
+                        <div style="display: flex; justify-content: space-between; margin-bottom: 10px;">
+                            <span>Median:</span>
+                            <span style="font-weight: bold; color: #3182ce;">{median_days:.1f} days</span>
+                        </div>
+                        <div style="display: flex; justify-content: space-between; margin-bottom: 10px;">
+                            <span>Fastest:</span>
+                            <span style="font-weight: bold; color: #38a169;">{min_days:.1f} days</span>
+                        </div>
+                        <div style="display: flex; justify-content: space-between; margin-bottom: 10px;">
+                            <span>Slowest:</span>
+                            <span style="font-weight: bold; color: #e53e3e;">{max_days:.1f} days</span>
+                        </div>
                     </div>
-                </div>
-                """
-                st.markdown(stats_html, unsafe_allow_html=True)
-            else:
-                st.info("No resolution time statistics available")
+                    """
+                    st.markdown(stats_html, unsafe_allow_html=True)
+                else:
+                    st.info("No resolution time statistics available")
 
-            st.markdown("</div>", unsafe_allow_html=True)
-    else:
-        st.info("No resolution time data available in queries dataset")
+                st.markdown("</div>", unsafe_allow_html=True)
+        else:
+            st.info("No resolution time data available in queries dataset")
 
 # =========================
 # SITE PERFORMANCE HEATMAPS
@@ -1245,7 +1672,7 @@ with col1:
         unsafe_allow_html=True
     )
     st.plotly_chart(
-        create_heatmap(df, 'clean_crf_percent', ''),
+        cached_figure("heatmap_clean_crf", filter_key, lambda: create_heatmap(site_rollup['clean_crf_percent_mean'], '')),
         use_container_width=True
     )
     st.markdown("</div>", unsafe_allow_html=True)
@@ -1259,7 +1686,7 @@ with col2:
         unsafe_allow_html=True
     )
     st.plotly_chart(
-        create_heatmap(df, 'data_readiness_score', ''),
+        cached_figure("heatmap_readiness", filter_key, lambda: create_heatmap(site_rollup['data_readiness_score_mean'], '')),
         use_container_width=True
     )
     st.markdown("</div>", unsafe_allow_html=True)
@@ -1270,158 +1697,94 @@ with col2:
 st.markdown("##  Critical Alerts & Immediate Attention")
 
 # Calculate critical metrics
-site_summary = df.groupby('site_id').agg({
-    'dqi': 'mean',
-    'region': 'first',
-    'missing_visits': 'sum',
-    'missing_pages': 'sum',
-    'pds_confirmed': 'sum',
-    'clean_patient': 'sum',
-    'patient_id': 'nunique'
-}).reset_index()
+site_summary = (
+    site_rollup
+    .rename(columns={
+        'dqi_mean': 'dqi',
+        'missing_visits_sum': 'missing_visits',
+        'missing_pages_sum': 'missing_pages',
+        'pds_confirmed_sum': 'pds_confirmed',
+        'clean_patient_sum': 'clean_patient',
+        'patients': 'patient_id',
+        'open_queries_sum': 'open_queries',
+        'closed_queries_sum': 'closed_queries',
+        'avg_resolution_days_mean': 'avg_resolution_days'
+    })
+    [['dqi', 'region', 'missing_visits', 'missing_pages', 'pds_confirmed', 'clean_patient', 'patient_id']
+     + (['open_queries', 'closed_queries', 'avg_resolution_days'] if cube.has_queries else [])]
+    .reset_index()
+)
 
 site_summary['clean_patient_pct'] = (site_summary['clean_patient'] / site_summary['patient_id']) * 100
 
-# Add query metrics if available
-if queries_df is not None:
-    # Note: This is a simplified approach. In a real scenario, you'd need to map subjects to sites
-    # For now, we'll add average query metrics per site
-    site_summary['open_queries'] = total_open_queries / len(site_summary)  # Simplified distribution
-    site_summary['closed_queries'] = total_closed_queries / len(site_summary)  # Simplified distribution
-    site_summary['avg_resolution_days'] = avg_resolution_days  # Same for all sites
-else:
+# Query metrics per site come from the subject -> site join in the cube
+if not cube.has_queries:
     site_summary['open_queries'] = 0
     site_summary['closed_queries'] = 0
     site_summary['avg_resolution_days'] = 0
 
-# Create a better priority score including query metrics
-def calculate_priority_score(row):
-    score = 0
-    
-    # DQI score (0-100, lower is worse)
-    if row['dqi'] < 20: score += 40
-    elif row['dqi'] < 40: score += 30
-    elif row['dqi'] < 60: score += 20
-    
-    # Clean patient percentage
-    if pd.notna(row['clean_patient_pct']):
-        if row['clean_patient_pct'] < 20: score += 30
-        elif row['clean_patient_pct'] < 50: score += 20
-        elif row['clean_patient_pct'] < 80: score += 10
-    
-    # Open queries
-    if pd.notna(row['open_queries']):
-        if row['open_queries'] > 10: score += 20
-        elif row['open_queries'] > 5: score += 15
-        elif row['open_queries'] > 2: score += 10
-    
-    # Missing visits
-    if pd.notna(row['missing_visits']):
-        if row['missing_visits'] > 20: score += 10
-    
-    # Resolution time
-    if pd.notna(row['avg_resolution_days']):
-        if row['avg_resolution_days'] > 20: score += 15
-        elif row['avg_resolution_days'] > 10: score += 10
-    
-    return score
-
-site_summary['priority_score'] = site_summary.apply(calculate_priority_score, axis=1)
-
-# Categorize priority
-def categorize_priority(score):
-    if score >= 60:
-        return "🔴 Critical", "#feb2b2"
-    elif score >= 40:
-        return "🟠 High", "#fbd38d"
-    elif score >= 20:
-        return "🟡 Medium", "#fefcbf"
-    else:
-        return "🟢 Low", "#c6f6d5"
-
-site_summary['priority_info'] = site_summary['priority_score'].apply(
-    lambda x: categorize_priority(x)
-)
-site_summary['priority'] = site_summary['priority_info'].apply(lambda x: x[0])
-site_summary['priority_color'] = site_summary['priority_info'].apply(lambda x: x[1])
+# Priority score including query metrics (utils/scoring.py)
+site_summary['priority_score'] = priority_scores(site_summary)
+site_summary['priority'], site_summary['priority_color'] = priority_levels(site_summary['priority_score'])
 
 # Determine DQI status
-site_summary['dqi_status'] = site_summary['dqi'].apply(
-    lambda x: ("🔴 Critical", "#e53e3e") if x < 40 else 
-              ("🟠 Warning", "#d69e2e") if x < 60 else 
-              ("🟢 Good", "#38a169")
-)
-site_summary['dqi_status_text'] = site_summary['dqi_status'].apply(lambda x: x[0])
-site_summary['dqi_color'] = site_summary['dqi_status'].apply(lambda x: x[1])
+site_summary['dqi_status_text'], site_summary['dqi_color'] = dqi_status(site_summary['dqi'])
 
-# Top 10 sites needing attention
-critical_sites = site_summary.sort_values(
-    ['priority_score', 'dqi', 'open_queries', 'missing_visits'], 
-    ascending=[False, True, False, False]
-).head(10)
+# Ranked site table: sort keys and rows per page
+ATTENTION_SORTS = {
+    "Priority": (['priority_score', 'dqi', 'open_queries', 'missing_visits'], [False, True, False, False]),
+    "DQI (lowest first)": (['dqi', 'priority_score'], [True, False]),
+    "Open Queries": (['open_queries', 'priority_score'], [False, False]),
+}
+ATTENTION_PAGE_SIZES = [10, 25, 50]
 
-# Display using Streamlit's metric cards
-#st.markdown('<div class="content-card">', unsafe_allow_html=True)
 st.markdown("### ⚠️ Sites Requiring Immediate Attention")
 
-# Create a simpler table view
-show_n = st.selectbox(
-    "Show sites",
-    options=[5, 10, 15, "All"],
-    index=0
-)
+@st.fragment
+def attention_sites_section(site_summary, token):
+    """
+    Every site ranked by the chosen sort, one page at a time in a single
+    table, so the browser gets the same few rows however many sites there
+    are. Sorting and paging only rerun this section.
+    """
+    col1, col2, col3 = st.columns([2, 1, 1])
+    sort_by = col1.selectbox("Sort sites by", list(ATTENTION_SORTS), key="attention_sort")
+    page_size = col2.selectbox("Sites per page", ATTENTION_PAGE_SIZES, key="attention_page_size")
+
+    n_pages = max(1, -(-len(site_summary) // page_size))
+    if st.session_state.get("attention_page", 1) > n_pages:
+        st.session_state["attention_page"] = n_pages
+    page = col3.number_input("Page", min_value=1, max_value=n_pages, step=1, key="attention_page")
+
+    # Sort orders are cached per data version and filter state
+    table = paged_table(site_summary, "attention", token)
+    rows = table.page(table.order(*ATTENTION_SORTS[sort_by]), page, page_size)
+
+    table = pd.DataFrame({
+        'Site': rows['site_id'],
+        'Region': rows['region'],
+        'DQI': rows['dqi'],
+        'DQI Status': rows['dqi_status_text'],
+        'Clean Patients %': rows['clean_patient_pct'],
+        'Open Queries': rows['open_queries'].fillna(0).round().astype(int),
+        'Priority': rows['priority'],
+    })
 
-if show_n == "All":
-    sites_to_show = critical_sites
-else:
-    sites_to_show = critical_sites.head(show_n)
+    # Badge colours come from the page's own rows, nothing else is styled
+    styled = (
+        table.style
+        .apply(lambda _: [f"color: {c}; font-weight: bold" for c in rows['dqi_color']], subset=['DQI Status'])
+        .apply(lambda _: [f"background-color: {c}; font-weight: bold" for c in rows['priority_color']], subset=['Priority'])
+        .format({'DQI': "{:.1f}", 'Clean Patients %': "{:.1f}%"}, na_rep="N/A")
+    )
 
-for _, site in sites_to_show.iterrows():    
-    col1, col2, col3, col4,col5 = st.columns([2, 2, 2, 2,2])
-    
-    with col1:
-        st.metric(
-            label=f"Site {site['site_id']}",
-            value=f"DQI: {site['dqi']:.1f}",
-            delta="Critical" if site['dqi'] < 40 else "Warning" if site['dqi'] < 60 else "Good",
-            delta_color="inverse"
-        )
-    
-    with col2:
-        st.metric(
-        label="Region",
-        value=site['region'],
-        delta_color="off"
+    st.dataframe(styled, hide_index=True, use_container_width=True)
+    st.caption(
+        f"Showing {len(rows)} of {len(site_summary)} sites "
+        f"(ranked by {sort_by.lower()}, page {page} of {n_pages})"
     )
-    with col3:
-        clean_pct = f"{site['clean_patient_pct']:.1f}%" if pd.notna(site['clean_patient_pct']) else "N/A"
-        st.metric(
-            label="Clean Patients",
-            value=clean_pct,
-            delta_color="off")
-        
-    
-    with col4:
-        open_queries_val = int(site['open_queries']) if pd.notna(site['open_queries']) else 0
-        st.metric(
-            label="Open Queries",
-            value=open_queries_val,
-            delta_color="off"
-        )
-    
-    with col5:
-        # Create a colored priority badge
-        priority_text, priority_color = categorize_priority(site['priority_score'])
-        st.markdown(f"""
-        <div style='background-color: {priority_color}; 
-                    padding: 10px; 
-                    border-radius: 8px; 
-                    text-align: center;
-                    font-weight: bold;
-                    color: #2d3748;'>
-            {priority_text}
-        </div>
-        """, unsafe_allow_html=True)
+
+attention_sites_section(site_summary, (dataset_version, filter_key))
 
 st.markdown('</div>', unsafe_allow_html=True)
 
@@ -1507,7 +1870,7 @@ with col2:
         checklist_items.append(("Avg Resolution Time < 10 days", False))
     
     try:
-        checklist_items.append(("PDs Resolved", df['pds_confirmed'].mean() > 0))
+        checklist_items.append(("PDs Resolved", df['pds_confirmed'].fillna(0).mean() > 0))
     except:
         checklist_items.append(("PDs Resolved", False))
     
@@ -1556,6 +1919,28 @@ with col3:
     st.markdown(snapshot_html, unsafe_allow_html=True)
     st.markdown('</div>', unsafe_allow_html=True)
 
+# =========================
+# EXPORT FILTERED DATA
+# =========================
+st.markdown("## ⬇ Export Filtered Data")
+
+# Generated on click from the cached frame, once per filter state and format
+col1, col2, col3 = st.columns(3)
+for column, (fmt, label) in zip(
+    (col1, col2, col3),
+    [("csv", "📥 CSV"), ("parquet", "📥 Parquet"), ("xlsx", "📥 Excel")]
+):
+    with column:
+        export_download_button(
+            f"{label} ({len(df):,} rows)",
+            (dataset_version, filter_key, "filtered_data"),
+            lambda: df,
+            fmt,
+            "clinical_data_filtered",
+            key=f"export_filtered_{fmt}",
+            use_container_width=True
+        )
+
 # =========================
 #  AI TOOLS SECTION (KEEPING ORIGINAL)
 # =========================
@@ -1566,34 +1951,46 @@ ai_tab1, ai_tab2, ai_tab3 = st.tabs([
     " SITE SUMMARY", 
     " AGENT RECOMMENDATIONS", 
     " NATURAL LANGUAGE QUERY"
-])
+], key="ai_tabs", on_change="rerun")
 
-# Use the currently filtered DataFrame
-drill_df = df.copy()
+# Use the currently filtered DataFrame (copy-on-write: no defensive copy)
+drill_df = df
 
+# Each AI tool is a fragment: its buttons and inputs rerun that tool only,
+# with the filtered data it was last given
 # Tab 1: Site Summary (keeping original)
-with ai_tab1:
+@st.fragment
+def site_summary_section(drill_df, site_rollup, filter_key):
     st.markdown("### AI-Powered Site Summary Generator")
     st.markdown("<p style='color: #4a5568; font-size: 16px;'>Generate comprehensive site performance analysis with risk intelligence and actionable insights.</p>", unsafe_allow_html=True)
     
     col1, col2, col3 = st.columns([1, 2, 1])
     with col2:
-        if st.button(" Generate Site Summary", key="gen_site_summary", use_container_width=True):
+        # The last summary for this data and filter state stays on screen
+        # while its tables are sorted or paged
+        summary_key = (dataset_version, filter_key)
+        generate = st.button(" Generate Site Summary", key="gen_site_summary", use_container_width=True)
+        stored = st.session_state.get("site_summary_result")
+        if generate or (stored is not None and stored[0] == summary_key):
             try:
-                placeholder = st.empty()
-                with placeholder.container():
-                    st.markdown("""
-                    <div class="ai-loader">
-                        <div class="emoji">⏳</div>
-                        <b>Generating AI Site Summary…</b>
-                        <div style="font-size:14px;">Analyzing risks, trends & actions</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                
-                with st.spinner("Processing…"):
-                    result = generate_site_summary(drill_df)
-                
-                placeholder.empty()
+                if generate:
+                    placeholder = st.empty()
+                    with placeholder.container():
+                        st.markdown("""
+                        <div class="ai-loader">
+                            <div class="emoji">⏳</div>
+                            <b>Generating AI Site Summary…</b>
+                            <div style="font-size:14px;">Analyzing risks, trends & actions</div>
+                        </div>
+                        """, unsafe_allow_html=True)
+                    
+                    with st.spinner("Processing…"):
+                        result = generate_site_summary(drill_df, site_rollup)
+                    
+                    placeholder.empty()
+                    st.session_state["site_summary_result"] = (summary_key, result)
+                else:
+                    result = stored[1]
                 
                 # Display results
                 st.markdown('<div class="content-card">', unsafe_allow_html=True)
@@ -1665,7 +2062,7 @@ with ai_tab1:
                         
                         if not rf_df.empty and "site_id" in rf_df.columns:
                             # Create a formatted table
-                            display_df = rf_df.copy()
+                            display_df = rf_df.copy(deep=False)
                             
                             # Add risk indicators
                             if "low_dqi" in display_df.columns:
@@ -1695,10 +2092,12 @@ with ai_tab1:
                                 rename_map["severity"] = "Severity Score"
                             
                             # Display table with custom styling
-                            st.dataframe(
+                            paged_dataframe(
                                 display_df[display_cols].rename(columns=rename_map),
-                                use_container_width=True,
-                                height=250
+                                key="ai_risk_fingerprint",
+                                token=summary_key,
+                                page_size=25,
+                                use_container_width=True
                             )
                         
                         st.markdown('</div>', unsafe_allow_html=True)
@@ -1755,36 +2154,29 @@ with ai_tab1:
                 if missing_cols:
                     st.warning(f"Missing columns: {missing_cols}. Cannot generate site performance summary.")
                 else:
-                    # Group by site
-                    agg_dict = {
-                        "total_subjects": ("patient_id", "nunique"),
-                        "avg_dqi": ("dqi", "mean"),
+                    # Per-site figures from the cube
+                    perf_cols = {
+                        "patients": "total_subjects",
+                        "dqi_mean": "avg_dqi",
                     }
                     
                     # Add subject_status if it exists
                     if "subject_status" in drill_df.columns:
-                        agg_dict["active_subjects"] = ("subject_status", lambda x: (x == "On Trial").sum())
-                        agg_dict["screen_failures"] = ("subject_status", lambda x: (x == "Screen Failure").sum())
+                        perf_cols["active_subjects"] = "active_subjects"
+                        perf_cols["screen_failures"] = "screen_failures"
                     
                     site_perf = (
-                        drill_df.groupby("site_id")
-                        .agg(**agg_dict)
+                        site_rollup[list(perf_cols)]
+                        .rename(columns=perf_cols)
                         .reset_index()
                         .round(1)
                     )
                     
-                    # Function to determine observation
-                    def site_observation(row):
-                        if row["avg_dqi"] < 40:
-                            return "🔴 Critical DQI Risk"
-                        elif "screen_failures" in row and row["screen_failures"] > row["total_subjects"] / 2:
-                            return "🟠 High Screen Failure Rate"
-                        elif row["avg_dqi"] < 60:
-                            return "🟡 Needs Attention"
-                        else:
-                            return "🟢 Good Performance"
-                    
-                    site_perf["Status"] = site_perf.apply(site_observation, axis=1)
+                    site_perf["Status"] = site_observation(
+                        site_perf["avg_dqi"],
+                        site_perf["total_subjects"],
+                        site_perf.get("screen_failures")
+                    )
                     
                     # Rename columns
                     rename_dict = {
@@ -1801,29 +2193,15 @@ with ai_tab1:
                     
                     site_perf = site_perf.rename(columns=rename_dict)
                     
-                    # Display with sorting by DQI (worst first)
-                    display_df = site_perf.sort_values("Avg DQI", ascending=True).head(20)
-                    
-                    # Apply color formatting
-                    def color_dqi(val):
-                        if val < 40:
-                            color = "#e53e3e"
-                        elif val < 60:
-                            color = "#d69e2e"
-                        elif val < 85:
-                            color = "#d69e2e"
-                        else:
-                            color = "#38a169"
-                        return f"color: {color}; font-weight: bold"
-                    
-                    # Apply styling
-                    styled_df = display_df.style.apply(lambda x: ['background-color: #f7fafc' if i % 2 == 0 else '' for i in range(len(x))], axis=0)
-                    
-                    # Display
-                    st.dataframe(
-                        styled_df,
-                        use_container_width=True,
-                        height=350
+                    # Display every site, worst DQI first, one page at a time
+                    paged_dataframe(
+                        site_perf,
+                        key="ai_site_perf",
+                        token=summary_key,
+                        default_sort="Avg DQI",
+                        page_size=25,
+                        style=lambda page: page.style.apply(lambda x: ['background-color: #f7fafc' if i % 2 == 0 else '' for i in range(len(x))], axis=0),
+                        use_container_width=True
                     )
                     
                     # Summary stats
@@ -1866,22 +2244,10 @@ with ai_tab1:
                             break
                     
                     if status_col:
-                        status_counts = drill_df[status_col].value_counts().reset_index()
-                        status_counts.columns = ["Status", "Count"]
-                        
-                        fig_status = px.pie(
-                            status_counts,
-                            names="Status",
-                            values="Count",
-                            hole=0.45,
-                            title="Subject Status Distribution",
-                            color_discrete_sequence=px.colors.qualitative.Set3
-                        )
-                        fig_status.update_layout(
-                            height=350,
-                            paper_bgcolor='white',
-                            plot_bgcolor='white',
-                            font=dict(color="#2d3748")
+                        fig_status = cached_figure(
+                            "ai_status_pie",
+                            (filter_key, status_col),
+                            lambda: create_status_pie(drill_df[status_col])
                         )
                         st.plotly_chart(fig_status, use_container_width=True)
                     else:
@@ -1890,40 +2256,10 @@ with ai_tab1:
                 # ---- DQI Band Pie ----
                 with c2:
                     if "dqi" in drill_df.columns:
-                        dqi_bins = pd.cut(
-                            drill_df["dqi"],
-                            bins=[0, 40, 60, 85, 100],
-                            labels=[
-                                "Critical (<40)",
-                                "At Risk (40–59)",
-                                "Acceptable (60–84)",
-                                "High Quality (85+)"
-                            ]
-                        )
-                        dqi_dist = dqi_bins.value_counts().reset_index()
-                        dqi_dist.columns = ["DQI Band", "Count"]
-                        
-                        color_map = {
-                            "Critical (<40)": "#e53e3e",
-                            "At Risk (40–59)": "#d69e2e",
-                            "Acceptable (60–84)": "#4299e1",
-                            "High Quality (85+)": "#38a169"
-                        }
-                        
-                        fig_dqi = px.pie(
-                            dqi_dist,
-                            names="DQI Band",
-                            values="Count",
-                            hole=0.45,
-                            title="DQI Quality Breakdown",
-                            color="DQI Band",
-                            color_discrete_map=color_map
-                        )
-                        fig_dqi.update_layout(
-                            height=350,
-                            paper_bgcolor='white',
-                            plot_bgcolor='white',
-                            font=dict(color="#2d3748")
+                        fig_dqi = cached_figure(
+                            "ai_dqi_band_pie",
+                            filter_key,
+                            lambda: create_dqi_band_pie(drill_df["dqi"])
                         )
                         st.plotly_chart(fig_dqi, use_container_width=True)
                     else:
@@ -1938,23 +2274,25 @@ with ai_tab1:
                     st.markdown('<div class="content-card">', unsafe_allow_html=True)
                     st.markdown("## ⬇ Download Options")
                     
-                    # Prepare data for download
-                    csv_data = site_perf.to_csv(index=False)
-                    
                     col1, col2 = st.columns(2)
                     
+                    # Both files are generated only when their button is clicked
                     with col1:
-                        st.download_button(
+                        export_download_button(
                             "📥 Download Site Performance (CSV)",
-                            csv_data,
-                            "site_performance_summary.csv",
-                            mime="text/csv",
+                            summary_key + ("site_performance",),
+                            lambda: site_perf,
+                            "csv",
+                            "site_performance_summary",
                             use_container_width=True
                         )
                     
                     with col2:
+                        risk_table = rf_df if 'rf_df' in locals() else pd.DataFrame()
+
                         # Create a summary report
-                        report_text = f"""CLINICAL TRIAL SITE PERFORMANCE REPORT
+                        def build_report():
+                            return f"""CLINICAL TRIAL SITE PERFORMANCE REPORT
 Generated: {pd.Timestamp.now().strftime('%Y-%m-%d %H:%M')}
 
 ============================================
@@ -1980,7 +2318,7 @@ Confidence Score: {metrics.get('confidence_score', 'N/A') if isinstance(result,
 
 RISK FINGERPRINT SITES
 ----------------------
-{rf_df.to_string(index=False) if 'rf_df' in locals() and not rf_df.empty else 'No risk sites identified'}
+{risk_table.to_string(index=False) if not risk_table.empty else 'No risk sites identified'}
 
 ACTION PRIORITIES
 -----------------
@@ -1991,7 +2329,7 @@ Report generated by Clinical Data Quality Dashboard
 """
                         st.download_button(
                             "📥 Download Executive Report (TXT)",
-                            report_text,
+                            build_report,
                             "clinical_site_summary.txt",
                             mime="text/plain",
                             use_container_width=True
@@ -2006,8 +2344,14 @@ Report generated by Clinical Data Quality Dashboard
                     st.code(traceback.format_exc())
         else:
             st.info("Click the button above to generate a comprehensive site summary analysis.")
+
+with ai_tab1:
+    if ai_tab1.open:
+        site_summary_section(drill_df, site_rollup, filter_key)
+
 # Tab 2: Agent Recommendations (keeping original)
-with ai_tab2:
+@st.fragment
+def agent_recommendations_section(drill_df):
     st.markdown("### AI Agent Recommendations")
     st.markdown("<p style='color: #4a5568; font-size: 16px;'>Get personalized agent deployment recommendations based on data quality patterns.</p>", unsafe_allow_html=True)
     
@@ -2044,13 +2388,54 @@ with ai_tab2:
         else:
             st.info("Click the button above to generate agent deployment recommendations.")
 
+with ai_tab2:
+    if ai_tab2.open:
+        agent_recommendations_section(drill_df)
+
 # Tab 3: Natural Language Query (keeping original)
-with ai_tab3:
+@st.fragment
+def nlq_section(drill_df, site_dqi):
     st.markdown("### Natural Language Query")
     st.markdown("<p style='color: #4a5568; font-size: 16px;'>Ask questions about your data in plain English and get instant insights.</p>", unsafe_allow_html=True)
     
     # Call the NLQ interface directly
-    nlq_interface(drill_df)
+    nlq_interface(drill_df, site_dqi)
+
+with ai_tab3:
+    if ai_tab3.open:
+        nlq_section(drill_df, site_rollup['dqi_mean'])
+
+# =========================
+# MEMORY REPORT
+# =========================
+if st.sidebar.toggle("🧠 Memory report", key="show_memory_report"):
+    report = memory_report(
+        shared={
+            "Analytics dataset": df_full,
+            "Queries dataset": queries_df_full,
+            "Aggregate cube": load_cube(*scope).cells,
+            "Query links": load_query_links(dataset_version),
+        },
+        session={
+            "Filtered view": df,
+            "Queries in scope": queries_df,
+            "Site rollup": site_rollup,
+            "Session state": dict(st.session_state),
+        },
+    )
+    st.sidebar.dataframe(report, hide_index=True, use_container_width=True)
+    session_mb = report.loc[report["Scope"] == "this session", "MB"].sum()
+    rss_mb = peak_rss_mb()
+    st.sidebar.caption(
+        f"This session adds {session_mb:.2f} MB on top of the shared data"
+        + (f" · process peak RSS {rss_mb:,.0f} MB" if rss_mb else "")
+    )
+    if "compact_schema" in df_full.attrs:
+        before, after = df_full.attrs["compact_schema"]
+        st.sidebar.caption(
+            f"Compact schema: master data {before / 1024 ** 2:.1f} MB → {after / 1024 ** 2:.1f} MB "
+            f"({before - after:,} bytes saved)"
+        )
 
 # =========================
 # FOOTER
@@ -0,0 +1,145 @@
+# benchmarks/rerun_memory.py
+"""
+Peak memory and allocations of the dashboard on a synthetic master dataset.
+
+Builds a throwaway copy of the app (its code plus generated data),
+renders it once with streamlit's AppTest to fill the caches, then measures
+one full rerun with tracemalloc. The rerun is what every widget
+interaction costs, so it is what copies and per-session frames show up in.
+
+    python benchmarks/rerun_memory.py --rows 200000
+    python benchmarks/rerun_memory.py --rows 200000 --max-peak-mb 150
+
+With --max-peak-mb the script exits with status 1 when the rerun peak is
+above the limit, so it can guard against regressions.
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+APP_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(APP_DIR))
+
+from utils.data_loader import COLUMN_MAP, DIMENSION_COLS  # noqa: E402
+
+LINKED = ["ai", "assets", "pages", "qc_pipeline", "utils"]
+
+
+# =========================
+# SYNTHETIC DATA
+# =========================
+def synthetic_master(rows, sites=2_000, seed=0):
+    """Raw master rows (export column names) spread over regions, countries and sites."""
+    rng = np.random.default_rng(seed)
+    raw = {col: name for name, col in COLUMN_MAP.items()}
+    countries = {"EMEA": ["DEU", "FRA", "GBR", "ESP"], "APAC": ["JPN", "CHN", "AUS"], "AMER": ["USA", "CAN", "BRA"]}
+
+    site = rng.integers(0, sites, rows)
+    region = np.array(list(countries))[site % len(countries)]
+    country = [countries[r][s % len(countries[r])] for r, s in zip(region, site)]
+
+    frame = {raw[col]: rng.integers(0, 20, rows) for col in COLUMN_MAP.values() if col not in DIMENSION_COLS}
+    frame[raw["study"]] = [f"Study {s % 12}" for s in site]
+    frame[raw["region"]] = region
+    frame[raw["country"]] = country
+    frame[raw["site_id"]] = [f"Site {s}" for s in site]
+    frame[raw["patient_id"]] = [f"Subject {i}" for i in range(rows)]
+    frame[raw["latest_visit"]] = "W2"
+    frame[raw["subject_status"]] = rng.choice(["On Trial", "Screen Failure", "Completed"], rows)
+    return pd.DataFrame(frame)
+
+
+def synthetic_queries(rows, seed=1):
+    rng = np.random.default_rng(seed)
+    subjects = rng.choice(rows, size=min(rows, 50_000), replace=False)
+    return pd.DataFrame({
+        "Subject Name": [f"Subject {i}" for i in subjects],
+        "Open Queries": rng.integers(0, 20, len(subjects)),
+        "Closed Queries": rng.integers(0, 20, len(subjects)),
+        "Average Query Close Duration (Days)": rng.uniform(1, 30, len(subjects)),
+    })
+
+
+def build_app_copy(root, rows):
+    """
+    App code in `root`, with generated data/ next to it. app.py is copied
+    (Streamlit resolves symlinks, and the app finds data/ next to itself);
+    the packages are linked.
+    """
+    shutil.copy(APP_DIR / "app.py", root / "app.py")
+    for name in LINKED:
+        (root / name).symlink_to(APP_DIR / name)
+    data_dir = root / "data"
+    data_dir.mkdir()
+    synthetic_master(rows).to_csv(data_dir / "master_dataset.csv", index=False)
+    synthetic_queries(rows).to_csv(data_dir / "queries.csv", index=False)
+    return root / "app.py"
+
+
+# =========================
+# MEASUREMENT
+# =========================
+def measure(run):
+    """(seconds, peak MB, blocks still allocated afterwards) for run()."""
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    tracemalloc.reset_peak()
+    start = time.perf_counter()
+    run()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    blocks = sum(stat.count_diff for stat in after.compare_to(before, "filename") if stat.count_diff > 0)
+    return elapsed, peak / 1024 ** 2, blocks
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--rows", type=int, default=200_000, help="synthetic master rows")
+    parser.add_argument("--max-peak-mb", type=float, default=None, help="fail when the rerun peak is above this")
+    args = parser.parse_args()
+
+    from streamlit.testing.v1 import AppTest
+
+    # The AI tools are never clicked here; the client only needs a key to import
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
+
+    root = Path(tempfile.mkdtemp(prefix="dashboard-bench-"))
+    try:
+        print(f"🧪 Generating {args.rows:,} master rows in {root}")
+        app_path = build_app_copy(root, args.rows)
+        at = AppTest.from_file(str(app_path), default_timeout=600)
+
+        results = {
+            "first render (cold caches)": measure(at.run),
+            "rerun (warm caches)": measure(at.run),
+        }
+        if at.exception:
+            print(f"❌ App raised: {[e.value for e in at.exception]}")
+            return 1
+
+        print(f"\n{'run':<28}{'seconds':>10}{'peak MB':>12}{'new blocks':>14}")
+        for name, (elapsed, peak_mb, blocks) in results.items():
+            print(f"{name:<28}{elapsed:>10.2f}{peak_mb:>12.1f}{blocks:>14,}")
+
+        rerun_peak = results["rerun (warm caches)"][1]
+        if args.max_peak_mb is not None and rerun_peak > args.max_peak_mb:
+            print(f"\n❌ Rerun peak {rerun_peak:.1f} MB is above the {args.max_peak_mb:.1f} MB limit")
+            return 1
+        return 0
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,7 +4,17 @@ from pathlib import Path
 import zipfile
 import shutil
 import time
+import pandas as pd
 from qc_pipeline.pipeline import run_qc_pipeline
+from qc_pipeline.results_cache import (
+    hash_archive,
+    lookup_results,
+    store_results,
+    load_results,
+    capture_trace,
+)
+from utils.exports import ExportCache, export_bytes
+from utils.paged_table import paged_dataframe
 
 # Load external CSS from ../assets/css/upload.css
 def load_css():
@@ -299,6 +309,181 @@ uploaded_zip = st.file_uploader(
 
 BASE_UPLOAD_DIR = Path("uploaded_data")
 BASE_UPLOAD_DIR.mkdir(exist_ok=True)
+RESULTS_DIR = BASE_UPLOAD_DIR / "results"
+
+# =========================
+# RESULTS DISPLAY
+# =========================
+@st.cache_resource
+def export_cache():
+    # Generated report files per archive, shared across sessions
+    return ExportCache(max_entries=4)
+
+def render_results(final_qc_df, output_file=None, trace=None, token=None):
+    """Show QC results - used for fresh runs and for cached archives alike.
+    token identifies the results (the archive hash) for the paged table."""
+    # Quarantined workbooks - the run finished without them
+    quarantine = final_qc_df.attrs.get("quarantine", [])
+    if quarantine:
+        st.warning(
+            f"⚠️ Partial result: {len(quarantine)} file(s) were quarantined and left out of this run. "
+            "Metrics for the affected studies may be incomplete."
+        )
+        with st.expander("🚫 Quarantined Files", expanded=True):
+            st.dataframe(
+                pd.DataFrame(quarantine).rename(columns={
+                    "file": "File",
+                    "study": "Study Folder",
+                    "stage": "Stage",
+                    "reason": "Reason",
+                    "size_mb": "Size (MB)",
+                    "elapsed_s": "Elapsed (s)",
+                }),
+                use_container_width=True,
+                hide_index=True
+            )
+
+    st.markdown("### 📋 QC Analysis Results")
+    
+    # Summary metrics in cards - use 4 columns
+    st.markdown("<br>", unsafe_allow_html=True)
+    
+    # Create wider metric cards
+    col1, col2, col3, col4 = st.columns(4)
+    
+    with col1:
+        total_studies = final_qc_df["Study Key"].nunique()
+        st.markdown(f"""
+        <div class="metric-card">
+            <div class="metric-value">{total_studies}</div>
+            <div class="metric-label">Total Studies</div>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    with col2:
+        total_subjects = final_qc_df["Subject"].nunique()
+        st.markdown(f"""
+        <div class="metric-card">
+            <div class="metric-value">{total_subjects}</div>
+            <div class="metric-label">Total Subjects</div>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    with col3:
+        coded_terms = final_qc_df["Coded"].sum() if "Coded" in final_qc_df.columns else 0
+        st.markdown(f"""
+        <div class="metric-card">
+            <div class="metric-value">{coded_terms}</div>
+            <div class="metric-label">Coded Terms</div>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    with col4:
+        uncoded_terms = final_qc_df["UnCoded"].sum() if "UnCoded" in final_qc_df.columns else 0
+        st.markdown(f"""
+        <div class="metric-card">
+            <div class="metric-value">{uncoded_terms}</div>
+            <div class="metric-label">Uncoded Terms</div>
+        </div>
+        """, unsafe_allow_html=True)
+    
+    st.markdown("<br><br>", unsafe_allow_html=True)
+    
+    # Dataframe with FULL WIDTH
+    st.markdown("### 📊 Detailed Analysis Table")
+    st.markdown("""
+    <div style="margin: 20px 0; color: #a0aec0; font-size: 1.1rem;">
+        Complete quality check results for all studies
+    </div>
+    """, unsafe_allow_html=True)
+    
+    # Configure column display for better width
+    column_config = {}
+    for col in final_qc_df.columns:
+        if col == "Study Key":
+            column_config[col] = st.column_config.NumberColumn(
+                "Study ID", 
+                width="large",
+                help="Unique study identifier"
+            )
+        elif col == "Subject":
+            column_config[col] = st.column_config.TextColumn(
+                "Subject ID", 
+                width="xlarge",
+                help="Patient/subject identifier"
+            )
+        elif col in ["Coded", "UnCoded", "LnR", "EDRR", "Inactivated", "DM", "Safety", "Missing Pages", "Missing Visits"]:
+            column_config[col] = st.column_config.NumberColumn(
+                col, 
+                width="medium",
+                help=f"{col} metrics"
+            )
+        else:
+            column_config[col] = st.column_config.Column(width="medium")
+    
+    # One page at a time; sorting and filtering run on the server
+    paged_dataframe(
+        final_qc_df,
+        key="qc_results",
+        token=token,
+        use_container_width=True,
+        column_config=column_config,
+        hide_index=True
+    )
+    
+    # Additional summary statistics with WHITE TEXT
+    st.markdown("<br>", unsafe_allow_html=True)
+    st.markdown("### 📈 Summary Statistics")
+    
+    # Use 3 columns for stats
+    col1, col2, col3 = st.columns(3)
+    
+    with col1:
+        if "DM" in final_qc_df.columns:
+            total_dm = final_qc_df["DM"].sum()
+            avg_dm = final_qc_df["DM"].mean()
+            st.metric("Total DM Reviews", f"{total_dm:,}", f"Average: {avg_dm:.1f}")
+    
+    with col2:
+        if "Safety" in final_qc_df.columns:
+            total_safety = final_qc_df["Safety"].sum()
+            avg_safety = final_qc_df["Safety"].mean()
+            st.metric("Total Safety Reviews", f"{total_safety:,}", f"Average: {avg_safety:.1f}")
+    
+    with col3:
+        issues_total = 0
+        if "LnR" in final_qc_df.columns:
+            issues_total += final_qc_df["LnR"].sum()
+        if "EDRR" in final_qc_df.columns:
+            issues_total += final_qc_df["EDRR"].sum()
+        st.metric("Total Issues Found", f"{issues_total:,}")
+    
+    # Download button
+    st.markdown("<br><br>", unsafe_allow_html=True)
+    # Written in chunks only when clicked, then reused for the same archive
+    cache = export_cache()
+    st.download_button(
+        label="📥 **DOWNLOAD FULL ANALYSIS REPORT (CSV)**",
+        data=lambda: cache.get((token or id(final_qc_df), "qc_results", "csv"), lambda: export_bytes(final_qc_df, "csv")),
+        file_name=f"qc_analysis_report_{time.strftime('%Y%m%d_%H%M%S')}.csv",
+        mime="text/csv",
+        use_container_width=True
+    )
+
+    # Merged CPID output written by the pipeline
+    if output_file is not None and Path(output_file).exists():
+        st.download_button(
+            label="📥 **DOWNLOAD MERGED CPID OUTPUT (XLSX)**",
+            data=lambda: Path(output_file).read_bytes(),
+            file_name=Path(output_file).name,
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            use_container_width=True
+        )
+
+    # Pipeline log for this run
+    if trace:
+        with st.expander("🧾 Pipeline Trace"):
+            st.code(trace, language="text")
 
 # =========================
 # FILE PROCESSING - FULL WIDTH
@@ -313,7 +498,34 @@ if uploaded_zip:
         <div class="file-info-detail"><strong>Type:</strong> ZIP Archive</div>
     </div>
     """, unsafe_allow_html=True)
-    
+
+    # Same archive processed before? Serve the stored results
+    archive_hash = hash_archive(uploaded_zip)
+    cached_entry = lookup_results(archive_hash, RESULTS_DIR)
+    force_reprocess = False
+    # A run that just finished in this session is served from the store on
+    # later reruns (pager, sort, filter), even with force reprocess ticked
+    just_processed = st.session_state.get("qc_fresh_result") == archive_hash
+
+    if cached_entry:
+        if just_processed:
+            st.info(f"✅ Showing the results of the run just completed ({cached_entry['rows']} rows).")
+        else:
+            st.info(
+                f"♻️ This exact archive was already processed on {cached_entry['processed_at']} "
+                f"({cached_entry['rows']} rows). Showing the stored results."
+            )
+        force_reprocess = st.checkbox(
+            "🔁 Force reprocess (extract and run the full QC pipeline again)",
+            key=f"force_reprocess_{archive_hash}",
+            on_change=lambda: st.session_state.pop("qc_fresh_result", None)
+        )
+
+if uploaded_zip and cached_entry and (just_processed or not force_reprocess):
+    final_qc_df, trace, output_file = load_results(cached_entry, RESULTS_DIR)
+    render_results(final_qc_df, output_file=output_file, trace=trace, token=archive_hash)
+
+elif uploaded_zip:
     # Create extraction directory
     extract_dir = BASE_UPLOAD_DIR / uploaded_zip.name.replace(".zip", "")
     
@@ -371,7 +583,20 @@ if uploaded_zip:
             
             # Run the actual pipeline
             print(f"Starting QC pipeline on: {extract_dir}")
-            final_qc_df = run_qc_pipeline(root_dir=extract_dir)
+            with capture_trace() as trace_buffer:
+                final_qc_df = run_qc_pipeline(root_dir=extract_dir)
+            trace = trace_buffer.getvalue()
+
+            # Register in the results index so a re-upload is served instantly
+            store_results(
+                archive_hash,
+                final_qc_df,
+                archive_name=uploaded_zip.name,
+                trace=trace,
+                output_file=final_qc_df.attrs.get("output_file"),
+                results_dir=RESULTS_DIR
+            )
+            st.session_state["qc_fresh_result"] = archive_hash
             
             # Complete progress
             progress_bar.progress(100)
@@ -394,129 +619,11 @@ if uploaded_zip:
             
             # Display results
             with results_placeholder.container():
-                st.markdown("### 📋 QC Analysis Results")
-                
-                # Summary metrics in cards - use 4 columns
-                st.markdown("<br>", unsafe_allow_html=True)
-                
-                # Create wider metric cards
-                col1, col2, col3, col4 = st.columns(4)
-                
-                with col1:
-                    total_studies = final_qc_df["Study Key"].nunique()
-                    st.markdown(f"""
-                    <div class="metric-card">
-                        <div class="metric-value">{total_studies}</div>
-                        <div class="metric-label">Total Studies</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                
-                with col2:
-                    total_subjects = final_qc_df["Subject"].nunique()
-                    st.markdown(f"""
-                    <div class="metric-card">
-                        <div class="metric-value">{total_subjects}</div>
-                        <div class="metric-label">Total Subjects</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                
-                with col3:
-                    coded_terms = final_qc_df["Coded"].sum() if "Coded" in final_qc_df.columns else 0
-                    st.markdown(f"""
-                    <div class="metric-card">
-                        <div class="metric-value">{coded_terms}</div>
-                        <div class="metric-label">Coded Terms</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                
-                with col4:
-                    uncoded_terms = final_qc_df["UnCoded"].sum() if "UnCoded" in final_qc_df.columns else 0
-                    st.markdown(f"""
-                    <div class="metric-card">
-                        <div class="metric-value">{uncoded_terms}</div>
-                        <div class="metric-label">Uncoded Terms</div>
-                    </div>
-                    """, unsafe_allow_html=True)
-                
-                st.markdown("<br><br>", unsafe_allow_html=True)
-                
-                # Dataframe with FULL WIDTH
-                st.markdown("### 📊 Detailed Analysis Table")
-                st.markdown("""
-                <div style="margin: 20px 0; color: #a0aec0; font-size: 1.1rem;">
-                    Complete quality check results for all studies
-                </div>
-                """, unsafe_allow_html=True)
-                
-                # Configure column display for better width
-                column_config = {}
-                for col in final_qc_df.columns:
-                    if col == "Study Key":
-                        column_config[col] = st.column_config.NumberColumn(
-                            "Study ID", 
-                            width="large",
-                            help="Unique study identifier"
-                        )
-                    elif col == "Subject":
-                        column_config[col] = st.column_config.TextColumn(
-                            "Subject ID", 
-                            width="xlarge",
-                            help="Patient/subject identifier"
-                        )
-                    elif col in ["Coded", "UnCoded", "LnR", "EDRR", "Inactivated", "DM", "Safety", "Missing Pages", "Missing Visits"]:
-                        column_config[col] = st.column_config.NumberColumn(
-                            col, 
-                            width="medium",
-                            help=f"{col} metrics"
-                        )
-                    else:
-                        column_config[col] = st.column_config.Column(width="medium")
-                
-                # Display dataframe with MAXIMUM width and height
-                st.dataframe(
+                render_results(
                     final_qc_df,
-                    use_container_width=True,
-                    height=700,  # Even taller for more rows
-                    column_config=column_config,
-                    hide_index=True
-                )
-                
-                # Additional summary statistics with WHITE TEXT
-                st.markdown("<br>", unsafe_allow_html=True)
-                st.markdown("### 📈 Summary Statistics")
-                
-                # Use 3 columns for stats
-                col1, col2, col3 = st.columns(3)
-                
-                with col1:
-                    if "DM" in final_qc_df.columns:
-                        total_dm = final_qc_df["DM"].sum()
-                        avg_dm = final_qc_df["DM"].mean()
-                        st.metric("Total DM Reviews", f"{total_dm:,}", f"Average: {avg_dm:.1f}")
-                
-                with col2:
-                    if "Safety" in final_qc_df.columns:
-                        total_safety = final_qc_df["Safety"].sum()
-                        avg_safety = final_qc_df["Safety"].mean()
-                        st.metric("Total Safety Reviews", f"{total_safety:,}", f"Average: {avg_safety:.1f}")
-                
-                with col3:
-                    issues_total = 0
-                    if "LnR" in final_qc_df.columns:
-                        issues_total += final_qc_df["LnR"].sum()
-                    if "EDRR" in final_qc_df.columns:
-                        issues_total += final_qc_df["EDRR"].sum()
-                    st.metric("Total Issues Found", f"{issues_total:,}")
-                
-                # Download button
-                st.markdown("<br><br>", unsafe_allow_html=True)
-                csv_data = final_qc_df.to_csv(index=False)
-                st.download_button(
-                    label="📥 **DOWNLOAD FULL ANALYSIS REPORT (CSV)**",
-                    data=csv_data,
-                    file_name=f"qc_analysis_report_{time.strftime('%Y%m%d_%H%M%S')}.csv",
-                    mime="text/csv",
-                    use_container_width=True
+                    output_file=final_qc_df.attrs.get("output_file"),
+                    trace=trace,
+                    token=archive_hash
                 )
                 
         except Exception as e:
@@ -0,0 +1,125 @@
+# qc_pipeline/file_guard.py
+import multiprocessing
+import time
+from pathlib import Path
+
+import pandas as pd
+
+# =================================================
+# DEADLINES
+# =================================================
+
+DEFAULT_FILE_TIMEOUT = 120   # seconds allowed to parse a single workbook
+DEFAULT_RUN_TIMEOUT = 1800   # seconds allowed for all parsing in one run
+
+
+class QuarantinedFileError(Exception):
+    """Raised when a workbook timed out, failed to parse or is already quarantined."""
+
+
+def _read_excel_worker(file_path, read_kwargs):
+    """Runs inside the worker process."""
+    return pd.read_excel(file_path, **read_kwargs)
+
+
+# =================================================
+# FILE GUARD
+# =================================================
+
+class FileGuard:
+    """
+    Parses Excel files in a worker process with a per-file deadline.
+
+    A file that times out or fails to parse is added to `quarantine`
+    (reason, size, elapsed time) and every later read of it is refused
+    immediately, so one pathological workbook costs at most one deadline.
+    Once the run budget is spent, remaining files are quarantined unread.
+    """
+
+    def __init__(self, file_timeout=DEFAULT_FILE_TIMEOUT, run_timeout=DEFAULT_RUN_TIMEOUT):
+        self.file_timeout = file_timeout
+        self.run_deadline = time.monotonic() + run_timeout if run_timeout else None
+        self.quarantine = []
+        self._quarantined = set()
+        self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    @property
+    def partial(self):
+        return bool(self.quarantine)
+
+    def close(self):
+        if self._pool is not None:
+            self._pool.terminate()
+            self._pool.join()
+            self._pool = None
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(processes=1)
+        return self._pool
+
+    def _time_left(self):
+        timeouts = []
+        if self.file_timeout:
+            timeouts.append(self.file_timeout)
+        if self.run_deadline is not None:
+            timeouts.append(self.run_deadline - time.monotonic())
+        return min(timeouts) if timeouts else None
+
+    def _add(self, file_path: Path, stage, reason, elapsed):
+        try:
+            size_mb = file_path.stat().st_size / 1024 / 1024
+        except OSError:
+            size_mb = None
+
+        self._quarantined.add(str(file_path.resolve()))
+        self.quarantine.append({
+            "file": file_path.name,
+            "study": file_path.parent.name,
+            "stage": stage,
+            "reason": reason,
+            "size_mb": round(size_mb, 2) if size_mb is not None else None,
+            "elapsed_s": round(elapsed, 2),
+        })
+        print(f"🚫 Quarantined {file_path.name} ({stage}): {reason} after {elapsed:.1f}s")
+
+    def read_excel(self, file_path, stage="", **read_kwargs):
+        file_path = Path(file_path)
+
+        if str(file_path.resolve()) in self._quarantined:
+            raise QuarantinedFileError(f"{file_path.name} is quarantined")
+
+        timeout = self._time_left()
+        if timeout is not None and timeout <= 0:
+            self._add(file_path, stage, "Run deadline reached before parsing", 0.0)
+            raise QuarantinedFileError(f"{file_path.name} skipped: run deadline reached")
+
+        start = time.monotonic()
+        try:
+            result = self._get_pool().apply_async(
+                _read_excel_worker, (str(file_path), read_kwargs)
+            )
+            return result.get(timeout)
+        except multiprocessing.TimeoutError:
+            # The worker is stuck inside the parser - kill it, start fresh next time
+            self.close()
+            elapsed = time.monotonic() - start
+            self._add(file_path, stage, f"Parse exceeded {timeout:.0f}s deadline", elapsed)
+            raise QuarantinedFileError(f"{file_path.name} timed out after {elapsed:.1f}s")
+        except Exception as e:
+            elapsed = time.monotonic() - start
+            self._add(file_path, stage, f"{type(e).__name__}: {e}", elapsed)
+            raise QuarantinedFileError(f"{file_path.name} could not be parsed: {e}") from e
+
+
+def read_excel(file_path, guard: FileGuard = None, stage="", **read_kwargs):
+    """pd.read_excel, routed through `guard` when one is given."""
+    if guard is None:
+        return pd.read_excel(file_path, **read_kwargs)
+    return guard.read_excel(file_path, stage=stage, **read_kwargs)
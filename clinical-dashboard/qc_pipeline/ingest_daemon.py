@@ -0,0 +1,341 @@
+# qc_pipeline/ingest_daemon.py
+"""
+Watch-folder ingestion service.
+
+Polls a directory for export ZIPs, skips archives whose content hash has
+already been processed, and runs the QC pipeline on a pool of worker
+processes. Results are registered in the same results index the upload
+page uses, so a ZIP ingested here is served instantly if someone uploads
+it by hand later.
+
+Usage (from the clinical-dashboard folder):
+    python -m qc_pipeline.ingest_daemon --watch /shared/exports --workers 2
+"""
+import argparse
+import json
+import os
+import shutil
+import signal
+import time
+import zipfile
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+from pathlib import Path
+
+from qc_pipeline.file_guard import DEFAULT_FILE_TIMEOUT, DEFAULT_RUN_TIMEOUT
+from qc_pipeline.results_cache import (
+    DEFAULT_RESULTS_DIR,
+    hash_archive,
+    lookup_results,
+    store_results,
+    capture_trace,
+)
+
+DEFAULT_STATE_DIR = Path("uploaded_data") / "ingest"
+RECENT_JOBS_KEPT = 50
+
+
+# =================================================
+# WORKER
+# =================================================
+
+def process_archive(zip_path, archive_hash, work_dir, results_dir, file_timeout, run_timeout):
+    """
+    Runs in a worker process: extract, run the pipeline, store results.
+    Returns a small summary dict; exceptions propagate to the scheduler.
+    """
+    from qc_pipeline.pipeline import run_qc_pipeline
+
+    zip_path = Path(zip_path)
+    job_dir = Path(work_dir) / archive_hash[:16]
+    extract_dir = job_dir / zip_path.stem
+
+    # A retry starts from a clean copy - the pipeline renames files in place
+    if job_dir.exists():
+        shutil.rmtree(job_dir)
+    extract_dir.mkdir(parents=True)
+
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        zip_ref.extractall(extract_dir)
+
+    start = time.monotonic()
+    with capture_trace() as trace_buffer:
+        final_qc_df = run_qc_pipeline(
+            root_dir=extract_dir,
+            file_timeout=file_timeout,
+            run_timeout=run_timeout
+        )
+    elapsed = time.monotonic() - start
+
+    store_results(
+        archive_hash,
+        final_qc_df,
+        archive_name=zip_path.name,
+        trace=trace_buffer.getvalue(),
+        output_file=final_qc_df.attrs.get("output_file"),
+        results_dir=results_dir
+    )
+
+    return {
+        "rows": int(len(final_qc_df)),
+        "partial": bool(final_qc_df.attrs.get("partial", False)),
+        "quarantined": len(final_qc_df.attrs.get("quarantine", [])),
+        "pipeline_s": round(elapsed, 2),
+    }
+
+
+# =================================================
+# SCHEDULER
+# =================================================
+
+class IngestDaemon:
+    def __init__(
+        self,
+        watch_dir,
+        state_dir=DEFAULT_STATE_DIR,
+        results_dir=DEFAULT_RESULTS_DIR,
+        workers=2,
+        max_queue=8,
+        retries=2,
+        retry_backoff=30,
+        poll_interval=10,
+        file_timeout=DEFAULT_FILE_TIMEOUT,
+        run_timeout=DEFAULT_RUN_TIMEOUT,
+    ):
+        self.watch_dir = Path(watch_dir)
+        self.state_dir = Path(state_dir)
+        self.results_dir = Path(results_dir)
+        self.work_dir = self.state_dir / "work"
+        self.status_path = self.state_dir / "ingest_status.json"
+
+        self.workers = workers
+        self.max_queue = max_queue
+        self.retries = retries
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self.file_timeout = file_timeout
+        self.run_timeout = run_timeout
+
+        self.pending = deque()      # jobs waiting for a worker
+        self.in_flight = {}         # future -> job
+        self.known_hashes = set()   # queued, running or done this session
+        self.recent_jobs = deque(maxlen=RECENT_JOBS_KEPT)
+        self.completed = 0
+        self.failed = 0
+        self._sizes = {}            # path -> (size, mtime) seen on the previous poll
+        self._hashes = {}           # path -> ((size, mtime), SHA-256) of settled archives
+        self._stop = False
+
+    # ---- discovery ----
+
+    def _is_stable(self, path: Path):
+        """A ZIP is only picked up once its size and mtime stop changing between polls."""
+        stat = path.stat()
+        signature = (stat.st_size, stat.st_mtime_ns)
+        previous = self._sizes.get(path)
+        self._sizes[path] = signature
+        return previous == signature
+
+    def _hash(self, path: Path):
+        """SHA-256 of a settled archive, re-read only when its size or mtime changed."""
+        signature = self._sizes[path]
+        cached = self._hashes.get(path)
+        if cached is None or cached[0] != signature:
+            cached = (signature, hash_archive(path))
+            self._hashes[path] = cached
+        return cached[1]
+
+    def scan(self):
+        """Queue new, settled archives. Returns how many were left for a later scan."""
+        deferred = 0
+        paths = sorted(self.watch_dir.glob("*.zip"))
+
+        # Forget archives that were removed from the folder
+        present = set(paths)
+        for seen in (self._sizes, self._hashes):
+            for path in [p for p in seen if p not in present]:
+                del seen[path]
+
+        for path in paths:
+            try:
+                if not self._is_stable(path):
+                    deferred += 1
+                    continue
+                archive_hash = self._hash(path)
+            except OSError as e:
+                print(f"⚠ Could not read {path.name}: {e}")
+                continue
+
+            if archive_hash in self.known_hashes:
+                continue
+
+            # Back-pressure: leave new arrivals in the folder until there is room
+            if len(self.pending) + len(self.in_flight) >= self.max_queue:
+                deferred += 1
+                continue
+            self.known_hashes.add(archive_hash)
+
+            if lookup_results(archive_hash, self.results_dir):
+                print(f"♻️ {path.name} already processed ({archive_hash[:12]}…), skipping")
+                continue
+
+            print(f"📥 Queued {path.name} ({archive_hash[:12]}…)")
+            self.pending.append({
+                "archive": path.name,
+                "path": str(path),
+                "hash": archive_hash,
+                "attempts": 0,
+                "queued_at": time.time(),
+                "not_before": 0.0,
+            })
+
+        return deferred
+
+    # ---- execution ----
+
+    def _submit_ready(self, executor):
+        now = time.time()
+        for _ in range(len(self.pending)):
+            if len(self.in_flight) >= self.workers:
+                break
+            job = self.pending.popleft()
+            if job["not_before"] > now:
+                self.pending.append(job)
+                continue
+
+            job["attempts"] += 1
+            job["started_at"] = time.time()
+            future = executor.submit(
+                process_archive,
+                job["path"],
+                job["hash"],
+                str(self.work_dir),
+                str(self.results_dir),
+                self.file_timeout,
+                self.run_timeout,
+            )
+            future.add_done_callback(lambda _, job=job: job.update(finished_at=time.time()))
+            self.in_flight[future] = job
+            print(f"⚙️ Started {job['archive']} (attempt {job['attempts']})")
+
+    def _collect_finished(self):
+        for future in [f for f in self.in_flight if f.done()]:
+            job = self.in_flight.pop(future)
+            finished_at = job.pop("finished_at", time.time())
+            record = {
+                "archive": job["archive"],
+                "hash": job["hash"],
+                "attempts": job["attempts"],
+                "queued_at": datetime.fromtimestamp(job["queued_at"]).isoformat(timespec="seconds"),
+                "finished_at": datetime.fromtimestamp(finished_at).isoformat(timespec="seconds"),
+                "wait_s": round(job["started_at"] - job["queued_at"], 2),
+                "latency_s": round(finished_at - job["started_at"], 2),
+            }
+
+            try:
+                record.update(future.result())
+                record["status"] = "done"
+                self.completed += 1
+                print(f"✅ Finished {job['archive']} in {record['latency_s']}s")
+            except Exception as e:
+                record["error"] = f"{type(e).__name__}: {e}"
+                if job["attempts"] <= self.retries:
+                    record["status"] = "retrying"
+                    job["not_before"] = time.time() + self.retry_backoff * job["attempts"]
+                    self.pending.append(job)
+                    print(f"🔁 {job['archive']} failed ({e}), retrying")
+                else:
+                    record["status"] = "failed"
+                    self.failed += 1
+                    print(f"❌ {job['archive']} failed after {job['attempts']} attempt(s): {e}")
+
+            self.recent_jobs.append(record)
+
+    # ---- status ----
+
+    def write_status(self):
+        latencies = [j["latency_s"] for j in self.recent_jobs if j["status"] == "done"]
+        status = {
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+            "watch_dir": str(self.watch_dir),
+            "workers": self.workers,
+            "queue_depth": len(self.pending),
+            "in_flight": [job["archive"] for job in self.in_flight.values()],
+            "completed": self.completed,
+            "failed": self.failed,
+            "avg_latency_s": round(sum(latencies) / len(latencies), 2) if latencies else None,
+            "recent_jobs": list(self.recent_jobs),
+        }
+
+        tmp_path = self.status_path.with_suffix(".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(status, f, indent=2)
+        os.replace(tmp_path, self.status_path)
+
+    # ---- main loop ----
+
+    def stop(self, *_):
+        print("🛑 Stopping after in-flight jobs finish…")
+        self._stop = True
+
+    def run(self, once=False):
+        self.watch_dir.mkdir(parents=True, exist_ok=True)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        self.results_dir.mkdir(parents=True, exist_ok=True)
+
+        print(f"👀 Watching {self.watch_dir} with {self.workers} worker(s)")
+
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            while not self._stop:
+                deferred = self.scan()
+                self._submit_ready(executor)
+                self._collect_finished()
+                self.write_status()
+
+                if once and not deferred and not self.pending and not self.in_flight:
+                    break
+                time.sleep(self.poll_interval)
+
+            # Drain whatever is already running
+            while self.in_flight:
+                time.sleep(1)
+                self._collect_finished()
+            self.write_status()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Watch a folder and run the QC pipeline on new export ZIPs")
+    parser.add_argument("--watch", required=True, help="Folder where export ZIPs are dropped")
+    parser.add_argument("--state-dir", default=str(DEFAULT_STATE_DIR), help="Work area and status file location")
+    parser.add_argument("--results-dir", default=str(DEFAULT_RESULTS_DIR), help="Shared results index")
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--max-queue", type=int, default=8, help="Max archives queued or running at once")
+    parser.add_argument("--retries", type=int, default=2)
+    parser.add_argument("--retry-backoff", type=float, default=30, help="Seconds, multiplied by attempt number")
+    parser.add_argument("--poll", type=float, default=10, help="Seconds between folder scans")
+    parser.add_argument("--file-timeout", type=float, default=DEFAULT_FILE_TIMEOUT)
+    parser.add_argument("--run-timeout", type=float, default=DEFAULT_RUN_TIMEOUT)
+    parser.add_argument("--once", action="store_true", help="Exit when the folder has been drained")
+    args = parser.parse_args()
+
+    daemon = IngestDaemon(
+        watch_dir=args.watch,
+        state_dir=args.state_dir,
+        results_dir=args.results_dir,
+        workers=args.workers,
+        max_queue=args.max_queue,
+        retries=args.retries,
+        retry_backoff=args.retry_backoff,
+        poll_interval=args.poll,
+        file_timeout=args.file_timeout,
+        run_timeout=args.run_timeout,
+    )
+
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run(once=args.once)
+
+
+if __name__ == "__main__":
+    main()
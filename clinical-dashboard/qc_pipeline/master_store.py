@@ -0,0 +1,235 @@
+# qc_pipeline/master_store.py
+import contextlib
+import json
+import os
+import time
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from utils.data_loader import (
+    DATASET_DIRNAME,
+    MANIFEST_NAME,
+    PARTITION_COLS,
+    ROW_GROUP_SIZE,
+    ds,
+    read_manifest,
+    to_master_frame,
+    to_master_table,
+    write_sample,
+)
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+# =================================================
+# MASTER DATASET STORAGE
+# =================================================
+# data/master_dataset.csv          - the data, only ever replaced atomically
+# data/master_dataset.csv.version  - {"version": n, ...}, bumped on every commit
+# data/master_dataset.csv.lock     - inter-process lock held only while committing
+# data/master_parquet/             - study/region partitioned copy the dashboard reads
+
+LOCK_TIMEOUT = 120      # seconds to wait for another pipeline's commit
+LOCK_POLL = 0.1
+
+
+class MasterLockTimeout(Exception):
+    """Raised when the master dataset lock can't be acquired in time."""
+
+
+def _lock_path(master_csv_path: Path):
+    return master_csv_path.with_name(master_csv_path.name + ".lock")
+
+
+def _version_path(master_csv_path: Path):
+    return master_csv_path.with_name(master_csv_path.name + ".version")
+
+
+def _try_lock(f):
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+        return True
+    except OSError:
+        return False
+
+
+def _unlock(f):
+    if fcntl is not None:
+        fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+    else:
+        f.seek(0)
+        msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+
+
+@contextlib.contextmanager
+def master_lock(master_csv_path: Path, timeout=LOCK_TIMEOUT):
+    """Exclusive inter-process lock on the master dataset."""
+    master_csv_path = Path(master_csv_path)
+    master_csv_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(_lock_path(master_csv_path), "a+") as f:
+        deadline = time.monotonic() + timeout
+        while not _try_lock(f):
+            if time.monotonic() > deadline:
+                raise MasterLockTimeout(f"Could not lock {master_csv_path} within {timeout}s")
+            time.sleep(LOCK_POLL)
+        try:
+            yield
+        finally:
+            _unlock(f)
+
+
+def read_master_version(master_csv_path: Path):
+    """Current committed version (0 when nothing has been committed yet)."""
+    version_path = _version_path(Path(master_csv_path))
+    if not version_path.exists():
+        return 0
+    try:
+        with open(version_path, "r") as f:
+            return int(json.load(f).get("version", 0))
+    except (OSError, ValueError):
+        return 0
+
+
+def _atomic_write_text(path: Path, text: str):
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    with open(tmp_path, "w") as f:
+        f.write(text)
+    os.replace(tmp_path, path)
+
+
+def atomic_write_csv(df: pd.DataFrame, path: Path):
+    """Write to a temp file next to `path`, then swap it in with one rename."""
+    path = Path(path)
+    tmp_path = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        df.to_csv(tmp_path, index=False)
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def bump_master_version(master_csv_path: Path, rows: int):
+    """Record a new committed version. Call only while holding master_lock."""
+    master_csv_path = Path(master_csv_path)
+    version = read_master_version(master_csv_path) + 1
+    _atomic_write_text(
+        _version_path(master_csv_path),
+        json.dumps({
+            "version": version,
+            "rows": int(rows),
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+        })
+    )
+    return version
+
+
+# =================================================
+# PARTITIONED COPY
+# =================================================
+
+def partition_dir(master_csv_path: Path):
+    return Path(master_csv_path).parent / DATASET_DIRNAME
+
+
+def _write_parts(table, dataset_dir: Path, version: int):
+    """Write `table` as new part files and return their manifest entries."""
+    written = []
+
+    def record(written_file):
+        path = Path(written_file.path)
+        written.append({
+            "path": path.relative_to(dataset_dir).as_posix(),
+            "version": version,
+            "rows": written_file.metadata.num_rows if written_file.metadata else None,
+        })
+
+    ds.write_dataset(
+        table,
+        str(dataset_dir),
+        format="parquet",
+        partitioning=PARTITION_COLS,
+        partitioning_flavor="hive",
+        basename_template=f"part-v{version:06d}-{{i}}.parquet",
+        max_rows_per_group=ROW_GROUP_SIZE,
+        min_rows_per_group=min(ROW_GROUP_SIZE, max(table.num_rows, 1)),
+        existing_data_behavior="overwrite_or_ignore",
+        file_visitor=record,
+    )
+    return written
+
+
+def publish_partitions(master_csv_path: Path, updated_master: pd.DataFrame,
+                       new_rows: pd.DataFrame, base_version: int, version: int):
+    """
+    Mirror a master commit into the partitioned store. Call only while
+    holding master_lock.
+
+    When the store is exactly one commit behind, only `new_rows` are written
+    as extra part files; otherwise (first run, a missed commit) the whole
+    master is rewritten. Either way a fresh site sample of the whole master
+    is stored for the dashboard's first paint. The manifest is replaced last,
+    so readers switch to the new version in one step and never see a partial
+    write.
+    """
+    if ds is None:
+        print("⚠ pyarrow not installed - skipping partitioned master copy")
+        return None
+
+    dataset_dir = partition_dir(master_csv_path)
+    dataset_dir.mkdir(parents=True, exist_ok=True)
+    manifest = read_manifest(dataset_dir)
+
+    if manifest is not None and manifest.get("version") == base_version:
+        files = manifest["files"]
+        if not new_rows.empty:
+            files = files + _write_parts(to_master_table(new_rows), dataset_dir, version)
+        rebuilt = False
+    else:
+        files = _write_parts(to_master_table(updated_master), dataset_dir, version)
+        rebuilt = True
+
+    sample_name = f"sample-v{version:06d}.feather"
+    try:
+        write_sample(to_master_frame(updated_master), dataset_dir / sample_name)
+    except OSError as e:
+        print(f"⚠ Could not write {sample_name}: {e}")
+        sample_name = None
+
+    manifest = {
+        "version": version,
+        "rows": int(len(updated_master)),
+        "files": files,
+        "sample": sample_name,
+        "updated_at": datetime.now().isoformat(timespec="seconds"),
+    }
+    _atomic_write_text(dataset_dir / MANIFEST_NAME, json.dumps(manifest, indent=2))
+
+    # Samples of older versions are no longer referenced by the manifest
+    for path in dataset_dir.glob("sample-v*.feather"):
+        if path.name != sample_name:
+            path.unlink()
+
+    if rebuilt:
+        # Parts from older versions are no longer referenced by the manifest
+        keep = {entry["path"] for entry in files}
+        for path in dataset_dir.rglob("*.parquet"):
+            if path.relative_to(dataset_dir).as_posix() not in keep:
+                path.unlink()
+        for root, _, _ in os.walk(dataset_dir, topdown=False):
+            if Path(root) != dataset_dir and not os.listdir(root):
+                os.rmdir(root)
+
+    print(f"🗃 Partitioned master published to {dataset_dir} "
+          f"({'rebuilt' if rebuilt else f'{len(new_rows)} new rows'}, version {version})")
+    return manifest
@@ -8,6 +8,20 @@ from datetime import datetime
 import shutil
 import zipfile
 
+from qc_pipeline.file_guard import (
+    FileGuard,
+    read_excel,
+    DEFAULT_FILE_TIMEOUT,
+    DEFAULT_RUN_TIMEOUT,
+)
+from qc_pipeline.master_store import (
+    master_lock,
+    read_master_version,
+    atomic_write_csv,
+    bump_master_version,
+    publish_partitions,
+)
+
 # =================================================
 # HELPERS
 # =================================================
@@ -182,7 +196,7 @@ def rename_files_in_study_folder(study_dir: Path):
 # STAGE 3 — ADD STUDY KEY
 # =================================================
 
-def add_study_key(root_dir: Path):
+def add_study_key(root_dir: Path, guard: FileGuard = None):
     print("Adding Study Key to all Excel files...")
     DRY_RUN = False
 
@@ -196,7 +210,7 @@ def add_study_key(root_dir: Path):
 
         for file in study_dir.glob("*.xlsx"):
             try:
-                sheets = pd.read_excel(file, sheet_name=None)
+                sheets = read_excel(file, guard, stage="Stage 3", sheet_name=None)
                 
                 for sheet, df in sheets.items():
                     df["Study Key"] = study_key
@@ -215,7 +229,7 @@ def add_study_key(root_dir: Path):
 # STAGE 4 — METRIC EXTRACTION
 # =================================================
 
-def extract_cols(root_dir):
+def extract_cols(root_dir, guard: FileGuard = None):
     """Extract metrics from standardized files with robust error handling"""
     
     # =================================================
@@ -255,7 +269,7 @@ def extract_cols(root_dir):
     def group_count(file_path, col_name):
         """Group by Study Key and Subject and count occurrences"""
         try:
-            df = pd.read_excel(file_path)
+            df = read_excel(file_path, guard, stage="Stage 4")
             df = standardise_subject_column(df)
             
             if df is None or df.empty:
@@ -314,7 +328,7 @@ def extract_cols(root_dir):
     def coded_uncoded_from_file(file_path):
         """Extract coded and uncoded terms from coding reports"""
         try:
-            df = pd.read_excel(file_path)
+            df = read_excel(file_path, guard, stage="Stage 4")
             df = standardise_subject_column(df)
             
             if df is None or df.empty:
@@ -341,7 +355,7 @@ def extract_cols(root_dir):
     def sae_dashboard_summary_from_file(file_path):
         """Extract SAE dashboard summaries"""
         try:
-            sheets = pd.read_excel(file_path, sheet_name=None)
+            sheets = read_excel(file_path, guard, stage="Stage 4", sheet_name=None)
             summaries = {}
 
             for sheet_name, df in sheets.items():
@@ -389,7 +403,7 @@ def extract_cols(root_dir):
     def edrr_summary_from_file(file_path):
         """Extract EDRR summaries"""
         try:
-            df = pd.read_excel(file_path)
+            df = read_excel(file_path, guard, stage="Stage 4")
             df = standardise_subject_column(df)
             
             if df is None or df.empty:
@@ -690,11 +704,13 @@ def find_cpid_file(study_dir: Path):
 
     return cpid_files[0]
 
-def collapse_cpid_headers(cpid_file: Path):
+def collapse_cpid_headers(cpid_file: Path, guard: FileGuard = None):
     print(f"Collapsing headers for: {cpid_file.name}")
 
-    df = pd.read_excel(
+    df = read_excel(
         cpid_file,
+        guard,
+        stage="Stage 5",
         sheet_name=0,
         header=[0, 1, 2, 3]
     )
@@ -1018,12 +1034,12 @@ def compute_cpid_dqi(cpid_df: pd.DataFrame) -> pd.DataFrame:
 
     return cpid_df
 
-def process_uploaded_study(study_dir: Path, final_qc_df: pd.DataFrame):
+def process_uploaded_study(study_dir: Path, final_qc_df: pd.DataFrame, guard: FileGuard = None):
     # 1️⃣ Find CPID file automatically
     cpid_file = find_cpid_file(study_dir)
 
     # 2️⃣ Collapse headers & overwrite
-    cpid_df = collapse_cpid_headers(cpid_file)
+    cpid_df = collapse_cpid_headers(cpid_file, guard)
 
     # 3️⃣ Populate CPID with QC metrics
     cpid_df = populate_cpid_with_qc(cpid_df, final_qc_df)
@@ -1145,9 +1161,9 @@ def load_or_create_master_dataset(master_csv_path: Path):
     
     return master_df
 
-def update_master_dataset(master_df: pd.DataFrame, new_cpid_df: pd.DataFrame, master_csv_path: Path):
+def merge_into_master(master_df: pd.DataFrame, new_cpid_df: pd.DataFrame):
     """
-    Update master dataset with new CPID data.
+    Merge new CPID data into the master dataset (no I/O).
     
     Strategy:
     1. If master is empty, use new data
@@ -1192,17 +1208,56 @@ def update_master_dataset(master_df: pd.DataFrame, new_cpid_df: pd.DataFrame, ma
             updated_master = pd.concat([master_df, new_cpid_df], ignore_index=True)
             print(f"📈 Appended {len(new_cpid_df)} rows to master dataset")
     
-    # Save updated master
-    updated_master.to_csv(master_csv_path, index=False)
-    print(f"💾 Master dataset saved to: {master_csv_path}")
+    return updated_master
+
+def update_master_dataset(new_cpid_df: pd.DataFrame, master_csv_path: Path, max_attempts=5):
+    """
+    Commit new CPID data to the master dataset without losing concurrent writes.
+
+    Optimistic concurrency: read the master and its version, merge outside
+    the lock, then commit only if nobody else committed in the meantime.
+    On a conflict the merge is redone against the fresh master. Only the
+    short commit step is serialized, so parallel pipelines don't wait on
+    each other's whole runs. The study/region partitioned copy is updated
+    in the same commit step.
+    Returns (updated_master, committed_version).
+    """
+    for attempt in range(1, max_attempts + 1):
+        base_version = read_master_version(master_csv_path)
+        master_df = load_or_create_master_dataset(master_csv_path)
+        updated_master = merge_into_master(master_df, new_cpid_df)
+
+        with master_lock(master_csv_path):
+            if read_master_version(master_csv_path) != base_version:
+                print(f"🔁 Master dataset changed during merge (attempt {attempt}), retrying")
+                continue
+
+            atomic_write_csv(updated_master, master_csv_path)
+            version = bump_master_version(master_csv_path, len(updated_master))
+            # merge_into_master only ever appends, so the new rows are the tail
+            publish_partitions(master_csv_path, updated_master,
+                               updated_master.iloc[len(master_df):], base_version, version)
+            break
+    else:
+        # Heavy contention - merge and commit while holding the lock
+        with master_lock(master_csv_path):
+            base_version = read_master_version(master_csv_path)
+            master_df = load_or_create_master_dataset(master_csv_path)
+            updated_master = merge_into_master(master_df, new_cpid_df)
+            atomic_write_csv(updated_master, master_csv_path)
+            version = bump_master_version(master_csv_path, len(updated_master))
+            publish_partitions(master_csv_path, updated_master,
+                               updated_master.iloc[len(master_df):], base_version, version)
+
+    print(f"💾 Master dataset saved to: {master_csv_path} (version {version})")
     print(f"   Total rows: {len(updated_master)}")
     
-    return updated_master
+    return updated_master, version
 
 # =================================================
 # MAIN PIPELINE ENTRY
 # =================================================
-def process_all_studies(root_dir: Path, final_qc_df: pd.DataFrame):
+def process_all_studies(root_dir: Path, final_qc_df: pd.DataFrame, guard: FileGuard = None):
     """
     Process all studies and return list of processed CPID file paths.
     """
@@ -1220,7 +1275,7 @@ def process_all_studies(root_dir: Path, final_qc_df: pd.DataFrame):
         print(f"\n📂 Study folder: {study_dir.name}")
 
         try:
-            cpid_df = process_uploaded_study(study_dir, final_qc_df)
+            cpid_df = process_uploaded_study(study_dir, final_qc_df, guard)
             if cpid_df is not None:
                 # Find the CPID file that was just processed
                 cpid_files = [
@@ -1241,7 +1296,7 @@ def process_all_studies(root_dir: Path, final_qc_df: pd.DataFrame):
     return processed_cpid_files
 
 
-def create_final_output_from_files(cpid_file_paths: list, output_path: Path = None):
+def create_final_output_from_files(cpid_file_paths: list, output_path: Path = None, guard: FileGuard = None):
     """
     Create final merged output from specific CPID files.
     """
@@ -1255,7 +1310,7 @@ def create_final_output_from_files(cpid_file_paths: list, output_path: Path = No
         print(f"📂 Reading {cpid_file.name}")
         
         try:
-            df = pd.read_excel(cpid_file)
+            df = read_excel(cpid_file, guard, stage="Stage 6")
             merged_dfs.append(df)
             print(f"   ✓ Successfully read {len(df)} rows")
         except Exception as e:
@@ -1279,7 +1334,7 @@ def create_final_output_from_files(cpid_file_paths: list, output_path: Path = No
     return final_merged_df
 
 
-def get_latest_cpid_data(processed_cpid_files: list):
+def get_latest_cpid_data(processed_cpid_files: list, guard: FileGuard = None):
     """
     Get merged data from only the latest processed CPID files.
     """
@@ -1288,17 +1343,24 @@ def get_latest_cpid_data(processed_cpid_files: list):
         return None
     
     print(f"\n📊 Getting data from {len(processed_cpid_files)} newly processed CPID files")
-    return create_final_output_from_files(processed_cpid_files)
+    return create_final_output_from_files(processed_cpid_files, guard=guard)
 
 
 # =================================================
 # MAIN PIPELINE ENTRY - UPDATED
 # =================================================
 
-def run_qc_pipeline(root_dir):
+def run_qc_pipeline(root_dir, file_timeout=DEFAULT_FILE_TIMEOUT, run_timeout=DEFAULT_RUN_TIMEOUT):
     """
     Entry point used by Streamlit.
     root_dir: Path or str - This is the extracted directory from uploaded ZIP
+    file_timeout: seconds allowed to parse any single workbook
+    run_timeout: seconds allowed for all parsing in this run
+
+    Workbooks that time out or fail to parse are quarantined and the run
+    carries on without them. The returned dataframe carries the quarantine
+    list in attrs["quarantine"] and attrs["partial"] is True when any file
+    was left out.
     """
     root_dir = Path(root_dir)
     
@@ -1307,6 +1369,8 @@ def run_qc_pipeline(root_dir):
     
     print(f"Running QC pipeline on: {root_dir}")
     
+    guard = FileGuard(file_timeout=file_timeout, run_timeout=run_timeout)
+
     try:
         # Stage 1: Rename folders
         print("Stage 1: Renaming study folders...")
@@ -1320,11 +1384,11 @@ def run_qc_pipeline(root_dir):
         
         # Stage 3: Add study key
         print("Stage 3: Adding study keys...")
-        add_study_key(root_dir)
+        add_study_key(root_dir, guard)
         
         # Stage 4: Extract metrics
         print("Stage 4: Extracting metrics...")
-        final_qc_df = extract_cols(root_dir)
+        final_qc_df = extract_cols(root_dir, guard)
         
         if final_qc_df.empty:
             print("Warning: No data extracted. Check input files.")
@@ -1334,7 +1398,7 @@ def run_qc_pipeline(root_dir):
         
         # Stage 5: Process CPID files and track which ones were processed
         print("\nStage 5: Processing CPID files...")
-        processed_cpid_files = process_all_studies(root_dir, final_qc_df)
+        processed_cpid_files = process_all_studies(root_dir, final_qc_df, guard)
         
         # Stage 6: Create final merged output from ONLY newly processed files
         print("\nStage 6: Creating final output from newly processed files...")
@@ -1348,7 +1412,7 @@ def run_qc_pipeline(root_dir):
         output_file = output_dir / f"QC_Results_{timestamp}.xlsx"
         
         # Get merged CPID data from ONLY the files we just processed
-        merged_cpid_df = get_latest_cpid_data(processed_cpid_files)
+        merged_cpid_df = get_latest_cpid_data(processed_cpid_files, guard)
         
         if merged_cpid_df is not None and not merged_cpid_df.empty:
             # Also save to the timestamped output file
@@ -1362,12 +1426,11 @@ def run_qc_pipeline(root_dir):
         project_root = Path(__file__).parent.parent.absolute()
         master_csv_path = project_root / "data" / "master_dataset.csv"
         
-        # Load or create master dataset
-        master_df = load_or_create_master_dataset(master_csv_path)
-        
+        master_version = read_master_version(master_csv_path)
+
         if merged_cpid_df is not None and not merged_cpid_df.empty:
-            # Update master dataset with new CPID data
-            updated_master = update_master_dataset(master_df, merged_cpid_df, master_csv_path)
+            # Commit new CPID data (safe against concurrent uploads)
+            updated_master, master_version = update_master_dataset(merged_cpid_df, master_csv_path)
             print(f"✅ Master dataset updated with {len(merged_cpid_df)} NEW rows from this upload")
         else:
             print("⚠ No new CPID data to add to master dataset")
@@ -1385,6 +1448,16 @@ def run_qc_pipeline(root_dir):
                     zipf.write(file_path, arcname)
         
         print(f"📦 Backup created at: {backup_file}")
+
+        if guard.partial:
+            print(f"⚠ Partial result: {len(guard.quarantine)} file(s) quarantined")
+            for entry in guard.quarantine:
+                print(f"   - {entry['study']}/{entry['file']}: {entry['reason']}")
+
+        final_qc_df.attrs["quarantine"] = list(guard.quarantine)
+        final_qc_df.attrs["partial"] = guard.partial
+        final_qc_df.attrs["output_file"] = str(output_file) if output_file.exists() else None
+        final_qc_df.attrs["master_version"] = master_version
         
         # Return the QC dataframe for display in Streamlit
         return final_qc_df
@@ -1393,4 +1466,7 @@ def run_qc_pipeline(root_dir):
         print(f"Error in QC pipeline: {e}")
         import traceback
         traceback.print_exc()
-        raise
\ No newline at end of file
+        raise
+
+    finally:
+        guard.close()
\ No newline at end of file
@@ -0,0 +1,216 @@
+# qc_pipeline/results_cache.py
+import contextlib
+import hashlib
+import io
+import json
+import os
+import shutil
+import sys
+import threading
+from datetime import datetime
+from pathlib import Path
+
+import pandas as pd
+
+from qc_pipeline.master_store import master_lock
+
+# =================================================
+# RESULTS INDEX
+# =================================================
+# One entry per processed archive, keyed by the SHA-256 of the ZIP bytes:
+#   <results_dir>/index.json
+#   <results_dir>/<hash>/final_qc.csv
+#   <results_dir>/<hash>/trace.txt
+#   <results_dir>/<hash>/<QC_Results_*.xlsx>
+
+DEFAULT_RESULTS_DIR = Path("uploaded_data") / "results"
+INDEX_NAME = "index.json"
+
+
+def hash_archive(source, chunk_size=1024 * 1024):
+    """SHA-256 of a ZIP given as a path or a binary file object (e.g. Streamlit upload)."""
+    digest = hashlib.sha256()
+
+    if isinstance(source, (str, Path)):
+        with open(source, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                digest.update(chunk)
+    else:
+        source.seek(0)
+        for chunk in iter(lambda: source.read(chunk_size), b""):
+            digest.update(chunk)
+        source.seek(0)
+
+    return digest.hexdigest()
+
+
+def _read_index(results_dir: Path):
+    index_path = results_dir / INDEX_NAME
+    if not index_path.exists():
+        return {}
+    try:
+        with open(index_path, "r") as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        print(f"⚠ Could not read results index {index_path}: {e}")
+        return {}
+
+
+def _write_index(results_dir: Path, index: dict):
+    # Write-then-rename so a reader never sees a half-written index
+    index_path = results_dir / INDEX_NAME
+    tmp_path = index_path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump(index, f, indent=2)
+    os.replace(tmp_path, index_path)
+
+
+def lookup_results(archive_hash: str, results_dir: Path = DEFAULT_RESULTS_DIR):
+    """
+    Return the index entry for an already-processed archive, or None.
+    Entries whose stored files have gone missing are treated as misses.
+    """
+    results_dir = Path(results_dir)
+    entry = _read_index(results_dir).get(archive_hash)
+    if entry is None:
+        return None
+
+    if not (results_dir / entry["final_qc"]).exists():
+        return None
+
+    return entry
+
+
+def store_results(
+    archive_hash: str,
+    final_qc_df: pd.DataFrame,
+    archive_name: str = "",
+    trace: str = "",
+    output_file=None,
+    results_dir: Path = DEFAULT_RESULTS_DIR,
+):
+    """Persist the results of one pipeline run and register them in the index."""
+    results_dir = Path(results_dir)
+    entry_dir = results_dir / archive_hash
+    entry_dir.mkdir(parents=True, exist_ok=True)
+
+    final_qc_df.to_csv(entry_dir / "final_qc.csv", index=False)
+
+    with open(entry_dir / "trace.txt", "w") as f:
+        f.write(trace or "")
+
+    stored_output = None
+    if output_file and Path(output_file).exists():
+        stored_output = entry_dir / Path(output_file).name
+        shutil.copy2(output_file, stored_output)
+
+    entry = {
+        "archive_name": archive_name,
+        "processed_at": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+        "rows": int(len(final_qc_df)),
+        "final_qc": f"{archive_hash}/final_qc.csv",
+        "trace": f"{archive_hash}/trace.txt",
+        "output_file": f"{archive_hash}/{stored_output.name}" if stored_output else None,
+        "quarantine": final_qc_df.attrs.get("quarantine", []),
+        "partial": bool(final_qc_df.attrs.get("partial", False)),
+    }
+
+    # Read-modify-write under the inter-process lock, so concurrent uploads
+    # and the ingest daemon never drop each other's entries
+    with master_lock(results_dir / INDEX_NAME):
+        index = _read_index(results_dir)
+        index[archive_hash] = entry
+        _write_index(results_dir, index)
+
+    print(f"🗂 Stored results for archive {archive_hash[:12]}… in {entry_dir}")
+    return entry
+
+
+def load_results(entry: dict, results_dir: Path = DEFAULT_RESULTS_DIR):
+    """
+    Load stored results for an index entry.
+    Returns (final_qc_df, trace, output_file_path_or_None).
+    """
+    results_dir = Path(results_dir)
+
+    final_qc_df = pd.read_csv(
+        results_dir / entry["final_qc"],
+        dtype={"Study Key": str, "Subject": str}
+    )
+    final_qc_df.attrs["quarantine"] = entry.get("quarantine", [])
+    final_qc_df.attrs["partial"] = entry.get("partial", False)
+
+    trace_path = results_dir / entry["trace"]
+    trace = trace_path.read_text() if trace_path.exists() else ""
+
+    output_file = None
+    if entry.get("output_file"):
+        output_file = results_dir / entry["output_file"]
+        if not output_file.exists():
+            output_file = None
+
+    return final_qc_df, trace, output_file
+
+
+# =================================================
+# TRACE CAPTURE
+# =================================================
+
+class _ThreadStdout(io.TextIOBase):
+    """
+    Stand-in for sys.stdout that echoes everything to the original stream
+    and copies each thread's writes into the buffers that thread is
+    capturing into. Other threads and sessions never reach a capture.
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self._local = threading.local()
+
+    def captures(self):
+        if not hasattr(self._local, "buffers"):
+            self._local.buffers = []
+        return self._local.buffers
+
+    def write(self, s):
+        for buffer in self.captures():
+            buffer.write(s)
+        return self.stream.write(s)
+
+    def flush(self):
+        self.stream.flush()
+
+    @property
+    def encoding(self):
+        return getattr(self.stream, "encoding", "utf-8")
+
+    def isatty(self):
+        return self.stream.isatty()
+
+
+_install_lock = threading.Lock()
+
+
+def _thread_stdout():
+    # Installed once and left in place: captures start and end per thread
+    # and never swap sys.stdout back and forth
+    with _install_lock:
+        if not isinstance(sys.stdout, _ThreadStdout):
+            sys.stdout = _ThreadStdout(sys.stdout)
+        return sys.stdout
+
+
+@contextlib.contextmanager
+def capture_trace():
+    """
+    Collect everything the calling thread prints while still echoing it to
+    the console. Captures can nest; prints from other threads are not
+    collected.
+    """
+    buffer = io.StringIO()
+    captures = _thread_stdout().captures()
+    captures.append(buffer)
+    try:
+        yield buffer
+    finally:
+        captures.remove(buffer)
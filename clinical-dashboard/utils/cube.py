@@ -0,0 +1,108 @@
+# utils/cube.py
+import pandas as pd
+
+from utils.data_loader import NUMERIC_COLS
+
+# =================================================
+# AGGREGATE CUBE
+# =================================================
+# Base cells are one row per (region, country, site). Every metric keeps
+# its sum and non-null count, so means at any level are sum / count and a
+# filter on region/country/site is answered from the cells alone.
+
+CELL_KEYS = ["region", "country", "site_id"]
+DERIVED_METRICS = [
+    "clean_patient", "missing_visits_pct", "missing_pages_pct", "non_conformant_pct",
+    "signature_pct", "data_readiness_score",
+]
+STATUS_COUNTS = {"active_subjects": "On Trial", "screen_failures": "Screen Failure"}
+
+
+class AggregateCube:
+    """
+    Sums, counts and means of every dashboard metric per site, rolled up to
+    country and region on request.
+
+    Build it once per data version from the analytical frame. Patient
+    counts are summed over cells, which assumes a patient belongs to a
+    single site. Passing the queries.csv links (utils.query_join) adds
+    per-site query counts and resolution time.
+    """
+
+    def __init__(self, df: pd.DataFrame, query_links: pd.DataFrame = None):
+        self.metrics = [col for col in NUMERIC_COLS + DERIVED_METRICS if col in df.columns]
+
+        flags = {}
+        if "subject_status" in df.columns:
+            flags = {name: df["subject_status"] == status for name, status in STATUS_COUNTS.items()}
+
+        grouped = df.assign(**flags).groupby(CELL_KEYS, dropna=False, sort=False, observed=True)
+        # Sums are float64 whatever the column dtype (small ints, float32)
+        cells = pd.concat([
+            grouped[self.metrics].sum().astype("float64").add_suffix("_sum"),
+            grouped[self.metrics].count().add_suffix("_count"),
+            grouped[list(flags)].sum(),
+        ], axis=1)
+        cells["rows"] = grouped.size()
+        cells["patients"] = grouped["patient_id"].nunique()
+
+        self.cells = cells.reset_index()
+        self.has_queries = query_links is not None
+        if self.has_queries:
+            self.cells = self._with_query_cells(self.cells, query_links)
+            self.metrics.append("avg_resolution_days")
+        self._additive = [col for col in self.cells.columns if col not in CELL_KEYS]
+
+    @staticmethod
+    def _with_query_cells(cells, query_links):
+        """Add weighted open/closed query sums and resolution-days sum/count per cell."""
+        weight = query_links["weight"]
+        resolution = query_links["avg_resolution_days"]
+        has_resolution = resolution.notna()
+
+        query_cells = pd.DataFrame({
+            **{col: query_links[col] for col in CELL_KEYS},
+            "open_queries_sum": query_links["open_queries"] * weight,
+            "closed_queries_sum": query_links["closed_queries"] * weight,
+            "avg_resolution_days_sum": resolution.fillna(0) * weight,
+            "avg_resolution_days_count": weight.where(has_resolution, 0),
+        }).groupby(CELL_KEYS, dropna=False, sort=False, observed=True).sum().reset_index()
+
+        query_cols = [col for col in query_cells.columns if col not in CELL_KEYS]
+        cells = cells.merge(query_cells, on=CELL_KEYS, how="left")
+        cells[query_cols] = cells[query_cols].fillna(0)
+        return cells
+
+    def _select(self, selections):
+        cells = self.cells
+        for col, value in (selections or {}).items():
+            if col in CELL_KEYS and value is not None and value != "All":
+                cells = cells[cells[col] == value]
+        return cells
+
+    def _add_means(self, result):
+        means = {
+            f"{metric}_mean": result[f"{metric}_sum"] / result[f"{metric}_count"].where(result[f"{metric}_count"] > 0)
+            for metric in self.metrics
+        }
+        return pd.concat([result, pd.DataFrame(means, index=result.index)], axis=1)
+
+    def rollup(self, level: str, selections: dict = None):
+        """
+        One row per value of `level` ("site_id", "country" or "region") for
+        the cells matching `selections` ({column: value}, "All" = no filter).
+        Columns: <metric>_sum, <metric>_count, <metric>_mean, rows,
+        patients, status counts and, below region level, the region.
+        With query links, also open_queries_sum and closed_queries_sum.
+        """
+        grouped = self._select(selections).groupby(level, sort=False, observed=True)
+        result = grouped[self._additive].sum()
+        if level != "region":
+            result["region"] = grouped["region"].first()
+
+        return self._add_means(result)
+
+    def totals(self, selections: dict = None):
+        """The same columns as rollup(), as one Series over the whole selection."""
+        result = self._select(selections)[self._additive].sum().to_frame().T
+        return self._add_means(result).iloc[0]
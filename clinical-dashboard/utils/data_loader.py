@@ -0,0 +1,456 @@
+# utils/data_loader.py
+import json
+import os
+import threading
+from collections import OrderedDict
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from utils.estimates import site_sample
+
+try:
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.feather as feather
+except ImportError:  # CSV-only installs
+    pa = None
+    ds = None
+    feather = None
+
+# =================================================
+# MASTER DATASET SCHEMA
+# =================================================
+
+COLUMN_MAP = {
+    "project_name_|_unnamed:_0_level_1_|_unnamed:_0_level_2_|_responsible_lf_for_action": "study",
+    "region_|_unnamed:_1_level_1_|_unnamed:_1_level_2_|_unnamed:_1_level_3": "region",
+    "country_|_unnamed:_2_level_1_|_unnamed:_2_level_2_|_unnamed:_2_level_3": "country",
+    "site_id_|_unnamed:_3_level_1_|_unnamed:_3_level_2_|_unnamed:_3_level_3": "site_id",
+    "subject_id_|_unnamed:_4_level_1_|_unnamed:_4_level_2_|_unnamed:_4_level_3": "patient_id",
+    "latest_visit_(sv)_(source:_rave_edc:_bo4)_|_unnamed:_5_level_1_|_unnamed:_5_level_2_|_unnamed:_5_level_3": "latest_visit",
+    "subject_status_(source:_primary_form)_|_unnamed:_6_level_1_|_unnamed:_6_level_2_|_unnamed:_6_level_3": "subject_status",
+    "input_files_|_missing_visits_|_unnamed:_7_level_2_|_unnamed:_7_level_3": "missing_visits",
+    "input_files_|_missing_page_|_unnamed:_8_level_2_|_unnamed:_8_level_3": "missing_pages",
+    "input_files_|_#_coded_terms_|_unnamed:_9_level_2_|_unnamed:_9_level_3": "coded_terms",
+    "input_files_|_#_uncoded_terms_|_unnamed:_10_level_2_|_unnamed:_10_level_3": "uncoded_terms",
+    "input_files_|_#_open_issues_in_lnr_|_unnamed:_11_level_2_|_unnamed:_11_level_3": "open_lnr_issues",
+    "input_files_|_#_open_issues_reported_for_3rd_party_reconciliation_in_edrr_|_unnamed:_12_level_2_|_unnamed:_12_level_3": "open_edrr_issues",
+    "input_files_|_inactivated_forms_and_folders_|_unnamed:_13_level_2_|_unnamed:_13_level_3": "inactivated_forms",
+    "input_files_|_#_esae_dashboard_review_for_dm_|_unnamed:_14_level_2_|_unnamed:_14_level_3": "esae_dm_reviews",
+    "input_files_|_#_esae_dashboard_review_for_safety_|_unnamed:_15_level_2_|_unnamed:_15_level_3": "esae_safety_reviews",
+    "cpmd_|_visit_status_|_#_expected_visits_(rave_edc_:_bo4)_|_unnamed:_16_level_3": "expected_visits",
+    "cpmd_|_page_status_(source:_(rave_edc_:_bo4))_|_#_pages_entered_|_unnamed:_17_level_3": "pages_entered",
+    "cpmd_|_page_status_(source:_(rave_edc_:_bo4))_|_#_pages_with_non-conformant_data_|_site/cra": "non_conformant_pages",
+    "cpmd_|_page_status_(source:_(rave_edc_:_bo4))_|_#_total_crfs_with_queries_&_non-conformant_data_|_unnamed:_19_level_3": "crfs_with_queries",
+    "cpmd_|_page_status_(source:_(rave_edc_:_bo4))_|_#_total_crfs_without_queries_&_non-conformant_data_|_unnamed:_20_level_3": "crfs_without_queries",
+    "cpmd_|_page_status_(source:_(rave_edc_:_bo4))_|_%_clean_entered_crf_|_unnamed:_21_level_3": "clean_crf_percent",
+    "cpmd_|_queries_status_(source:(rave_edc_:_bo4))_|_#_dm_queries_|_dm": "dm_queries",
+    "cpmd_|_queries_status_(source:(rave_edc_:_bo4))_|_#_clinical_queries_|_cse/cdd": "clinical_queries",
+    "cpmd_|_queries_status_(source:(rave_edc_:_bo4))_|_#_medical_queries_|_cdmd/medical_lead": "medical_queries",
+    "cpmd_|_queries_status_(source:(rave_edc_:_bo4))_|_#_site_queries_|_site/cra": "site_queries",
+    "cpmd_|_queries_status_(source:(rave_edc_:_bo4))_|_#_field_monitor_queries_|_cra": "field_monitor_queries",
+    "cpmd_|_queries_status_(source:(rave_edc_:_bo4))_|_#_coding_queries_|_coder": "coding_queries",
+    "cpmd_|_queries_status_(source:(rave_edc_:_bo4))_|_#_safety_queries_|_safety_team": "safety_queries",
+    "cpmd_|_queries_status_(source:(rave_edc_:_bo4))_|_#total_queries_|_unnamed:_29_level_3": "total_queries",
+    "cpmd_|_page_action_status_(source:_(rave_edc_:_bo4))_|_#_crfs_require_verification_(sdv)_|_cra": "crfs_require_sdv",
+    "cpmd_|_page_action_status_(source:_(rave_edc_:_bo4))_|_#_forms_verified_|_unnamed:_31_level_3": "forms_verified",
+    "cpmd_|_page_action_status_(source:_(rave_edc_:_bo4))_|_#_crfs_frozen_|_unnamed:_32_level_3": "crfs_frozen",
+    "cpmd_|_page_action_status_(source:_(rave_edc_:_bo4))_|_#_crfs_not_frozen_|_dm": "crfs_not_frozen",
+    "cpmd_|_page_action_status_(source:_(rave_edc_:_bo4))_|_#_crfs_locked_|_unnamed:_34_level_3": "crfs_locked",
+    "cpmd_|_page_action_status_(source:_(rave_edc_:_bo4))_|_#_crfs_unlocked_|_unnamed:_35_level_3": "crfs_unlocked",
+    "cpmd_|_protocol_deviations_(source:(rave_edc_:_bo4))_|_#_pds_confirmed_|_cd_lf": "pds_confirmed",
+    "cpmd_|_protocol_deviations_(source:(rave_edc_:_bo4))_|_#_pds_proposed_|_unnamed:_37_level_3": "pds_proposed",
+    "ssm_|_pi_signatures_(source:_(rave_edc_:_bo4))_|_#_crfs_signed_|_investigator": "crfs_signed",
+    "ssm_|_pi_signatures_(source:_(rave_edc_:_bo4))_|_crfs_overdue_for_signs_within_45_days_of_data_entry_|_unnamed:_39_level_3": "signs_overdue_45",
+    "ssm_|_pi_signatures_(source:_(rave_edc_:_bo4))_|_crfs_overdue_for_signs_between_45_to_90_days_of_data_entry_|_unnamed:_40_level_3": "signs_overdue_90",
+    "ssm_|_pi_signatures_(source:_(rave_edc_:_bo4))_|_crfs_overdue_for_signs_beyond_90_days_of_data_entry_|_unnamed:_41_level_3": "signs_overdue_90_plus",
+    "ssm_|_pi_signatures_(source:_(rave_edc_:_bo4))_|_broken_signatures_|_unnamed:_42_level_3": "broken_signatures",
+    "ssm_|_pi_signatures_(source:_(rave_edc_:_bo4))_|_crfs_never_signed_|_unnamed:_43_level_3": "crfs_never_signed",
+    "dqi": "dqi"
+}
+
+DIMENSION_COLS = ["study", "region", "country", "site_id", "patient_id", "latest_visit", "subject_status"]
+NUMERIC_COLS = [col for col in COLUMN_MAP.values() if col not in DIMENSION_COLS]
+MASTER_COLS = list(COLUMN_MAP.values())
+PERCENT_COLS = ["clean_crf_percent", "dqi"]
+COUNT_COLS = [col for col in NUMERIC_COLS if col not in PERCENT_COLS]
+
+# =================================================
+# PARTITIONED STORE LAYOUT
+# =================================================
+# data/master_parquet/study=<study>/region=<region>/part-v000007-0.parquet
+# data/master_parquet/_manifest.json  - {"version": n, "files": [...]}
+#
+# Rows inside each file are sorted by country, site and patient, so the
+# row-group min/max statistics let a country or site filter skip most of a
+# study's data without reading it.
+
+DATASET_DIRNAME = "master_parquet"
+MANIFEST_NAME = "_manifest.json"
+PARTITION_COLS = ["study", "region"]
+SORT_COLS = ["country", "site_id", "patient_id"]
+ROW_GROUP_SIZE = 20_000
+
+# Sidebar filter -> column it prunes on
+FILTER_COLS = {"region": "region", "country": "country", "site": "site_id"}
+
+
+def standardize_master(df: pd.DataFrame):
+    """Dashboard column names and numeric types for a raw master dataset frame."""
+    df.columns = (
+        df.columns
+        .str.strip()
+        .str.lower()
+        .str.replace(" ", "_")
+    )
+
+    # Apply mapping safely
+    df = df.rename(columns={k: v for k, v in COLUMN_MAP.items() if k in df.columns})
+
+    for col in NUMERIC_COLS:
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+
+    return df
+
+
+def master_schema():
+    fields = [
+        pa.field(col, pa.string()) if col in DIMENSION_COLS else pa.field(col, pa.float64())
+        for col in MASTER_COLS
+    ]
+    return pa.schema(fields)
+
+
+def to_master_frame(df: pd.DataFrame):
+    """Exactly the mapped columns: dimensions as strings, everything else float."""
+    df = standardize_master(df.copy())
+
+    for col in MASTER_COLS:
+        if col not in df.columns:
+            df[col] = pd.NA if col in DIMENSION_COLS else float("nan")
+    df = df[MASTER_COLS].copy()
+
+    for col in DIMENSION_COLS:
+        df[col] = df[col].astype("string").str.strip()
+    for col in NUMERIC_COLS:
+        df[col] = df[col].astype("float64")
+
+    return df
+
+
+def to_master_table(df: pd.DataFrame):
+    """
+    Arrow table with exactly the mapped columns, fixed types and partition
+    keys filled in, ready to be written to the partitioned store.
+    """
+    df = to_master_frame(df)
+
+    # Partition directories can't be null
+    for col in PARTITION_COLS:
+        df[col] = df[col].fillna("Unknown")
+
+    df = df.sort_values(PARTITION_COLS + SORT_COLS, kind="stable", ignore_index=True)
+    return pa.Table.from_pandas(df, schema=master_schema(), preserve_index=False)
+
+
+# =================================================
+# FIRST-PAINT SAMPLE
+# =================================================
+# Each stored copy of the master keeps a stratified per-site sample of it
+# (estimates.site_sample) alongside, so the dashboard's first paint reads a
+# few rows per site instead of the whole dataset:
+# data/master_parquet/sample-v000007.feather  - named by the manifest's "sample"
+# data/master_dataset.sample.feather          - written with the CSV sidecar
+
+def sample_schema():
+    return (
+        master_schema()
+        .append(pa.field("stratum", pa.int64()))
+        .append(pa.field("site_rows", pa.int64()))
+        .append(pa.field("site_patients", pa.int64()))
+    )
+
+
+def write_sample(df: pd.DataFrame, path: Path):
+    """Store the site sample of a master frame (mapped columns) at `path`."""
+    path = Path(path)
+    tmp_path = path.with_name(path.name + f".{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        feather.write_feather(
+            pa.Table.from_pandas(site_sample(df), schema=sample_schema(), preserve_index=False),
+            tmp_path,
+            compression="uncompressed"
+        )
+        os.replace(tmp_path, path)
+    finally:
+        if tmp_path.exists():
+            tmp_path.unlink()
+
+
+def read_sample(path: Path):
+    """A stored site sample, or None if there is none to read."""
+    if feather is None:
+        return None
+    try:
+        return feather.read_table(path, memory_map=True).to_pandas()
+    except (OSError, pa.ArrowInvalid):
+        return None
+
+
+# =================================================
+# CSV SIDECAR
+# =================================================
+# data/master_dataset.feather       - typed, renamed copy of the mapped columns
+# data/master_dataset.feather.json  - size/mtime of the CSV it was built from
+#
+# Used whenever the partitioned store isn't available. The sidecar is
+# uncompressed Feather so it can be memory-mapped and column-projected.
+
+def _sidecar_paths(csv_path: Path):
+    sidecar_path = csv_path.with_suffix(".feather")
+    return sidecar_path, sidecar_path.with_name(sidecar_path.name + ".json")
+
+
+def _sample_path(csv_path: Path):
+    return csv_path.with_suffix(".sample.feather")
+
+
+def _csv_signature(csv_path: Path):
+    stat = csv_path.stat()
+    return {"mtime_ns": stat.st_mtime_ns, "size": stat.st_size}
+
+
+def _is_mapped(raw_col):
+    return raw_col.strip().lower().replace(" ", "_") in COLUMN_MAP
+
+
+def _write_sidecar(df: pd.DataFrame, csv_path: Path, signature: dict):
+    sidecar_path, meta_path = _sidecar_paths(csv_path)
+    suffix = f".{os.getpid()}.{threading.get_ident()}.tmp"
+    tmp_sidecar = sidecar_path.with_name(sidecar_path.name + suffix)
+    tmp_meta = meta_path.with_name(meta_path.name + suffix)
+    try:
+        feather.write_feather(
+            pa.Table.from_pandas(df, schema=master_schema(), preserve_index=False),
+            tmp_sidecar,
+            compression="uncompressed"
+        )
+        with open(tmp_meta, "w") as f:
+            json.dump(signature, f)
+        os.replace(tmp_sidecar, sidecar_path)
+        write_sample(df, _sample_path(csv_path))
+        os.replace(tmp_meta, meta_path)
+    except OSError as e:
+        print(f"⚠ Could not write {sidecar_path.name}: {e}")
+    finally:
+        for path in (tmp_sidecar, tmp_meta):
+            if path.exists():
+                path.unlink()
+
+
+def _sidecar_fresh(csv_path: Path, signature: dict):
+    _, meta_path = _sidecar_paths(csv_path)
+    try:
+        with open(meta_path, "r") as f:
+            return json.load(f) == signature
+    except (OSError, ValueError):
+        return False
+
+
+def read_master_csv(csv_path: Path, columns=None):
+    """
+    Master dataset with dashboard column names and types, mapped columns only.
+
+    Reads the Feather sidecar when it was built from the current CSV;
+    otherwise parses just the mapped CSV columns and rebuilds the sidecar.
+    """
+    csv_path = Path(csv_path)
+    signature = _csv_signature(csv_path)
+
+    if feather is not None:
+        sidecar_path, _ = _sidecar_paths(csv_path)
+        if _sidecar_fresh(csv_path, signature):
+            try:
+                table = feather.read_table(sidecar_path, columns=columns, memory_map=True)
+                return table.to_pandas()
+            except (OSError, pa.ArrowInvalid) as e:
+                print(f"⚠ Could not read {sidecar_path.name}, re-parsing CSV: {e}")
+
+    df = to_master_frame(pd.read_csv(csv_path, usecols=_is_mapped, low_memory=False))
+    if feather is not None:
+        _write_sidecar(df, csv_path, signature)
+
+    return df[columns] if columns else df
+
+
+def read_csv_sample(csv_path: Path):
+    """The site sample written with the sidecar, or None if the CSV has changed since."""
+    csv_path = Path(csv_path)
+    if not _sidecar_fresh(csv_path, _csv_signature(csv_path)):
+        return None
+    return read_sample(_sample_path(csv_path))
+
+
+def read_manifest(dataset_dir: Path):
+    """Manifest of the last published store, or None if there isn't one."""
+    manifest_path = Path(dataset_dir) / MANIFEST_NAME
+    if not manifest_path.exists():
+        return None
+    try:
+        with open(manifest_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def partition_filters(region="All", country="All", site="All"):
+    """Sidebar selections -> {column: value} for the ones that actually filter."""
+    selections = {"region": region, "country": country, "site": site}
+    return {
+        FILTER_COLS[name]: str(value)
+        for name, value in selections.items()
+        if value is not None and value != "All"
+    }
+
+
+def read_partitions(dataset_dir: Path, manifest: dict, filters: dict = None, columns=None):
+    """
+    Read the published store with the filters pushed down.
+
+    Only the files listed in `manifest` are read, so a half-finished publish
+    is never visible. region prunes whole directories; country and site_id
+    prune row groups through their min/max statistics.
+    """
+    dataset_dir = Path(dataset_dir)
+    files = [str(dataset_dir / entry["path"]) for entry in manifest["files"]]
+    if not files:
+        return pd.DataFrame(columns=columns or MASTER_COLS)
+
+    partitioning = ds.partitioning(
+        pa.schema([pa.field(col, pa.string()) for col in PARTITION_COLS]),
+        flavor="hive"
+    )
+    dataset = ds.dataset(
+        files,
+        schema=master_schema(),
+        format="parquet",
+        partitioning=partitioning,
+        partition_base_dir=str(dataset_dir)
+    )
+
+    expression = None
+    for col, value in (filters or {}).items():
+        condition = ds.field(col) == value
+        expression = condition if expression is None else expression & condition
+
+    table = dataset.to_table(columns=columns, filter=expression)
+    return table.to_pandas()
+
+
+def read_store_sample(dataset_dir: Path, manifest: dict):
+    """The site sample published with `manifest`, or None for stores without one."""
+    if not manifest.get("sample"):
+        return None
+    return read_sample(Path(dataset_dir) / manifest["sample"])
+
+
+class IncrementalReader:
+    """
+    Remembers the last frame read for each filter/column selection and, when
+    a new version is published, reads only the part files added since then.
+
+    Commits that append rows add part files, so the old frame plus the new
+    parts is the new version. A rebuilt store replaces files, which is
+    detected and answered with a full read.
+    """
+
+    def __init__(self, dataset_dir: Path, max_entries=16):
+        self.dataset_dir = Path(dataset_dir)
+        self.max_entries = max_entries
+        self._entries = OrderedDict()   # (filters, columns) -> (paths, frame)
+        self._lock = threading.Lock()
+
+    def read(self, manifest: dict, filters: dict = None, columns=None):
+        """Frame for `manifest`; treat it as read-only, it is shared."""
+        key = (tuple(sorted((filters or {}).items())), tuple(columns) if columns else None)
+        paths = {entry["path"] for entry in manifest["files"]}
+
+        with self._lock:
+            cached = self._entries.get(key)
+
+        if cached is not None and cached[0] == paths:
+            frame = cached[1]
+        elif cached is not None and cached[0] <= paths:
+            new_files = [entry for entry in manifest["files"] if entry["path"] not in cached[0]]
+            added = read_partitions(self.dataset_dir, {"files": new_files}, filters, columns)
+            frame = pd.concat([cached[1], added], ignore_index=True)
+            print(f"📎 Loaded {len(added)} new rows from {len(new_files)} part file(s)")
+        else:
+            frame = read_partitions(self.dataset_dir, manifest, filters, columns)
+
+        with self._lock:
+            self._entries[key] = (paths, frame)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+        return frame
+
+
+def filter_frame(df: pd.DataFrame, filters: dict = None):
+    """Same filters as read_partitions, applied to an in-memory frame."""
+    for col, value in (filters or {}).items():
+        df = df[df[col].astype(str) == value]
+    return df
+
+
+# =================================================
+# COMPACT IN-MEMORY SCHEMA
+# =================================================
+# The stored copies keep strings and float64 (one schema for every writer).
+# The frame the dashboard holds is compacted after loading: dimensions
+# become categoricals, counts the smallest nullable int that holds them
+# and percentages float32.
+
+INT_DTYPES = ["Int8", "Int16", "Int32", "Int64"]
+
+
+def _smallest_int(values: pd.Series):
+    """Smallest nullable int dtype for `values`, or None if any value is fractional."""
+    known = values.dropna()
+    if len(known) and not (known % 1 == 0).all():
+        return None
+    low, high = (known.min(), known.max()) if len(known) else (0, 0)
+    for dtype in INT_DTYPES:
+        limits = np.iinfo(dtype.lower())
+        if limits.min <= low and high <= limits.max:
+            return dtype
+    return None
+
+
+def compact_master(df: pd.DataFrame):
+    """
+    The master frame with categorical dimensions, nullable small-int counts
+    and float32 percentages. Count columns holding fractions stay float64.
+    The bytes before/after are kept in attrs["compact_schema"].
+    """
+    before = int(df.memory_usage(deep=True).sum())
+    columns = {}
+    for col in df.columns:
+        if col in DIMENSION_COLS:
+            columns[col] = df[col].astype("category")
+        elif col in PERCENT_COLS:
+            columns[col] = df[col].astype("float32")
+        elif col in COUNT_COLS:
+            dtype = _smallest_int(df[col])
+            columns[col] = df[col] if dtype is None else df[col].astype(dtype)
+    compact = df.assign(**columns)
+    after = int(compact.memory_usage(deep=True).sum())
+
+    compact.attrs["compact_schema"] = (before, after)
+    saved = 1 - after / before if before else 0
+    print(f"🗜 Compact schema: {before / 1024 ** 2:.1f} MB -> {after / 1024 ** 2:.1f} MB ({saved:.0%} saved)")
+    return compact
@@ -0,0 +1,73 @@
+# utils/dqi_sweep.py
+import numpy as np
+import pandas as pd
+
+# =================================================
+# DQI THRESHOLD SWEEP
+# =================================================
+# The sidebar thresholds are integers 0-100. Sorting the mean DQI of every
+# country/site/patient once gives a cumulative histogram over those
+# thresholds, so "how many are below X" is an array lookup and the map
+# banding is three slice assignments on the sorted order.
+
+THRESHOLDS = np.arange(0, 101)
+SWEEP_LEVELS = {"country": "Countries", "site_id": "Sites", "patient_id": "Patients"}
+
+
+class DQISweep:
+    """
+    Mean DQI per entity (country, site or patient) in ascending order, with
+    the number of entities below each integer threshold precomputed.
+
+    Entities without a DQI are never counted below or above a threshold;
+    like dqi_band, they are banded "Critical".
+    """
+
+    def __init__(self, dqi: pd.Series):
+        dqi = dqi.astype(float)
+        known = dqi.dropna().sort_values(kind="stable")
+        self.missing = dqi.index[dqi.isna()]
+        self.entities = known.index
+        self.values = known.to_numpy()
+        self.below = np.searchsorted(self.values, THRESHOLDS, side="left")
+
+    def __len__(self):
+        return len(self.values)
+
+    def count_below(self, threshold):
+        """Entities with mean DQI < threshold; O(1) for the slider's integer values."""
+        if float(threshold).is_integer() and 0 <= threshold <= 100:
+            return int(self.below[int(threshold)])
+        return int(np.searchsorted(self.values, threshold, side="left"))
+
+    def count_at_least(self, threshold):
+        """Entities with mean DQI >= threshold."""
+        return len(self) - self.count_below(threshold)
+
+    def bands(self, critical_threshold, high_perf_threshold, name="avg_dqi"):
+        """
+        One row per entity: its mean DQI and "DQI Level", the same bands as
+        scoring.dqi_band, filled from the cumulative counts instead of
+        comparing every value.
+        """
+        levels = np.full(len(self), "Critical", dtype=object)
+        levels[self.count_below(critical_threshold):] = "Average"
+        # Assigned last so a high threshold below the critical one still wins
+        levels[self.count_below(high_perf_threshold):] = "High Performing"
+
+        index = self.missing.append(self.entities)
+        return pd.DataFrame({
+            name: np.concatenate([np.full(len(self.missing), np.nan), self.values]),
+            "DQI Level": np.concatenate([np.full(len(self.missing), "Critical", dtype=object), levels]),
+        }, index=index)
+
+
+def build_sweeps(country_dqi: pd.Series, site_dqi: pd.Series, patient_dqi: pd.Series):
+    """{level: DQISweep} for the country, site and patient means of one scope."""
+    sweeps = {
+        "country": DQISweep(country_dqi),
+        "site_id": DQISweep(site_dqi),
+        "patient_id": DQISweep(patient_dqi),
+    }
+    print("📐 DQI sweeps built: " + ", ".join(f"{len(s):,} {SWEEP_LEVELS[level].lower()}" for level, s in sweeps.items()))
+    return sweeps
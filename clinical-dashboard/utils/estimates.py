@@ -0,0 +1,106 @@
+# utils/estimates.py
+import numpy as np
+import pandas as pd
+
+# =================================================
+# STRATIFIED SAMPLE ESTIMATES
+# =================================================
+# On a cold start the first paint comes from a few rows per site. Every
+# site (its region/country/site path, as site IDs repeat across countries)
+# is a stratum, so small sites are represented as well as large ones;
+# means are weighted by each site's share of the rows and come with a 95%
+# interval half-width (normal approximation, finite-population corrected).
+
+SAMPLE_PER_SITE = 10
+SITE_PATH = ["region", "country", "site_id"]
+STRATUM = "stratum"
+Z_95 = 1.96
+
+
+def stratified_sample(df: pd.DataFrame, strata="site_id", per_stratum=SAMPLE_PER_SITE, seed=0):
+    """
+    (sample, sizes): up to `per_stratum` random rows of every stratum, in
+    the original row order, and the number of rows per stratum in `df`.
+    """
+    order = np.random.default_rng(seed).permutation(len(df))
+    shuffled = df[strata].iloc[order]
+    rank = shuffled.groupby(shuffled, sort=False, dropna=False, observed=True).cumcount().to_numpy()
+    keep = np.sort(order[rank < per_stratum])
+    sizes = df[strata].value_counts(dropna=False)
+    return df.iloc[keep], sizes
+
+
+def site_sample(df: pd.DataFrame, per_site=SAMPLE_PER_SITE, seed=0):
+    """
+    stratified_sample of a master frame by site path, with the stratum and
+    its row and patient counts attached (stratum, site_rows, site_patients),
+    so the sample can be stored and later filtered to any region/country/site
+    on its own.
+    """
+    df = df.assign(**{STRATUM: df.groupby(SITE_PATH, sort=False, dropna=False, observed=True).ngroup()})
+    sample, sizes = stratified_sample(df, STRATUM, per_site, seed)
+    patients = df.groupby(STRATUM, sort=False)["patient_id"].nunique()
+    return sample.assign(
+        site_rows=sizes.reindex(sample[STRATUM]).to_numpy(),
+        site_patients=patients.reindex(sample[STRATUM]).to_numpy(),
+    )
+
+
+def sample_sizes(sample: pd.DataFrame):
+    """
+    (rows per stratum, patients) of the strata in a site_sample. Patients
+    are summed per stratum, so a patient_id found under more than one site
+    path is counted once per path: an upper bound on the distinct count.
+    """
+    per_stratum = sample.groupby(STRATUM, sort=False)[["site_rows", "site_patients"]].first()
+    return per_stratum["site_rows"], int(per_stratum["site_patients"].sum())
+
+
+def _stratum_stats(sample, values, sizes, strata, by=None):
+    keys = [sample[by], sample[strata]] if by else [sample[strata]]
+    grouped = values.groupby(keys, sort=False, dropna=False, observed=True)
+    stats = pd.DataFrame({"mean": grouped.mean(), "var": grouped.var(ddof=1), "n": grouped.count()})
+    stats["N"] = sizes.reindex(stats.index.get_level_values(-1)).to_numpy()
+    return stats[stats["n"] > 0]
+
+
+def _combine(stats):
+    """(estimate, margin) from per-stratum mean/var/n/N; NaN if no stratum has data."""
+    if stats.empty:
+        return np.nan, np.nan
+    weight = stats["N"] / stats["N"].sum()
+    fpc = (1 - stats["n"] / stats["N"]).clip(lower=0)
+    variance = (weight ** 2 * fpc * stats["var"].fillna(0) / stats["n"]).sum()
+    return float((weight * stats["mean"]).sum()), float(Z_95 * np.sqrt(variance))
+
+
+def stratified_mean(sample: pd.DataFrame, column, sizes: pd.Series, strata=STRATUM, by=None):
+    """
+    Estimated mean of `column` over the whole population and its 95%
+    margin, as (estimate, margin). With `by` (a column the strata nest in,
+    e.g. country), one row per value: columns estimate and margin.
+    """
+    values = sample[column].astype("float64")
+    stats = _stratum_stats(sample, values, sizes, strata, by)
+    if by is None:
+        return _combine(stats)
+
+    rows = {key: _combine(group) for key, group in stats.groupby(level=0, sort=False, dropna=False, observed=True)}
+    return pd.DataFrame.from_dict(rows, orient="index", columns=["estimate", "margin"]).rename_axis(by)
+
+
+def stratified_ratio(sample: pd.DataFrame, numerator, denominator, sizes: pd.Series, strata=STRATUM):
+    """
+    Estimated ratio of two column totals (sum(numerator) / sum(denominator))
+    and its 95% margin, linearized around the estimate.
+    """
+    num = sample[numerator].astype("float64").fillna(0)
+    den = sample[denominator].astype("float64").fillna(0)
+    num_mean, _ = _combine(_stratum_stats(sample, num, sizes, strata))
+    den_mean, _ = _combine(_stratum_stats(sample, den, sizes, strata))
+    if not den_mean > 0:
+        return np.nan, np.nan
+
+    ratio = num_mean / den_mean
+    _, residual_margin = _combine(_stratum_stats(sample, num - ratio * den, sizes, strata))
+    return ratio, residual_margin / den_mean
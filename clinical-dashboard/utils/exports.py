@@ -0,0 +1,105 @@
+# utils/exports.py
+import io
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:     # parquet exports unavailable
+    pa = None
+    pq = None
+
+# =================================================
+# LAZY EXPORTS
+# =================================================
+# Exports are only generated when a download button is clicked (Streamlit
+# calls the button's data callable) and written in row chunks straight
+# from the cached frame, so nothing is serialized on ordinary reruns.
+
+EXPORT_FORMATS = {      # format -> (mime type, file extension)
+    "csv": ("text/csv", ".csv"),
+    "parquet": ("application/vnd.apache.parquet", ".parquet"),
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", ".xlsx"),
+}
+CHUNK_ROWS = 50_000
+XLSX_MAX_ROWS = 1_048_575    # Excel sheet limit minus the header row
+
+
+def _chunks(df: pd.DataFrame, chunk_rows=CHUNK_ROWS):
+    for start in range(0, max(len(df), 1), chunk_rows):
+        yield start, df.iloc[start:start + chunk_rows]
+
+
+def _write_csv(df, buffer):
+    for start, chunk in _chunks(df):
+        chunk.to_csv(buffer, mode="wb", header=start == 0, index=False, encoding="utf-8")
+
+
+def _write_parquet(df, buffer):
+    if pq is None:
+        raise ImportError("pyarrow is required for Parquet exports")
+    writer = None
+    try:
+        for _, chunk in _chunks(df):
+            table = pa.Table.from_pandas(chunk, preserve_index=False)
+            if writer is None:
+                writer = pq.ParquetWriter(buffer, table.schema)
+            writer.write_table(table.cast(writer.schema))
+    finally:
+        if writer is not None:
+            writer.close()
+
+
+def _write_xlsx(df, buffer):
+    if len(df) > XLSX_MAX_ROWS:
+        raise ValueError(f"{len(df):,} rows do not fit in one Excel sheet; use CSV or Parquet")
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        for start, chunk in _chunks(df):
+            chunk.to_excel(
+                writer, index=False, header=start == 0,
+                startrow=start + 1 if start else 0
+            )
+
+
+_WRITERS = {"csv": _write_csv, "parquet": _write_parquet, "xlsx": _write_xlsx}
+
+
+def export_bytes(df: pd.DataFrame, fmt: str):
+    """`df` serialized as `fmt` ("csv", "parquet" or "xlsx"), written in row chunks."""
+    buffer = io.BytesIO()
+    _WRITERS[fmt](df, buffer)
+    return buffer.getvalue()
+
+
+class ExportCache:
+    """
+    Generated export files keyed by (data version, filter state, export, format).
+
+    Files can be large, so only a few are kept; the least recently
+    downloaded is dropped first.
+    """
+
+    def __init__(self, max_entries=8):
+        self.max_entries = max_entries
+        self._files = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, build):
+        """Bytes for `key`, calling `build()` only when they are not cached."""
+        with self._lock:
+            data = self._files.get(key)
+            if data is not None:
+                self._files.move_to_end(key)
+                return data
+
+        data = build()
+        with self._lock:
+            self._files[key] = data
+            self._files.move_to_end(key)
+            while len(self._files) > self.max_entries:
+                self._files.popitem(last=False)
+        print(f"📦 Generated export {key[-2:]} ({len(data) / 1024:.0f} KB)")
+        return data
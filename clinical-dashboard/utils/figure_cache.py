@@ -0,0 +1,49 @@
+# utils/figure_cache.py
+import threading
+from collections import OrderedDict
+
+# =================================================
+# FIGURE CACHE
+# =================================================
+
+
+class FigureCache:
+    """
+    Built Plotly figures keyed by whatever determines them, typically
+    (data version, figure id, filter/threshold values).
+
+    A miss calls the builder once and keeps the figure; a hit returns the
+    same object, skipping the data preparation, Plotly Express and figure
+    validation entirely. Figures are shared between sessions: pass them to
+    st.plotly_chart (which only serializes them), never modify them.
+    Least recently used entries are evicted past `max_entries`.
+    """
+
+    def __init__(self, max_entries=128):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._figures = OrderedDict()   # key -> go.Figure
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._figures)
+
+    def get(self, key, build):
+        """Figure for `key`, calling `build()` only when it is not cached."""
+        with self._lock:
+            figure = self._figures.get(key)
+            if figure is not None:
+                self._figures.move_to_end(key)
+                self.hits += 1
+
+        if figure is None:
+            figure = build()
+            with self._lock:
+                self.misses += 1
+                self._figures[key] = figure
+                self._figures.move_to_end(key)
+                while len(self._figures) > self.max_entries:
+                    self._figures.popitem(last=False)
+
+        return figure
@@ -0,0 +1,189 @@
+# utils/filter_index.py
+import bisect
+import itertools
+
+import numpy as np
+import pandas as pd
+
+# =================================================
+# SIDEBAR FILTER INDEX
+# =================================================
+
+FILTER_DIMENSIONS = ["region", "country", "site_id", "patient_id"]
+_NO_ROWS = np.array([], dtype=np.intp)
+
+
+def sort_for_filtering(df: pd.DataFrame):
+    """
+    Order rows by region, country, site and patient so every sidebar
+    selection covers one contiguous block of rows.
+    """
+    return df.sort_values(FILTER_DIMENSIONS, kind="stable", ignore_index=True)
+
+
+class FilterIndex:
+    """
+    Inverted index over the sidebar dimensions of one frame: for each
+    column, value -> sorted array of row positions.
+
+    Build it once per data version; a filter change is then a few array
+    intersections instead of boolean scans over the whole frame.
+    """
+
+    def __init__(self, df: pd.DataFrame, columns=FILTER_DIMENSIONS):
+        self.n_rows = len(df)
+        self.positions = {}
+
+        for col in columns:
+            codes, values = pd.factorize(df[col])          # missing -> -1
+            order = np.argsort(codes, kind="stable")
+            bounds = np.searchsorted(codes[order], np.arange(len(values) + 1))
+            self.positions[col] = {
+                value: order[bounds[i]:bounds[i + 1]]
+                for i, value in enumerate(values)
+            }
+
+    def lookup(self, selections: dict):
+        """Row positions matching every selection, or None for "all rows"."""
+        result = None
+        for col, value in selections.items():
+            if value is None or value == "All":
+                continue
+            rows = self.positions[col].get(value, _NO_ROWS)
+            result = rows if result is None else np.intersect1d(result, rows, assume_unique=True)
+        return result
+
+    def apply(self, df: pd.DataFrame, selections: dict):
+        """
+        Rows of `df` (the frame the index was built on) matching `selections`.
+        A contiguous match is returned as a positional slice, which pandas
+        serves as a view rather than a copy.
+        """
+        positions = self.lookup(selections)
+        if positions is None:
+            return df
+        if len(positions) == 0:
+            return df.iloc[:0]
+        if positions[-1] - positions[0] + 1 == len(positions):
+            return df.iloc[positions[0]:positions[-1] + 1]
+        return df.iloc[positions]
+
+
+# =================================================
+# CASCADING OPTIONS
+# =================================================
+
+class FilterHierarchy:
+    """
+    Region -> country -> site -> patient tree for the sidebar.
+
+    For every combination of parent selections (a value or "All" at each
+    level) it stores the sorted values of the next level, so building the
+    options for a selectbox is a dict lookup and only valid combinations
+    are ever offered.
+    """
+
+    def __init__(self, df: pd.DataFrame, columns=FILTER_DIMENSIONS):
+        self.columns = list(columns)
+        self._children = {}
+        paths = df[self.columns].drop_duplicates()
+
+        for level, col in enumerate(self.columns):
+            parents = self.columns[:level]
+            for kept in itertools.product([True, False], repeat=level):
+                keep_cols = [parent for parent, keep in zip(parents, kept) if keep]
+                rows = paths.dropna(subset=keep_cols + [col])
+
+                if not keep_cols:
+                    self._children[("All",) * level] = sorted(rows[col].unique())
+                    continue
+
+                for key, values in rows.groupby(keep_cols, sort=False, observed=True)[col]:
+                    key = iter(key if isinstance(key, tuple) else (key,))
+                    path = tuple(next(key) if keep else "All" for keep in kept)
+                    self._children[path] = sorted(values.unique())
+
+    def options(self, *parents):
+        """Sorted values one level below `parents` (e.g. options("EMEA") -> countries)."""
+        return self._children.get(tuple(parents), [])
+
+
+# =================================================
+# PATIENT SEARCH
+# =================================================
+
+class PatientSearch:
+    """
+    Case-insensitive prefix and substring search over one scope's patient IDs.
+
+    Prefix matches come from a binary search over the sorted IDs, substring
+    matches from a trigram index, so a lookup touches only the candidates
+    instead of every ID. Results are paged; the sidebar only ever receives
+    one page.
+    """
+
+    def __init__(self, values):
+        self.values = sorted(values, key=lambda v: str(v).lower())
+        self._keys = [str(v).lower() for v in self.values]
+        self._members = set(self.values)
+
+        postings = {}
+        for pos, key in enumerate(self._keys):
+            for gram in {key[i:i + 3] for i in range(len(key) - 2)}:
+                postings.setdefault(gram, []).append(pos)
+        self._grams = {gram: np.array(rows, dtype=np.int32) for gram, rows in postings.items()}
+
+    def __len__(self):
+        return len(self.values)
+
+    def __contains__(self, value):
+        return value in self._members
+
+    def _prefix_matches(self, query):
+        start = bisect.bisect_left(self._keys, query)
+        pos = start
+        while pos < len(self._keys) and self._keys[pos].startswith(query):
+            yield pos
+            pos += 1
+
+    def _substring_candidates(self, query):
+        if len(query) < 3:
+            return range(len(self._keys))
+        rows = None
+        for i in range(len(query) - 2):
+            gram_rows = self._grams.get(query[i:i + 3])
+            if gram_rows is None:
+                return []
+            rows = gram_rows if rows is None else np.intersect1d(rows, gram_rows, assume_unique=True)
+        return rows
+
+    def search(self, query="", limit=50, offset=0):
+        """
+        One page of matches, prefix matches first.
+        Returns (values, has_more).
+        """
+        query = (query or "").strip().lower()
+        wanted = offset + limit + 1     # one extra to know whether there is a next page
+
+        if not query:
+            page = self.values[offset:offset + limit]
+            return page, offset + limit < len(self.values)
+
+        matches = []
+        seen = set()
+        for pos in self._prefix_matches(query):
+            matches.append(pos)
+            seen.add(pos)
+            if len(matches) >= wanted:
+                break
+
+        if len(matches) < wanted:
+            for pos in self._substring_candidates(query):
+                pos = int(pos)
+                if pos not in seen and query in self._keys[pos]:
+                    matches.append(pos)
+                    if len(matches) >= wanted:
+                        break
+
+        page = [self.values[pos] for pos in matches[offset:offset + limit]]
+        return page, len(matches) > offset + limit
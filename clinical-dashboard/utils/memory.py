@@ -0,0 +1,134 @@
+# utils/memory.py
+import numpy as np
+import pandas as pd
+
+try:
+    import resource     # peak RSS, Unix only
+except ImportError:
+    resource = None
+
+# =================================================
+# SHARED READ-ONLY DATA
+# =================================================
+# The analytical frame is held once per process and handed to every
+# session. Copy-on-write makes every derived frame (filters, assign, column
+# writes) copy only what it changes; marking the shared buffers read-only
+# turns an accidental in-place write into an error instead of a change
+# every other session would see.
+
+
+def enable_copy_on_write():
+    """Copy-on-write is always on from pandas 3; switch it on for pandas 2."""
+    if int(pd.__version__.split(".")[0]) < 3:
+        pd.set_option("mode.copy_on_write", True)
+
+
+def read_only(df: pd.DataFrame):
+    """
+    The same frame with its numpy columns on read-only buffers. Extension
+    columns (strings, nullable ints, categoricals) are kept as they are.
+    """
+    columns = {}
+    for col in df.columns:
+        values = df[col]
+        if isinstance(values.dtype, np.dtype):
+            array = values.to_numpy(copy=True)
+            array.flags.writeable = False
+            columns[col] = array
+        else:
+            columns[col] = values.array
+    frozen = pd.DataFrame(columns, index=df.index, copy=False)
+    frozen.attrs = dict(df.attrs)
+    return frozen
+
+
+# =================================================
+# MEMORY REPORT
+# =================================================
+
+def _root(array):
+    while isinstance(getattr(array, "base", None), np.ndarray):
+        array = array.base
+    return array
+
+
+def _buffers(values: pd.Series):
+    """
+    The numpy arrays behind a column, data first: the array itself, a
+    categorical's codes, or a nullable column's values and mask. Empty for
+    other extension columns (strings).
+    """
+    if isinstance(values.dtype, np.dtype):
+        return [values.to_numpy()]
+    if isinstance(values.dtype, pd.CategoricalDtype):
+        return [values.array.codes]
+    array = values.array
+    if isinstance(getattr(array, "_data", None), np.ndarray) and isinstance(getattr(array, "_mask", None), np.ndarray):
+        return [array._data, array._mask]
+    return []
+
+
+def shared_buffers(*frames):
+    """ids of the numpy buffers behind the given (shared) frames."""
+    ids = set()
+    for df in frames:
+        if isinstance(df, pd.DataFrame):
+            for col in df.columns:
+                buffers = _buffers(df[col])
+                if buffers:
+                    ids.add(id(_root(buffers[0])))
+    return ids
+
+
+def owned_bytes(obj, shared_ids=frozenset()):
+    """
+    Bytes held by `obj` (a frame, array, or a dict/list/tuple of them) that
+    are not views of the shared buffers. String columns are counted in
+    full, so views of them are overestimated.
+    """
+    if isinstance(obj, pd.DataFrame):
+        total = int(obj.index.memory_usage(deep=True))
+        for col in obj.columns:
+            buffers = _buffers(obj[col])
+            if not buffers:
+                total += int(obj[col].memory_usage(deep=True, index=False))
+            elif id(_root(buffers[0])) not in shared_ids:
+                total += sum(buffer.nbytes for buffer in buffers)
+        return total
+    if isinstance(obj, pd.Series):
+        return owned_bytes(obj.to_frame(), shared_ids)
+    if isinstance(obj, np.ndarray):
+        return 0 if id(_root(obj)) in shared_ids else obj.nbytes
+    if isinstance(obj, dict):
+        return sum(owned_bytes(value, shared_ids) for value in obj.values())
+    if isinstance(obj, (list, tuple)):
+        return sum(owned_bytes(value, shared_ids) for value in obj)
+    if hasattr(obj, "df"):      # PagedTable and similar wrappers
+        return owned_bytes(obj.df, shared_ids)
+    return 0
+
+
+def peak_rss_mb():
+    """Peak resident memory of this process in MB, or None if unknown."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def memory_report(shared: dict, session: dict):
+    """
+    One row per object: MB held, and whether it is shared by the process
+    or owned by this session (views of the shared frames count as 0).
+    """
+    shared_ids = shared_buffers(*shared.values())
+    rows = [
+        {"Object": name, "Scope": "shared (once per process)",
+         "MB": owned_bytes(obj) / 1024 ** 2}
+        for name, obj in shared.items()
+    ]
+    rows += [
+        {"Object": name, "Scope": "this session",
+         "MB": owned_bytes(obj, shared_ids) / 1024 ** 2}
+        for name, obj in session.items()
+    ]
+    return pd.DataFrame(rows).round(2)
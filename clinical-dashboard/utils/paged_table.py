@@ -0,0 +1,132 @@
+# utils/paged_table.py
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+# =================================================
+# SERVER-SIDE PAGED TABLES
+# =================================================
+# The full frame stays in the Python process; the browser only ever gets
+# the page being looked at. Sort orders are computed once per column and
+# direction and reused for every page.
+
+PAGE_SIZES = [25, 50, 100, 250]
+
+
+class PagedTable:
+    """
+    A frame served one page at a time, optionally sorted and filtered.
+
+    Sort permutations (row positions in sorted order) are cached per
+    (columns, ascending), so paging through a sorted table or switching
+    back to an earlier sort is a slice, not a new sort.
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        self.df = df
+        self._orders = {}
+        self._last_filter = (None, None)
+
+    def __len__(self):
+        return len(self.df)
+
+    def order(self, columns, ascending=True):
+        """Row positions of the frame sorted by `columns` (missing values last)."""
+        columns = [columns] if isinstance(columns, str) else list(columns)
+        if isinstance(ascending, bool):
+            ascending = [ascending] * len(columns)
+        key = (tuple(columns), tuple(ascending))
+
+        if key not in self._orders:
+            keys = self.df[columns].reset_index(drop=True)
+            self._orders[key] = keys.sort_values(
+                columns, ascending=ascending, kind="stable", na_position="last"
+            ).index.to_numpy()
+        return self._orders[key]
+
+    def matches(self, column, text):
+        """Boolean mask of rows whose `column` contains `text` (case-insensitive)."""
+        if self._last_filter[0] != (column, text):
+            values = self.df[column].astype("string")
+            mask = values.str.contains(text, case=False, regex=False, na=False).to_numpy(dtype=bool)
+            self._last_filter = ((column, text), mask)
+        return self._last_filter[1]
+
+    def positions(self, sort_by=None, ascending=True, filter_column=None, filter_text=""):
+        """Row positions in display order for a sort and an optional text filter."""
+        if sort_by:
+            positions = self.order(sort_by, ascending)
+        else:
+            positions = np.arange(len(self.df))
+
+        if filter_column and filter_text:
+            positions = positions[self.matches(filter_column, filter_text)[positions]]
+        return positions
+
+    def page(self, positions, page=1, page_size=50):
+        """Rows of one page of `positions`."""
+        start = (page - 1) * page_size
+        return self.df.iloc[positions[start:start + page_size]]
+
+
+def paged_table(df: pd.DataFrame, key: str, token=None):
+    """
+    The session's PagedTable for `key`, rebuilt when `token` (anything that
+    identifies the frame's contents, e.g. a data version or archive hash)
+    changes. Without a token the frame's identity is used.
+    """
+    token = id(df) if token is None else token
+    state_key = f"{key}_paged_table"
+    cached = st.session_state.get(state_key)
+    if cached is None or cached[0] != token:
+        cached = (token, PagedTable(df))
+        st.session_state[state_key] = cached
+    return cached[1]
+
+
+def paged_dataframe(df: pd.DataFrame, key: str, token=None, default_sort=None,
+                    default_ascending=True, page_size=50, style=None, **dataframe_kwargs):
+    """
+    st.dataframe for large frames: sort, filter and page controls above a
+    single page of rows. `style(page_df)` may return a Styler for the page.
+    Extra keyword arguments go to st.dataframe.
+    """
+    table = paged_table(df, key, token)
+    columns = list(df.columns)
+    sort_options = ["(none)"] + columns
+
+    col1, col2, col3, col4, col5 = st.columns([2, 1, 2, 2, 1])
+    sort_by = col1.selectbox(
+        "Sort by", sort_options,
+        index=sort_options.index(default_sort) if default_sort in columns else 0,
+        key=f"{key}_sort"
+    )
+    ascending = col2.selectbox(
+        "Order", ["Ascending", "Descending"],
+        index=0 if default_ascending else 1,
+        key=f"{key}_order"
+    ) == "Ascending"
+    filter_column = col3.selectbox("Filter column", columns, key=f"{key}_filter_column")
+    filter_text = col4.text_input("Contains", key=f"{key}_filter_text")
+    page_size = col5.selectbox(
+        "Rows", PAGE_SIZES,
+        index=PAGE_SIZES.index(page_size) if page_size in PAGE_SIZES else 1,
+        key=f"{key}_page_size"
+    )
+
+    positions = table.positions(
+        None if sort_by == "(none)" else sort_by, ascending, filter_column, filter_text.strip()
+    )
+    n_pages = max(1, -(-len(positions) // page_size))
+    page_key = f"{key}_page"
+    if st.session_state.get(page_key, 1) > n_pages:
+        st.session_state[page_key] = n_pages
+    page = st.number_input("Page", min_value=1, max_value=n_pages, step=1, key=page_key)
+
+    rows = table.page(positions, page, page_size)
+    first = (page - 1) * page_size
+
+    st.dataframe(style(rows) if style else rows, **dataframe_kwargs)
+    st.caption(f"Rows {min(first + 1, len(positions)):,}–{first + len(rows):,} "
+               f"of {len(positions):,} (page {page} of {n_pages})")
+    return rows
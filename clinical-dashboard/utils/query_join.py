@@ -0,0 +1,61 @@
+# utils/query_join.py
+import pandas as pd
+
+# =================================================
+# QUERIES -> SITES
+# =================================================
+# queries.csv only has a subject name. Joining it to the master's
+# patient_id places every subject's open/closed queries at the patient's
+# region, country and site, so query metrics can be aggregated per site
+# instead of being spread evenly across sites.
+
+LINK_KEYS = ["region", "country", "site_id", "patient_id"]
+
+
+def subject_key(values: pd.Series):
+    """Normalised subject identifier: "Subject 12", "SUBJ-12" and "12" all become "12"."""
+    key = values.astype("string").str.strip().str.lower()
+    key = key.str.replace(r"^subj(?:ect)?[\s_\-#:]*", "", regex=True)
+    return key.str.replace(r"\s+", " ", regex=True)
+
+
+def link_queries(master_df: pd.DataFrame, queries_df: pd.DataFrame):
+    """
+    One row per (queries.csv subject, matching master patient) with the
+    patient's region/country/site and a `weight`. A subject that matches
+    patients at several sites (same ID in different studies) is split
+    evenly between them, so totals are preserved. Returns None when there
+    is nothing to join.
+    """
+    if queries_df is None or "subject_name" not in queries_df.columns:
+        return None
+
+    patients = master_df[LINK_KEYS].dropna(subset=["patient_id"]).drop_duplicates()
+    patients = patients.assign(subject_key=subject_key(patients["patient_id"]))
+    matches = patients["subject_key"].value_counts()
+
+    subjects = queries_df.assign(subject_key=subject_key(queries_df["subject_name"]))
+    links = subjects.merge(patients, on="subject_key", how="inner")
+    links["weight"] = 1.0 / links["subject_key"].map(matches)
+
+    linked = links["subject_key"].nunique()
+    ambiguous = int((matches[matches.index.isin(links["subject_key"])] > 1).sum())
+    print(f"🔗 Linked {linked} of {len(subjects)} query subjects to master patients ({ambiguous} ambiguous)")
+
+    return links.drop(columns="subject_key")
+
+
+def queries_in_scope(query_links: pd.DataFrame, selections: dict):
+    """
+    queries.csv rows for the subjects under a region/country/site/patient
+    selection, with the split subjects' counts weighted.
+    """
+    links = query_links
+    for col, value in selections.items():
+        if value is not None and value != "All":
+            links = links[links[col] == value]
+
+    return links.assign(
+        open_queries=links["open_queries"] * links["weight"],
+        closed_queries=links["closed_queries"] * links["weight"],
+    )
@@ -0,0 +1,98 @@
+# utils/scoring.py
+import numpy as np
+import pandas as pd
+
+# =================================================
+# SITE SCORING
+# =================================================
+# Every function takes whole columns (Series / arrays) and returns arrays,
+# so scoring thousands of sites is a handful of numpy calls instead of a
+# Python function per row. Missing values never add points.
+
+DQI_CRITICAL = 40       # below: critical
+DQI_WARNING = 60        # below: needs attention
+
+# column -> (band edges, points per band, higher_is_worse)
+PRIORITY_RULES = {
+    "dqi": ([20, 40, 60], [40, 30, 20, 0], False),
+    "clean_patient_pct": ([20, 50, 80], [30, 20, 10, 0], False),
+    "open_queries": ([2, 5, 10], [0, 10, 15, 20], True),
+    "missing_visits": ([20], [0, 10], True),
+    "avg_resolution_days": ([10, 20], [0, 10, 15], True),
+}
+
+PRIORITY_LEVELS = [     # (minimum score, label, badge colour), highest first
+    (60, "🔴 Critical", "#feb2b2"),
+    (40, "🟠 High", "#fbd38d"),
+    (20, "🟡 Medium", "#fefcbf"),
+    (0, "🟢 Low", "#c6f6d5"),
+]
+
+
+def _values(values):
+    return np.asarray(values, dtype="float64")
+
+
+def _banded_points(values, edges, points, higher_is_worse):
+    values = _values(values)
+    # Lower-is-worse bands are [edge, next) ; higher-is-worse bands are (edge, next]
+    band = np.digitize(values, edges, right=higher_is_worse)
+    return np.where(np.isnan(values), 0, np.asarray(points)[band])
+
+
+def priority_scores(sites: pd.DataFrame, rules=PRIORITY_RULES):
+    """Priority score per site from the columns named in `rules`."""
+    score = np.zeros(len(sites), dtype="int64")
+    for col, (edges, points, higher_is_worse) in rules.items():
+        if col in sites.columns:
+            score += _banded_points(sites[col], edges, points, higher_is_worse).astype("int64")
+    return score
+
+
+def priority_levels(scores, levels=PRIORITY_LEVELS):
+    """(labels, colours) arrays for priority scores."""
+    scores = _values(scores)
+    conditions = [scores >= minimum for minimum, _, _ in levels[:-1]]
+    labels = np.select(conditions, [label for _, label, _ in levels[:-1]], default=levels[-1][1])
+    colors = np.select(conditions, [color for _, _, color in levels[:-1]], default=levels[-1][2])
+    return labels, colors
+
+
+def dqi_status(dqi, critical=DQI_CRITICAL, warning=DQI_WARNING):
+    """(labels, colours) arrays: Critical below `critical`, Warning below `warning`."""
+    dqi = _values(dqi)
+    conditions = [dqi < critical, dqi < warning]
+    labels = np.select(conditions, ["🔴 Critical", "🟠 Warning"], default="🟢 Good")
+    colors = np.select(conditions, ["#e53e3e", "#d69e2e"], default="#38a169")
+    return labels, colors
+
+
+def dqi_band(dqi, critical_threshold=DQI_CRITICAL, high_perf_threshold=DQI_WARNING):
+    """Map/KPI band per value, driven by the sidebar threshold sliders."""
+    dqi = _values(dqi)
+    return np.select(
+        [dqi >= high_perf_threshold, dqi >= critical_threshold],
+        ["High Performing", "Average"],
+        default="Critical"
+    )
+
+
+def site_observation(avg_dqi, total_subjects, screen_failures=None,
+                     critical=DQI_CRITICAL, warning=DQI_WARNING):
+    """One-line status per site for the AI tab's performance summary."""
+    avg_dqi = _values(avg_dqi)
+    if screen_failures is None:
+        high_screen_failure = np.zeros(len(avg_dqi), dtype=bool)
+    else:
+        high_screen_failure = _values(screen_failures) > _values(total_subjects) / 2
+
+    return np.select(
+        [avg_dqi < critical, high_screen_failure, avg_dqi < warning],
+        ["🔴 Critical DQI Risk", "🟠 High Screen Failure Rate", "🟡 Needs Attention"],
+        default="🟢 Good Performance"
+    )
+
+
+def site_severity(avg_dqi, patients, dqi_target=DQI_WARNING):
+    """AI severity: distance below the DQI target plus a load term per patient."""
+    return (dqi_target - _values(avg_dqi)) + _values(patients) * 2